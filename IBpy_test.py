@@ -6,7 +6,11 @@ from ib.ext.Order import Order
 from ib.opt import Connection, message
 import time
 import datetime
-import csv
+
+from recorder import BarRecorder, ib_date_to_epoch
+
+# Recorder for the historical bars, opened in __main__
+recorder = None
 
 def error_handler(msg):
     """Handles the capturing of error messages"""
@@ -72,15 +76,14 @@ def create_order(order_type, quantity, action):
     return order
 
 def process_data(msg):
-    outfile = open('1weekemini.csv', 'a')
-    d_writer = csv.writer(outfile)
-    
     if msg.open != -1:
-        a_array = [msg.date, msg.open, msg.high, msg.low, msg.close, msg.volume, msg.count, msg.WAP]
-        d_writer.writerow(a_array)
+        recorder.record((ib_date_to_epoch(msg.date), msg.open, msg.high, 
+                         msg.low, msg.close, msg.volume, msg.count, msg.WAP))
         
     else:
-        print("not")
+        # IB marks the end of a historical data request with a 'finished'
+        # message whose prices are -1
+        recorder.flush()
 
 if __name__ == "__main__":
     # Connect to the Trader Workstation (TWS) running on the usual port of
@@ -101,6 +104,7 @@ if __name__ == "__main__":
    
     
     endtime = datetime.datetime.now().strftime('%Y%m%d %H:%M:%S')
+    recorder = BarRecorder('1weekemini.csv')
     
     
     tws_conn.reqHistoricalData(
@@ -118,4 +122,5 @@ if __name__ == "__main__":
     
 
     time.sleep(100)
-    tws_conn.disconnect()
\ No newline at end of file
+    tws_conn.disconnect()
+    recorder.close()
\ No newline at end of file
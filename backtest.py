@@ -8,65 +8,270 @@ import portfolio
 import datetime
 import execution
 import exposure
-from multiprocessing import Queue
-import queue
+import eventbus
+import logging
 import os
+import sys
+import instrumentation
+import performance
+import resultcache
+import risk
+import numpy as np
 
-start_date = datetime.datetime(2016, 8, 8, 9, 30, 0)
-initial_capital = 100000
-event_queue = Queue()
-csv_directory = "C:\\Users\\jonesdl6\\Desktop\\EminiBacktest"
-csv_filename = '1weekemini.csv'
-bars = data.EMiniCSVHandler(event_queue, 
-                            csv_filename)
-bars.update_bars()
-                                   
-
-                                       
-portfolio = portfolio.EMiniPortfolio(bars, 
-                                     event_queue, 
-                                     start_date, 
-                                     initial_capital)
-
-strategy = strategy.SMAtoEMA(bars, 
-                             event_queue)                                     
-broker = execution.SimulatedExecutionHandler(event_queue)
-
-while True:
-    
-    if bars.continue_backtest == True:
+from event import EventType
+
+# Settings used by run_backtest() for any key missing from its config
+DEFAULT_CONFIG = {'csv_filename': '1weekemini.csv',
+                  'start_date': datetime.datetime(2016, 8, 8, 9, 30, 0),
+                  'initial_capital': 100000,
+                  'strategy': strategy.SMAtoEMA,
+                  'strategy_params': {},
+                  'execution': execution.SimulatedExecutionHandler,
+                  'execution_params': {},
+                  # Keyword arguments of an ExposureManager checking every
+                  # order before it reaches the execution handler, or None
+                  # for no exposure limits.
+                  'exposure_params': None,
+                  # Limits passed to risk.create_risk_checks(), e.g.
+                  # {'max_position': 1, 'max_daily_loss': 2000}, or None.
+                  # Orders go straight to the execution handler when there
+                  # are neither risk nor exposure limits.
+                  'risk_params': None,
+                  # Time every handler and count events, adding an
+                  # Instrumentation summary to the results.
+                  'instrument': False,
+                  # Directory of the result cache, returning the stored
+                  # result of a backtest already run with the same data,
+                  # code and settings, or None to always run it.
+                  'result_cache': None,
+                  # Largest size in bytes of the result cache.
+                  'result_cache_size': 256*2**20,
+                  # Directory of the binary bar cache to memory-map the CSV
+                  # from, or None to parse the CSV directly.
+                  'cache_dir': None,
+                  # Rows per chunk to stream the CSV in, or None to load the
+                  # whole file before the first bar.
+                  'chunksize': None,
+                  # Pass events through a multiprocessing.Queue instead of
+                  # the in-process deque, e.g. when a component runs in
+                  # another process.
+                  'multiprocess_events': False}
+
+def register_handlers(events, strategy, portfolio, broker, risk_stage=None):
+    """
+    Wires each event type to the components that handle it. Shared by the
+    backtest loop and the live trading loop in live.py.
+
+    Parameters:
+    events - The EventBus shared by the components.
+    strategy - The Strategy object.
+    portfolio - The Portfolio object.
+    broker - The ExecutionHandler object.
+    risk_stage - Optional PreTradeRiskStage that checks orders before
+                 they reach the broker.
+    """
+
+    # The broker sees each new bar first, so orders resting from earlier
+    # bars fill before the strategy acts on it.
+    events.register(EventType.MARKET, broker.update)
+    events.register(EventType.MARKET, portfolio.update)
+    if risk_stage is not None:
+        events.register(EventType.MARKET, risk_stage.update)
+    def calculate_signals(event):
+        strategy.calculate_signals(event, portfolio)
+    calculate_signals.__qualname__ = '%s.calculate_signals' % \
+        type(strategy).__name__
+    events.register(EventType.MARKET, calculate_signals)
+    events.register(EventType.SIGNAL, portfolio.update_signal)
+    events.register(EventType.FILL, portfolio.update_fill)
+
+    if risk_stage is None:
+        events.register(EventType.ORDER, broker.execute_order)
+    else:
+        events.register(EventType.ORDER, risk_stage.execute_order)
+        events.register(EventType.FILL, risk_stage.update)
+
+def simulate(events, bars, strategy, portfolio, broker, risk_stage=None):
+    """
+    Runs the event-driven backtest loop, releasing one bar at a time and
+    dispatching the resulting events until the data is exhausted.
+
+    Parameters:
+    events - The EventBus shared by the components.
+    bars - The DataHandler object.
+    strategy - The Strategy object.
+    portfolio - The Portfolio object.
+    broker - The ExecutionHandler object.
+    risk_stage - Optional PreTradeRiskStage checking orders.
+
+    Returns the number of events dispatched.
+    """
+
+    register_handlers(events, strategy, portfolio, broker, risk_stage)
+
+    dispatched = 0
+    while bars.continue_backtest:
         bars.update_bars()
+
+        # Handle the events
+        dispatched += events.dispatch()
+    return dispatched
+
+def create_data_handler(settings, events, columns=None):
+    """
+    Returns the data handler described by settings, see DEFAULT_CONFIG.
+
+    Parameters:
+    settings - The full config of the backtest.
+    events - The EventBus the handler places MarketEvents on.
+    columns - Optional Bars tuple of already loaded bar arrays, used instead
+              of reading settings['csv_filename'].
+    """
+
+    if columns is not None:
+        return data.EMiniArrayHandler(events, columns)
+    if settings['cache_dir'] is not None:
+        return data.EMiniCachedHandler(events, settings['csv_filename'],
+                                       settings['cache_dir'])
+    if settings['chunksize'] is not None:
+        return data.EMiniStreamingCSVHandler(events, settings['csv_filename'],
+                                             settings['chunksize'])
+    return data.EMiniCSVHandler(events, settings['csv_filename'])
+
+def create_components(settings, bars, events, indicators=None):
+    """
+    Builds the strategy, portfolio, execution handler and optional risk
+    stage described by settings on top of a data handler.
+
+    Parameters:
+    settings - The full config of the backtest.
+    bars - The DataHandler object.
+    events - The EventBus shared by the components.
+    indicators - Optional IndicatorRegistry passed to the strategy, so
+                 strategies replaying the same bars share indicators.
+
+    Returns a (strategy, portfolio, broker, risk_stage) tuple, risk_stage
+    being None when there are no risk or exposure limits.
+    """
+
+    es_portfolio = portfolio.EMiniPortfolio(bars,
+                                            events,
+                                            settings['start_date'],
+                                            settings['initial_capital'])
+    strategy_params = settings['strategy_params']
+    if indicators is not None:
+        strategy_params = dict(strategy_params, indicators=indicators)
+    signals = settings['strategy'](bars, events, **strategy_params)
+    broker = settings['execution'](events, bars,
+                                   **settings['execution_params'])
+
+    checks = []
+    if settings['risk_params'] is not None:
+        checks = risk.create_risk_checks(bars, es_portfolio,
+                                         **settings['risk_params'])
+    if settings['exposure_params'] is not None:
+        checks.append(risk.ExposureCheck(exposure.ExposureManager(
+            es_portfolio, **settings['exposure_params'])))
+    if checks:
+        risk_stage = risk.PreTradeRiskStage(bars, broker, checks)
+    else:
+        risk_stage = None
+    return signals, es_portfolio, broker, risk_stage
+
+def collect_results(settings, es_portfolio, fills):
+    """
+    Summarises a finished backtest.
+
+    Parameters:
+    settings - The full config of the backtest.
+    es_portfolio - The EMiniPortfolio after the last bar.
+    fills - List of the FillEvents of the backtest.
+
+    Returns a dictionary of the strategy parameters and the summary.
+    """
+
+    initial_capital = settings['initial_capital']
+    total = float(es_portfolio.value)
+    results = dict(settings['strategy_params'])
+    results.update({'total': total,
+                    'total_return': total/initial_capital - 1.0,
+                    'positions': es_portfolio.es_positions,
+                    'fills': len(fills),
+                    'commission': sum(fill.commission for fill in fills)})
+
+    history = es_portfolio.get_history()
+    stats = performance.create_summary(history['datetime'],
+                                       history['positions'][:, 0],
+                                       history['cash'],
+                                       np.diff(history['commission'],
+                                               prepend=0.0),
+                                       history['total'],
+                                       initial_capital)
+    results.update((name, float(value)) for name, value in stats.items())
+    return results
+
+def run_backtest(config, columns=None):
+    """
+    Builds the data handler, strategy, portfolio and execution handler
+    described by config, runs the backtest and summarises the result.
+
+    Parameters:
+    config - Dictionary of settings, see DEFAULT_CONFIG. strategy_params
+             and execution_params are passed to the strategy and execution
+             handler constructors as keyword arguments.
+    columns - Optional Bars tuple of already loaded bar arrays, used instead
+              of reading config['csv_filename'].
+
+    Returns a dictionary of the strategy parameters and the summary.
+    """
+
+    settings = dict(DEFAULT_CONFIG)
+    settings.update(config)
+
+    # Instrumented runs are timed, so are never answered from the cache
+    cache = None
+    if settings['result_cache'] is not None and not settings['instrument']:
+        cache = resultcache.ResultCache(settings['result_cache'],
+                                        settings['result_cache_size'])
+        key = resultcache.result_key(settings, columns)
+        cached = cache.load(key)
+        if cached is not None:
+            return cached['results']
+
+    if settings['multiprocess_events']:
+        events = eventbus.QueueEventBus()
     else:
-        break
-    
-    # Handle the events
-    while True:
-        try:
-            event = event_queue.get(True, .001)
-        except queue.Empty:
-            print("Queue empty")
-            break
-        else:
-            if event is not None:
-                print(event.type)
-                if event.type == 'MARKET':
-                    #print('1')
-                    #portfolio.update(event)
-                    strategy.calculate_signals(event, portfolio)
-                elif event.type == 'SIGNAL':
-                    #print('2')
-                    portfolio.update_signal(event)
-                    
-                elif event.type == 'ORDER':
-                    #print('3')
-                    broker.execute_order(event)
-                    
-                elif event.type == 'FILL':
-                    #print('4')
-
-                    portfolio.update_fill(event)
-                    
-# print("debt: %s" % portfolio.debt)
-# print("equity: %s" % portfolio.current_holdings['total'])   
-# print("cash: %s" % portfolio.cash)  
-# print("commission: %s" % portfolio.current_holdings['commission'])         
+        events = eventbus.DequeEventBus()
+    bars = create_data_handler(settings, events, columns)
+    signals, es_portfolio, broker, risk_stage = \
+        create_components(settings, bars, events)
+
+    fills = []
+    events.register(EventType.FILL, fills.append)
+    if settings['instrument']:
+        profile = instrumentation.Instrumentation()
+        profile.attach(events)
+    simulate(events, bars, signals, es_portfolio, broker, risk_stage)
+
+    results = collect_results(settings, es_portfolio, fills)
+    if cache is not None:
+        cache.store(key, results, es_portfolio.get_history(), fills)
+    if settings['instrument']:
+        profile.detach(events)
+        results['instrumentation'] = profile.summary()
+    return results
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    csv_directory = "C:\\Users\\jonesdl6\\Desktop\\EminiBacktest"
+    # Pass --profile to time the event handlers
+    results = run_backtest(dict(DEFAULT_CONFIG,
+                                instrument='--profile' in sys.argv))
+
+    print("equity: %s" % results['total'])
+    print("commission: %s" % results['commission'])
+    print("sharpe: %.2f, max drawdown: %.2f%%" % (results['sharpe'],
+                                                 100*results['max_drawdown']))
+    if 'instrumentation' in results:
+        print(instrumentation.format_summary(results['instrumentation']))
@@ -0,0 +1,428 @@
+#! python3
+# benchmark.py
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import data
+import event
+import eventbus
+import execution
+import instrumentation
+import portfolio
+import strategy
+
+from event import EventType
+from recorder import CSV_DATETIME_FORMAT, CSV_HEADER
+
+# Constructor arguments used to build one event of each type
+_EXAMPLE_ARGS = {event.MarketEvent: (),
+                 event.SignalEvent: ('ES', 0, 'LONG'),
+                 event.OrderEvent: ('ES', 'MKT', 1, 'BUY'),
+                 event.FillEvent: (0, 'ES', 'GLOBEX', 1, 'BUY', 2150.0)}
+
+# Generated datasets are kept here and reused by later runs
+BENCHMARK_DATA_DIR = '.benchdata'
+
+def session_minutes(start, end):
+    """
+    Returns the epoch seconds of every 1-minute bar between start and end
+    (naive Central Time datetimes) that falls in an e-mini session: Sunday
+    to Friday 17:00-16:00, halted 15:15-15:30.
+    """
+
+    minutes = np.arange(int(pd.Timestamp(start).value//10**9),
+                        int(pd.Timestamp(end).value//10**9), 60)
+    # 1970-01-01 was a Thursday, so this is Monday=0 to Sunday=6
+    weekday = (minutes//86400 + 3) % 7
+    minute_of_day = (minutes % 86400)//60
+    halted = (minute_of_day >= 15*60 + 15) & (minute_of_day < 15*60 + 30)
+    closed = ((minute_of_day >= 16*60) & (minute_of_day < 17*60)) | \
+             halted | (weekday == 5) | \
+             ((weekday == 4) & (minute_of_day >= 16*60)) | \
+             ((weekday == 6) & (minute_of_day < 17*60))
+    return minutes[~closed]
+
+def generate_bars(timestamps, seed=0, price=2000.0, volatility=0.0004,
+                  tick_size=0.25):
+    """
+    Generates a random walk of e-mini style bars on the given timestamps.
+    The same seed always gives the same bars.
+
+    Parameters:
+    timestamps - Array of bar timestamps in epoch seconds.
+    seed - Seed of the random number generator.
+    price - Opening price of the first bar.
+    volatility - Standard deviation of the 1-minute log returns.
+    tick_size - Prices are rounded to multiples of this.
+
+    Returns a Bars tuple of column arrays.
+    """
+
+    rng = np.random.default_rng(seed)
+    num_bars = len(timestamps)
+    close = price*np.exp(np.cumsum(rng.normal(0.0, volatility, num_bars)))
+    close = np.round(close/tick_size)*tick_size
+    open_ = np.concatenate([[price], close[:-1]])
+    wick = np.round(np.abs(rng.normal(0.0, volatility, (2, num_bars))) *
+                    close/tick_size)*tick_size
+    high = np.maximum(open_, close) + wick[0]
+    low = np.minimum(open_, close) - wick[1]
+    volume = rng.integers(1, 2000, num_bars)
+    count = np.maximum(volume//6, 1)
+    wap = np.round((open_ + high + low + close)/4.0, 3)
+    return data.Bars(np.asarray(timestamps, dtype=np.int64), open_, high,
+                     low, close, volume, count, wap)
+
+def generate_emini_csv(filename, years=1, seed=0,
+                       start='2014-01-05 17:00:00'):
+    """
+    Writes `years` years of synthetic 1-minute bars to filename in the same
+    format as 1weekemini.csv, unless the file already exists.
+
+    Returns filename.
+    """
+
+    if not os.path.exists(filename):
+        end = pd.Timestamp(start) + pd.Timedelta(days=int(365.25*years))
+        bars = generate_bars(session_minutes(start, end), seed)
+        frame = pd.DataFrame(dict(zip(CSV_HEADER, bars)), columns=CSV_HEADER)
+        frame['Datetime'] = pd.to_datetime(bars.datetime, unit='s').strftime(
+            CSV_DATETIME_FORMAT)
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        frame.to_csv(filename + '.tmp', index=False)
+        os.replace(filename + '.tmp', filename)
+    return filename
+
+def generate_symbol_csvs(csv_dir, symbol_list, years=1, seed=0,
+                         start='2014-01-05 17:00:00'):
+    """
+    Writes synthetic 1-minute closes and volumes of every symbol to
+    csv_dir/symbol.csv in the format read by HistoricCSVDataHandler,
+    unless the files already exist. Each symbol has its own seed and a
+    tenth of its bars dropped, so the handler has gaps to align.
+    """
+
+    end = pd.Timestamp(start) + pd.Timedelta(days=int(365.25*years))
+    timestamps = session_minutes(start, end)
+    os.makedirs(csv_dir, exist_ok=True)
+    for i, symbol in enumerate(symbol_list):
+        filename = os.path.join(csv_dir, '%s.csv' % symbol)
+        if os.path.exists(filename):
+            continue
+        rng = np.random.default_rng(seed + i)
+        kept = timestamps[rng.random(len(timestamps)) >= 0.1]
+        bars = generate_bars(kept, seed + i, price=1000.0*(i + 1))
+        frame = pd.DataFrame({'datetime': pd.to_datetime(
+                                  bars.datetime, unit='s').strftime(
+                                  '%Y-%m-%d %H:%M:%S'),
+                              'close': bars.close,
+                              'volume': bars.volume})
+        frame.to_csv(filename + '.tmp', index=False)
+        os.replace(filename + '.tmp', filename)
+    return csv_dir
+
+def _best_time(function, repeat):
+    """
+    Returns the shortest wall time of repeat calls to function, and the
+    value returned by the last call.
+    """
+
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_event_dispatch(num_events=200000, repeat=5):
+    """
+    Measures the raw cost of creating events and dispatching them through a
+    DequeEventBus to handlers that do nothing, cycling through the four
+    event types as a backtest would.
+
+    Returns the best events per second over repeat runs.
+    """
+
+    events = eventbus.DequeEventBus()
+    for event_class, args in _EXAMPLE_ARGS.items():
+        events.register(event_class(*args).type, lambda e: None)
+
+    best = 0.0
+    for r in range(repeat):
+        start = time.perf_counter()
+        for i in range(num_events // 4):
+            events.put(event.MARKET_EVENT)
+            events.put(event.SignalEvent('ES', i, 'LONG'))
+            events.put(event.OrderEvent('ES', 'MKT', 1, 'BUY'))
+            events.put(event.FillEvent(i, 'ES', 'GLOBEX', 1, 'BUY', 2150.0))
+            events.dispatch()
+        best = max(best, num_events / (time.perf_counter() - start))
+    return best
+
+def bench_event_loop(csv_filename='1weekemini.csv', repeat=3):
+    """
+    Measures the event-driven backtest loop on csv_filename, counting every
+    event dispatched. The CSV is loaded once beforehand.
+
+    Returns the best events per second over repeat runs.
+    """
+
+    columns = data.load_emini_csv(csv_filename)
+    best = 0.0
+    for i in range(repeat):
+        events = eventbus.DequeEventBus()
+        bars = data.EMiniArrayHandler(events, columns)
+        es_portfolio = portfolio.EMiniPortfolio(bars, events, None, 100000)
+        sma_to_ema = strategy.SMAtoEMA(bars, events)
+        broker = execution.SimulatedExecutionHandler(events, bars)
+        start = time.perf_counter()
+        dispatched = backtest.simulate(events, bars, sma_to_ema,
+                                       es_portfolio, broker)
+        elapsed = time.perf_counter() - start
+        best = max(best, dispatched / elapsed)
+    return best
+
+def bench_csv_load(csv_filename, repeat=3):
+    """
+    Measures load_emini_csv() on csv_filename.
+    """
+
+    elapsed, columns = _best_time(lambda: data.load_emini_csv(csv_filename),
+                                  repeat)
+    return {'bars': len(columns.datetime),
+            'load_bars_per_second': len(columns.datetime)/elapsed}
+
+def bench_update_bars(columns, repeat=3):
+    """
+    Measures releasing every bar through EMiniArrayHandler.update_bars()
+    and dispatching its MarketEvent to no handlers.
+    """
+
+    def replay():
+        events = eventbus.DequeEventBus()
+        bars = data.EMiniArrayHandler(events, columns)
+        while bars.continue_backtest:
+            bars.update_bars()
+            events.dispatch()
+
+    elapsed, result = _best_time(replay, repeat)
+    return {'update_bars_per_second': len(columns.datetime)/elapsed}
+
+def bench_handlers(columns):
+    """
+    Runs SMAtoEMA over columns with Instrumentation attached and returns the
+    mean latency of each handler per call, e.g. the strategy's per-bar
+    latency, which isolates regressions in strategy.py, portfolio.py and
+    execution.py.
+    """
+
+    events = eventbus.DequeEventBus()
+    bars = data.EMiniArrayHandler(events, columns)
+    es_portfolio = portfolio.EMiniPortfolio(bars, events, None, 100000)
+    sma_to_ema = strategy.SMAtoEMA(bars, events)
+    broker = execution.SimulatedExecutionHandler(events, bars)
+    profile = instrumentation.Instrumentation()
+    profile.attach(events)
+    backtest.simulate(events, bars, sma_to_ema, es_portfolio, broker)
+    profile.detach(events)
+
+    summary = profile.summary()
+    return dict(('%s_us' % name, stats['mean_us'])
+                for name, stats in summary['handlers'].items()
+                if name != 'list.append')
+
+def bench_backtest(csv_filename, repeat=3):
+    """
+    Measures run_backtest() on csv_filename end to end, from reading the
+    CSV to the summary statistics, and its peak traced memory in a separate
+    run (tracemalloc slows the run down, so it is not timed).
+    """
+
+    config = dict(backtest.DEFAULT_CONFIG, csv_filename=csv_filename)
+    elapsed, results = _best_time(lambda: backtest.run_backtest(config),
+                                  repeat)
+
+    tracemalloc.start()
+    try:
+        backtest.run_backtest(config)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    num_bars = len(data.load_emini_csv(csv_filename).datetime)
+    return {'backtest_bars_per_second': num_bars/elapsed,
+            'peak_memory_bytes': peak}
+
+def bench_multi_symbol(csv_dir, symbol_list, repeat=3):
+    """
+    Measures loading and aligning the CSV files of several symbols with
+    HistoricCSVDataHandler, and replaying them with one SMAtoEMA per symbol
+    into a FuturesPortfolio.
+    """
+
+    load_s, bars = _best_time(
+        lambda: data.HistoricCSVDataHandler(eventbus.DequeEventBus(),
+                                            csv_dir, symbol_list), repeat)
+
+    def replay():
+        events = eventbus.DequeEventBus()
+        bars = data.HistoricCSVDataHandler(events, csv_dir, symbol_list)
+        futures = portfolio.FuturesPortfolio(bars, events, None, 10**6)
+        broker = execution.SimulatedExecutionHandler(events, bars)
+        strategies = [strategy.SMAtoEMA(bars, events, symbol=symbol)
+                      for symbol in symbol_list]
+
+        def calculate_signals(event):
+            for s in strategies:
+                s.calculate_signals(event, futures)
+        events.register(EventType.MARKET, broker.update)
+        events.register(EventType.MARKET, futures.update)
+        events.register(EventType.MARKET, calculate_signals)
+        events.register(EventType.SIGNAL, futures.update_signal)
+        events.register(EventType.ORDER, broker.execute_order)
+        events.register(EventType.FILL, futures.update_fill)
+
+        start = time.perf_counter()
+        while bars.continue_backtest:
+            bars.update_bars()
+            events.dispatch()
+        return time.perf_counter() - start
+
+    replay_s = min(replay() for i in range(repeat))
+    return {'timestamps': len(bars.datetime),
+            'symbols': len(symbol_list),
+            'load_s': load_s,
+            'replay_bars_per_second': len(bars.datetime)/replay_s}
+
+def environment():
+    """
+    Returns the versions and machine details recorded with the results.
+    """
+
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+def run_suite(csv_filename='1weekemini.csv', years=2, symbol_list=('ES', 'NQ',
+              'YM', 'RTY'), symbol_years=1, seed=0, repeat=3):
+    """
+    Runs every benchmark on csv_filename, on `years` years of synthetic
+    e-mini bars and on `symbol_years` years of synthetic bars for each of
+    symbol_list. The synthetic data is generated once into
+    BENCHMARK_DATA_DIR, so every run of the same suite sees the same bars.
+
+    Returns a dictionary of the environment and, per benchmark, its metrics.
+    Metric names end in their unit: _s and _us are times, _bytes memory and
+    _per_second throughput.
+    """
+
+    synthetic = generate_emini_csv(
+        os.path.join(BENCHMARK_DATA_DIR, 'es_%gy_seed%s.csv' % (years, seed)),
+        years, seed)
+    symbol_dir = generate_symbol_csvs(
+        os.path.join(BENCHMARK_DATA_DIR, '%s_%gy_seed%s' %
+                     ('_'.join(symbol_list), symbol_years, seed)),
+        symbol_list, symbol_years, seed)
+
+    results = {'environment': environment(), 'benchmarks': {}}
+    benchmarks = results['benchmarks']
+    benchmarks['event_dispatch'] = {
+        'events_per_second': bench_event_dispatch(repeat=repeat)}
+    for name, filename in (('1week', csv_filename), ('synthetic', synthetic)):
+        columns = data.load_emini_csv(filename)
+        metrics = bench_csv_load(filename, repeat)
+        metrics.update(bench_update_bars(columns, repeat))
+        metrics['event_loop_events_per_second'] = \
+            bench_event_loop(filename, repeat)
+        metrics.update(bench_handlers(columns))
+        metrics.update(bench_backtest(filename, repeat))
+        benchmarks[name] = metrics
+    benchmarks['multi_symbol'] = bench_multi_symbol(symbol_dir,
+                                                    list(symbol_list), repeat)
+    return results
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares two run_suite() results metric by metric.
+
+    Parameters:
+    baseline - The earlier results.
+    current - The new results.
+    threshold - Relative change beyond which a metric counts as changed.
+
+    Returns a list of (benchmark, metric, baseline, current, change,
+    status) rows, status being 'regression', 'improvement' or ''.
+    """
+
+    rows = []
+    for name, metrics in sorted(current['benchmarks'].items()):
+        for metric, value in sorted(metrics.items()):
+            before = baseline['benchmarks'].get(name, {}).get(metric)
+            if not before or metric in ('bars', 'timestamps', 'symbols'):
+                continue
+            change = value/before - 1.0
+            # Throughput should go up, times and memory down
+            if metric.endswith('_per_second'):
+                change_for_worse = -change
+            else:
+                change_for_worse = change
+            if change_for_worse > threshold:
+                status = 'regression'
+            elif change_for_worse < -threshold:
+                status = 'improvement'
+            else:
+                status = ''
+            rows.append((name, metric, before, value, change, status))
+    return rows
+
+def format_comparison(rows):
+    lines = ['%-14s %-44s %14s %14s %8s' % ('benchmark', 'metric',
+                                             'baseline', 'current', 'change')]
+    for name, metric, before, value, change, status in rows:
+        lines.append('%-14s %-44s %14.6g %14.6g %+7.1f%% %s' %
+                     (name, metric[:44], before, value, 100*change, status))
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the backtest pipeline.")
+    parser.add_argument('--output', help="write the results to this JSON "
+                        "file")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="compare with the results in this JSON file, "
+                        "exiting with status 1 on any regression")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="relative change reported as a regression")
+    parser.add_argument('--csv', default='1weekemini.csv')
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--symbols', nargs='+',
+                        default=['ES', 'NQ', 'YM', 'RTY'])
+    parser.add_argument('--symbol-years', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = run_suite(args.csv, args.years, tuple(args.symbols),
+                        args.symbol_years, args.seed, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    print(json.dumps(results['benchmarks'], indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            rows = compare(json.load(f), results, args.threshold)
+        print(format_comparison(rows))
+        if any(row[-1] == 'regression' for row in rows):
+            sys.exit(1)
@@ -0,0 +1,6 @@
+#! python3
+# conftest.py
+
+# IBpy_test.py is a script talking to TWS, not a test module, despite its
+# name matching pytest's default *_test.py pattern
+collect_ignore = ['IBpy_test.py']
@@ -0,0 +1,34 @@
+#! python3
+# contracts.py
+
+from collections import namedtuple
+
+# Dollar value of a one point move, minimum price increment, and the initial
+# and maintenance margin per contract in USD
+ContractSpec = namedtuple('ContractSpec', ('multiplier', 'tick_size',
+                                           'initial_margin',
+                                           'maintenance_margin'))
+
+# CME equity index futures. The margins are indicative only, as the exchange
+# revises them regularly; pass updated specs to the portfolio where needed.
+CONTRACT_SPECS = {'ES': ContractSpec(50.0, 0.25, 5500.0, 5000.0),
+                  'NQ': ContractSpec(20.0, 0.25, 4400.0, 4000.0),
+                  'YM': ContractSpec(5.0, 1.0, 4400.0, 4000.0),
+                  'RTY': ContractSpec(50.0, 0.1, 6050.0, 5500.0)}
+
+def get_contract_spec(symbol, specs=None):
+    """
+    Returns the ContractSpec of symbol from specs, or from CONTRACT_SPECS if
+    specs is None or does not list it.
+
+    Parameters:
+    symbol - The instrument symbol, e.g. 'ES'.
+    specs - Optional dictionary of symbol to ContractSpec overrides.
+    """
+
+    if specs is not None and symbol in specs:
+        return specs[symbol]
+    try:
+        return CONTRACT_SPECS[symbol]
+    except KeyError:
+        raise KeyError("No contract specification for %s" % symbol)
@@ -2,12 +2,369 @@
 # data.py
 
 import datetime
+import hashlib
+import json
+import logging
 import os, os.path
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
 
 from abc import ABCMeta, abstractmethod
 
-from event import MarketEvent
+from collections import namedtuple
+
+from event import MARKET_EVENT
+from sessions import CME_CALENDAR, SessionArrays
+
+logger = logging.getLogger(__name__)
+
+# Bar columns, in the order of the e-mini CSV files
+BAR_FIELDS = ('datetime', 'open', 'high', 'low', 'close', 'volume', 'count',
+              'wap')
+BAR_DTYPES = {'datetime': np.int64,
+              'open': np.float64,
+              'high': np.float64,
+              'low': np.float64,
+              'close': np.float64,
+              'volume': np.int64,
+              'count': np.int64,
+              'wap': np.float64}
+
+# A window of bars held column-wise, one array per field in BAR_FIELDS
+Bars = namedtuple('Bars', BAR_FIELDS)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def epoch_to_datetime(timestamp):
+    """
+    Converts a bar timestamp in epoch seconds back to a datetime.
+    """
+    
+    return EPOCH + datetime.timedelta(seconds=int(timestamp))
+    
+def _convert_emini_frame(csv_data):
+    """
+    Converts a DataFrame read from an e-mini CSV file into one read-only
+    NumPy array per column: int64 epoch seconds for the datetime, float64
+    for the prices and WAP, and int64 for volume and count.
+    
+    Returns a Bars tuple of the column arrays.
+    """
+    
+    # Parse every timestamp in one vectorized call rather than a strptime()
+    # per bar
+    timestamps = pd.to_datetime(csv_data.index, format='%Y%m%d %H:%M:%S')
+    timestamps = timestamps.values.astype('datetime64[s]').astype(np.int64)
+    
+    columns = [timestamps]
+    for i, field in enumerate(BAR_FIELDS[1:]):
+        columns.append(np.ascontiguousarray(csv_data.iloc[:, i].values,
+                                            dtype=BAR_DTYPES[field]))
+    for column in columns:
+        column.flags.writeable = False
+    return Bars(*columns)
+    
+def load_emini_csv(csv_filename):
+    """
+    Opens an e-mini CSV file, converting it into one read-only NumPy array
+    per column.
+    
+    Ensure proper formatting for the data source being used.
+    
+    Returns a Bars tuple of the column arrays.
+    """
+    
+    csv_data = pd.read_csv(csv_filename, 
+                           delimiter=',',
+                           header=0,
+                           index_col=0)
+    return _convert_emini_frame(csv_data)
+    
+def _bar_cache_path(csv_filename, cache_dir):
+    """
+    Returns the cache directory for csv_filename, keyed by a hash of its
+    absolute path, size and modification time so that an edited or replaced
+    file gets a fresh cache entry without being re-read to check.
+    """
+    
+    csv_filename = os.path.abspath(csv_filename)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(csv_filename), '.barcache')
+    stat = os.stat(csv_filename)
+    key = hashlib.sha1(('%s|%d|%d' % (csv_filename, stat.st_size,
+                                      stat.st_mtime_ns)).encode('utf-8'))
+    name = '%s-%s' % (os.path.basename(csv_filename), key.hexdigest()[:16])
+    return os.path.join(cache_dir, name)
+    
+def _file_sha1(filename):
+    """
+    Returns the SHA-1 hex digest of a file's contents.
+    """
+    
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+    
+def convert_csv_to_cache(csv_filename, cache_dir=None):
+    """
+    Converts an e-mini CSV file to the binary bar cache: one .npy file per
+    field in BAR_FIELDS plus a meta.json recording the source file and the
+    SHA-1 of its contents. Does nothing if the cache entry already exists.
+    
+    The entry is written to a temporary directory and renamed into place,
+    so concurrent backtests never see a partly written cache.
+    
+    Parameters:
+    csv_filename - Path to the CSV file.
+    cache_dir - Directory holding cache entries, default '.barcache' next
+                to the CSV file.
+                
+    Returns the path of the cache entry.
+    """
+    
+    path = _bar_cache_path(csv_filename, cache_dir)
+    if os.path.isdir(path):
+        return path
+        
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_path = tempfile.mkdtemp(dir=parent)
+    try:
+        columns = load_emini_csv(csv_filename)
+        for field, column in zip(BAR_FIELDS, columns):
+            np.save(os.path.join(tmp_path, '%s.npy' % field), column)
+        stat = os.stat(csv_filename)
+        meta = {'source': os.path.abspath(csv_filename),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha1': _file_sha1(csv_filename),
+                'num_bars': len(columns.datetime)}
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another process renamed its copy into place first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    except:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return path
+    
+def load_cached_bars(csv_filename, cache_dir=None):
+    """
+    Returns a Bars tuple of read-only memory-mapped arrays for csv_filename,
+    converting the file into the cache first if needed.
+    
+    Only the pages actually touched are read, and processes mapping the
+    same entry share them through the page cache.
+    
+    Parameters:
+    csv_filename - Path to the CSV file.
+    cache_dir - Directory holding cache entries, see convert_csv_to_cache().
+    """
+    
+    path = convert_csv_to_cache(csv_filename, cache_dir)
+    return Bars(*[np.load(os.path.join(path, '%s.npy' % field), mmap_mode='r')
+                  for field in BAR_FIELDS])
+    
+def load_cache_meta(csv_filename, cache_dir=None):
+    """
+    Returns the meta.json dictionary of csv_filename's cache entry,
+    converting the file into the cache first if needed.
+    """
+    
+    path = convert_csv_to_cache(csv_filename, cache_dir)
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+    
+# Record layout of binary bar files, one fixed-size record per bar
+BAR_RECORD_DTYPE = np.dtype([(field, BAR_DTYPES[field]) 
+                             for field in BAR_FIELDS])
+                             
+def load_bar_records(filename):
+    """
+    Reads a binary bar file of BAR_RECORD_DTYPE records, as written by
+    recorder.BarRecorder, sorted by timestamp.
+    
+    Returns a Bars tuple of read-only column arrays.
+    """
+    
+    records = np.fromfile(filename, dtype=BAR_RECORD_DTYPE)
+    records = records[np.argsort(records['datetime'], kind='mergesort')]
+    columns = []
+    for field in BAR_FIELDS:
+        column = np.ascontiguousarray(records[field])
+        column.flags.writeable = False
+        columns.append(column)
+    return Bars(*columns)
+    
+class BarRingBuffer(object):
+    """
+    Fixed-capacity history of bars held column-wise in NumPy arrays.
+    
+    Each bar is written twice, at i and i + capacity, so the latest N bars
+    are always a contiguous slice and can be returned as views without
+    copying. Memory is fixed at twice the capacity however many bars are
+    appended.
+    """
+    
+    def __init__(self, capacity, fields=BAR_FIELDS, dtypes=BAR_DTYPES):
+        """
+        Initializes the empty buffer.
+        
+        Parameters:
+        capacity - Most bars kept, i.e. the maximum lookback.
+        fields - Names of the bar fields, in append() order.
+        dtypes - Dictionary of the NumPy dtype of each field.
+        """
+        
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        if self.fields == BAR_FIELDS:
+            self.Bars = Bars
+        else:
+            self.Bars = namedtuple('Bars', self.fields)
+        self.columns = [np.zeros(2*capacity, dtype=dtypes[field])
+                        for field in self.fields]
+        self.count = 0
+        
+    def __len__(self):
+        return min(self.count, self.capacity)
+        
+    def append(self, bar):
+        """
+        Adds a bar, overwriting the oldest once the buffer is full.
+        
+        Parameters:
+        bar - Sequence of values in the order of fields.
+        """
+        
+        i = self.count % self.capacity
+        j = i + self.capacity
+        for column, value in zip(self.columns, bar):
+            column[i] = column[j] = value
+        self.count += 1
+        
+    def get_latest_bars(self, N=1):
+        """
+        Returns the last N bars, or fewer if less are held, as a Bars tuple
+        of read-only views.
+        """
+        
+        count = min(N, self.capacity, self.count)
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        views = []
+        for column in self.columns:
+            view = column[end - count:end]
+            view.flags.writeable = False
+            views.append(view)
+        return self.Bars(*views)
+        
+class BarAggregator(object):
+    """
+    Builds fixed-length OHLCV bars from ticks, or from shorter bars, as they
+    arrive.
+    
+    A bar is completed by the first tick of the next period, or by flush(),
+    and is returned as a tuple in BAR_FIELDS order with the period's start
+    as its timestamp, the number of ticks as its count and the volume
+    weighted price as its WAP.
+    
+    Periods start at multiples of bar_seconds from the epoch, shifted back
+    by offset, e.g. daily bars with an offset of SESSION_OFFSET start at
+    17:00 to cover one e-mini session.
+    """
+    
+    def __init__(self, bar_seconds=60, offset=0):
+        """
+        Parameters:
+        bar_seconds - Length of each bar in seconds.
+        offset - Seconds by which period starts are shifted back.
+        """
+        
+        self.bar_seconds = bar_seconds
+        self.offset = offset
+        self.start = None
+    
+    def add_tick(self, timestamp, price, size):
+        """
+        Adds a trade to the current bar.
+        
+        Returns the completed previous bar if the tick starts a new one,
+        otherwise None.
+        """
+        
+        return self.add_bar((timestamp, price, price, price, price, size, 1,
+                             price))
+    
+    def add_bar(self, bar):
+        """
+        Adds a bar shorter than bar_seconds, e.g. a 5-second real time bar,
+        to the current bar.
+        
+        Parameters:
+        bar - Tuple of values in BAR_FIELDS order.
+        
+        Returns the completed previous bar if this one starts a new one,
+        otherwise None.
+        """
+        
+        timestamp, open_, high, low, close, volume, count, wap = bar
+        start = timestamp - (timestamp + self.offset) % self.bar_seconds
+        completed = None
+        if start != self.start:
+            completed = self.flush()
+            self.start = start
+            self.open = open_
+            self.high = high
+            self.low = low
+            self.volume = 0
+            self.count = 0
+            self.price_volume = 0.0
+        
+        if high > self.high:
+            self.high = high
+        if low < self.low:
+            self.low = low
+        self.close = close
+        self.volume += volume
+        self.count += count
+        self.price_volume += wap*volume
+        return completed
+    
+    def flush(self):
+        """
+        Completes and returns the current bar, or None if there is none.
+        """
+        
+        if self.start is None:
+            return None
+        if self.volume:
+            wap = self.price_volume / self.volume
+        else:
+            wap = self.close
+        bar = (self.start, self.open, self.high, self.low, self.close,
+               self.volume, self.count, wap)
+        self.start = None
+        return bar
+
+def get_latest_bar(bars, symbol):
+    """
+    Returns the latest bar of symbol as a Bars tuple of length-1 columns,
+    from either a multi-symbol handler (get_latest_bars(symbol, N)) or a
+    single-instrument one (get_latest_bars(N)).
+    """
+    
+    if hasattr(bars, 'symbol_slot'):
+        return bars.get_latest_bars(symbol, N=1)
+    return bars.get_latest_bars(N=1)
 
 class DataHandler(object):
     """
@@ -46,12 +403,18 @@ class HistoricCSVDataHandler(DataHandler):
     HistoricCSVDataHandler is designed to read CSV files for each requested
     symbol from disk and provide an interface to obtain the "latest" bar in a
     manner identical to a live trading interface.
+    
+    All symbols are aligned on one master clock, the union of their
+    timestamps, and forward-filled into a single (time x symbol x field)
+    array. One MarketEvent is emitted per timestamp and the latest bars of
+    any symbol are a view into that array.
     """
     
-    def __init__(self, events, csv_dir, symbol_list):
+    def __init__(self, events, csv_dir, symbol_list, 
+                 fields=('close', 'volume'), calendar=CME_CALENDAR):
         """
-        Initializes the historic data handler by requseting the locaiton of the
-        CSV files and a list of symbols.
+        Initializes the historic data handler by requesting the location of
+        the CSV files and a list of symbols.
         
         It will be assumed that all files are of the form "symbol.csv", where
         symbol is a string in the list.
@@ -60,164 +423,334 @@ class HistoricCSVDataHandler(DataHandler):
         events - The Event Queue.
         csv_dir - Absolute directory path to the CSV files.
         symbol_list - A list of symbol strings.
+        fields - Names of the columns following the datetime in each file.
+        calendar - The SessionCalendar classifying the bars.
         """
         
         self.events = events
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
+        self.fields = tuple(fields)
+        self.calendar = calendar
+        self.Bars = namedtuple('Bars', ('datetime',) + self.fields)
         
-        self.symbol_data = {}
-        self.latest_symbol_data = {}
-        self.continue_backtest = True
+        # Slot of each symbol along the second axis of self.symbol_data
+        self.symbol_slot = dict((s, i) for i, s in enumerate(symbol_list))
+        self.bar_index = -1
         
         self._open_convert_csv_files()
+        self.sessions = calendar.precompute(self.datetime)
+        self.continue_backtest = len(self.datetime) > 0
         
     def _open_convert_csv_files(self):
         """
-        Opens the CSV files from the data directory, converting them into pandas
-        DataFrames within a symbol dictionary.
+        Opens the CSV files from the data directory and aligns them on the
+        union of their timestamps, forward-filling each symbol from its last
+        bar. Timestamps before a symbol's first bar are NaN.
         
         Ensure proper formatting for the data source being used.
         """
         
-        comb_index = None
+        timestamps = []
+        values = []
         for s in self.symbol_list:
             # Load the CSV file with no header information, indexed on datetime
-            self.symbol_data[s] = pd.io.parsers.read_csv(
-                                    os.path.join(self.csv_dir, '%s.csv' % s),
-                                    header = 0, index_col = 0,
-                                    names = ['datetime','close','volume'])
-                                    
-            if comb_index is None:
-                comb_index = self.symbol_data[s].index
-            else:
-                comb_index.union(self.symbol_data[s].index)
-                
-            # Set the latest symbol_data to None
-            self.latest_symbol_data[s] = []
+            csv_data = pd.read_csv(os.path.join(self.csv_dir, '%s.csv' % s),
+                                   header = 0, index_col = 0,
+                                   names = ('datetime',) + self.fields)
+            ts = pd.to_datetime(csv_data.index, format='%Y-%m-%d %H:%M:%S')
+            ts = ts.values.astype('datetime64[s]').astype(np.int64)
+            order = np.argsort(ts, kind='mergesort')
+            timestamps.append(ts[order])
+            values.append(csv_data.values.astype(np.float64)[order])
             
-        # Reindex the dataframes
-        for s in self.symbol_list:
-            self.symbol_data[s] = (self.symbol_data[s]
-                                       .reindex(index=comb_index, method='pad') 
-                                       .iterrows())
-                                        
-    def _get_new_bar(self, symbol):
-        """
-        Returns the latest bar from the data feed as a tuple of (symbol, datetime,
-        close, volume).
-        """
-        for b in self.symbol_data[symbol]:
-            yield tuple([symbol, 
-                         datetime.datetime.strptime(b[0], '%Y-%m-%d %H:%M:%S'),
-                         b[1][0],
-                         b[1][1]])
+        # Merge the sorted per-symbol clocks into one master clock
+        if timestamps:
+            self.datetime = np.unique(np.concatenate(timestamps))
+        else:
+            self.datetime = np.zeros(0, dtype=np.int64)
+            
+        # Forward-fill each symbol onto the master clock: the row to use for
+        # each master timestamp is the symbol's last bar at or before it
+        self.symbol_data = np.full((len(self.datetime), len(self.symbol_list),
+                                    len(self.fields)), np.nan)
+        for i, (ts, vals) in enumerate(zip(timestamps, values)):
+            rows = np.searchsorted(ts, self.datetime, side='right') - 1
+            valid = rows >= 0
+            self.symbol_data[valid, i, :] = vals[rows[valid]]
+            
+        self.datetime.flags.writeable = False
+        self.symbol_data.flags.writeable = False
                          
     def get_latest_bars(self, symbol, N=1):
         """
         Returns the last N bars from the latest_symbol list, or N-k if less
-        available.
+        available, as a Bars tuple of the datetime and each field. The
+        columns are views into the aligned data, so nothing is copied.
         """
         
         try:
-            bars_list = self.latest_symbol_data[symbol]
-        except:
-            print("That symbol is not available in the historic data set")
+            slot = self.symbol_slot[symbol]
+        except KeyError:
+            logger.error("%s is not available in the historic data set",
+                         symbol)
         else:
-            return bars_list[-N:]
+            end = self.bar_index + 1
+            start = max(end - N, 0)
+            window = self.symbol_data[start:end, slot]
+            return self.Bars(self.datetime[start:end], 
+                             *[window[:, k] for k in range(len(self.fields))])
+                             
+    def get_latest_bar_values(self, field):
+        """
+        Returns the latest value of field for every symbol, as an array
+        indexed like symbol_list, all NaN until the first bar is released.
+        """
+        
+        if self.bar_index < 0:
+            return np.full(len(self.symbol_list), np.nan)
+        return self.symbol_data[self.bar_index, :, self.fields.index(field)]
+        
+    def get_latest_session(self):
+        """
+        Returns the session of the latest bar, looked up in the arrays
+        precomputed when the data was loaded, or None until the first bar
+        is released.
+        """
+        
+        i = self.bar_index
+        if i < 0:
+            return None
+        return SessionArrays(self.sessions.session_id[i],
+                             self.sessions.in_session[i],
+                             self.sessions.rth[i])
             
     def update_bars(self):
         """
-        Pushes the latest bar to the latest_symbol_data structure for all symbols
-        in the symbol list.
+        Advances the master clock by one timestamp, releasing the latest bar
+        of every symbol, and places a single MarketEvent on the queue.
         """
         
-        for s in self.symbol_list:
-            try:
-                bar = next(self._get_new_bar(s))
-            except StopIteration:
+        if self.bar_index + 1 < len(self.datetime):
+            self.bar_index += 1
+            if self.bar_index + 1 == len(self.datetime):
                 self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[s].append(bar)
-        self.events.put(MarketEvent())
+            self.events.put(MARKET_EVENT)
+        else:
+            self.continue_backtest = False
         
-class EMiniCSVHandler(DataHandler):
+class EMiniArrayHandler(DataHandler):
     """
-    Data handler for the e-mini csv.
+    Data handler replaying e-mini bars that are already held as column
+    arrays, e.g. loaded by load_emini_csv() or attached from shared memory.
+    
+    A cursor marks the latest bar, so releasing a bar and reading the latest
+    N bars are both O(1) and no per-bar history is accumulated. The session
+    of every bar is classified once on loading, in self.sessions.
     """
     
-    def __init__(self, events, csv_filename):
+    def __init__(self, events, columns, calendar=CME_CALENDAR):
         """
-        Initializes the historic data handler by requseting the locaiton of the
-        CSV files and a list of symbols.
-        
-        It will be assumed that all files are of the form "symbol.csv", where
-        symbol is a string in the list.
+        Initializes the handler with the full set of bars.
         
         Parameters:
         events - The Event Queue.
-        csv_dir - Absolute directory path to the CSV files.
-        symbol_list - A list of symbol strings.
+        columns - A Bars tuple with one array per field in BAR_FIELDS.
+        calendar - The SessionCalendar classifying the bars.
         """
         
         self.events = events
+        self.columns = columns
+        self.calendar = calendar
+        self.sessions = calendar.precompute(columns.datetime)
+        self.num_bars = len(columns.datetime)
+        self.bar_index = -1
+        self.continue_backtest = self.num_bars > 0
+                         
+    def get_latest_bars(self, N=1):
+        """
+        Returns the last N bars, or N-k if less available, as a Bars tuple of
+        read-only column views, e.g. get_latest_bars(N).close[-1] is the
+        latest close. No data is copied.
+        """
+        
+        end = self.bar_index + 1
+        start = max(end - N, 0)
+        return Bars(*[column[start:end] for column in self.columns])
+        
+    def get_latest_session(self):
+        """
+        Returns the session of the latest bar as a SessionArrays tuple of
+        its session id and whether it is in the session and in regular
+        trading hours, looked up in the arrays precomputed when the data
+        was loaded, or None until the first bar is released.
+        """
+        
+        i = self.bar_index
+        if i < 0:
+            return None
+        return SessionArrays(self.sessions.session_id[i],
+                             self.sessions.in_session[i],
+                             self.sessions.rth[i])
+        
+    def update_bars(self):
+        """
+        Releases the next bar by advancing the cursor and places a MarketEvent
+        on the event queue.
+        """
+        
+        if self.bar_index + 1 < self.num_bars:
+            self.bar_index += 1
+            if self.bar_index + 1 == self.num_bars:
+                self.continue_backtest = False
+            self.events.put(MARKET_EVENT)
+        else:
+            self.continue_backtest = False
+            
+class EMiniCSVHandler(EMiniArrayHandler):
+    """
+    Data handler for the e-mini csv.
+    
+    The whole file is parsed once into contiguous column arrays which are
+    then replayed by EMiniArrayHandler.
+    """
+    
+    def __init__(self, events, csv_filename, calendar=CME_CALENDAR):
+        """
+        Initializes the historic data handler by requesting the location of
+        the CSV file.
+        
+        Parameters:
+        events - The Event Queue.
+        csv_filename - Path to the CSV file.
+        calendar - The SessionCalendar classifying the bars.
+        """
+        
         self.csv_filename = csv_filename
-        self.csv_data = {}
-        self.latest_data = []
-        self.continue_backtest = True    
-        self._open_convert_csv_files()
+        EMiniArrayHandler.__init__(self, events, load_emini_csv(csv_filename),
+                                   calendar)
+            
+class EMiniCachedHandler(EMiniArrayHandler):
+    """
+    Data handler for the e-mini csv that replays bars memory-mapped from the
+    binary bar cache, converting the CSV on first use.
+    
+    Startup costs a few file opens regardless of the length of the history.
+    """
+    
+    def __init__(self, events, csv_filename, cache_dir=None,
+                 calendar=CME_CALENDAR):
+        """
+        Initializes the handler from the cache entry for csv_filename.
         
-    def _open_convert_csv_files(self):
+        Parameters:
+        events - The Event Queue.
+        csv_filename - Path to the CSV file.
+        cache_dir - Directory holding cache entries, see
+                    convert_csv_to_cache().
+        calendar - The SessionCalendar classifying the bars.
         """
-        Opens the CSV files from the data directory, converting them into pandas
-        DataFrames within a symbol dictionary.
         
-        Ensure proper formatting for the data source being used.
+        self.csv_filename = csv_filename
+        self.cache_dir = cache_dir
+        EMiniArrayHandler.__init__(self, events,
+                                   load_cached_bars(csv_filename, cache_dir),
+                                   calendar)
+            
+class EMiniStreamingCSVHandler(DataHandler):
+    """
+    Data handler for e-mini csv files too large to load at once.
+    
+    The file is read in fixed-size chunks as the replay reaches them and
+    each released bar is copied into a fixed-size lookback buffer, so memory
+    use does not depend on the length of the file and the first bar is
+    available as soon as the first chunk is parsed.
+    """
+    
+    def __init__(self, events, csv_filename, chunksize=50000, 
+                 max_lookback=1000, calendar=CME_CALENDAR):
         """
+        Initializes the handler and reads the first chunk.
         
-        self.csv_data = pd.read_csv(self.csv_filename, 
-                                    delimiter=',',
-                                    header=0,
-                                    index_col=0)
-                                    
-        new_index = self.csv_data.index     
-        self.csv_data = self.csv_data.reindex(new_index).iterrows()
- 
-    def _get_new_bar(self):
+        Parameters:
+        events - The Event Queue.
+        csv_filename - Path to the CSV file.
+        chunksize - Number of rows parsed per chunk.
+        max_lookback - Most bars get_latest_bars() can return.
+        calendar - The SessionCalendar classifying the bars, a chunk at a
+                   time as it is read.
         """
-        Returns the latest bar from the data feed as a tuple of:
-        ['Datetime', 'Open', 'High', 'Low', 'Close', 'Volume', 'Count', 'WAP'].
+        
+        self.events = events
+        self.csv_filename = csv_filename
+        self.chunksize = chunksize
+        self.max_lookback = max_lookback
+        self.calendar = calendar
+        self.bar_index = -1
+        self.session = None
+        
+        self.buffer = BarRingBuffer(max_lookback)
+        
+        self.reader = pd.read_csv(self.csv_filename, 
+                                  delimiter=',',
+                                  header=0,
+                                  index_col=0,
+                                  chunksize=chunksize)
+        self.chunk = None
+        self.chunk_index = 0
+        self.continue_backtest = self._next_chunk()
+        
+    def _next_chunk(self):
         """
-        for b in self.csv_data:
-            yield tuple([datetime.datetime.strptime(b[0], '%Y%m%d %H:%M:%S'), 
-                         b[1][0], b[1][1], b[1][2], b[1][3], b[1][4], b[1][5],
-                         b[1][6]])
-                         
+        Parses the next non-empty chunk of the file, returning False when the
+        file is exhausted.
+        """
+        
+        self.chunk = None
+        self.chunk_index = 0
+        for csv_data in self.reader:
+            if len(csv_data):
+                self.chunk = _convert_emini_frame(csv_data)
+                self.chunk_sessions = \
+                    self.calendar.precompute(self.chunk.datetime)
+                return True
+        self.reader.close()
+        return False
+        
     def get_latest_bars(self, N=1):
         """
-        Returns the last N bars from the latest_symbol list, or N-k if less
-        available.
+        Returns the last N bars, or N-k if less available, as a Bars tuple of
+        read-only views into the lookback buffer. At most max_lookback bars
+        are available.
         """
         
-        try:
-            bars_list = self.latest_data
-        except:
-            print("That symbol is not available in the historic data set")
-        else:
-            return bars_list[-N:]
-            
+        return self.buffer.get_latest_bars(N)
+        
+    def get_latest_session(self):
+        """
+        Returns the session of the latest bar, looked up in the arrays
+        precomputed for its chunk.
+        """
+        
+        return self.session
+        
     def update_bars(self):
         """
-        Pushes the latest bar to the latest_symbol_data structure for all symbols
-        in the symbol list.
+        Copies the next bar into the lookback buffer and places a MarketEvent
+        on the event queue, reading the next chunk when the current one has
+        been replayed.
         """
         
-        try:
-            bar = next(self._get_new_bar())
-        except StopIteration:
+        if self.chunk is None:
             self.continue_backtest = False
-        else:
-            if bar is not None:
-                self.latest_data.append(bar)
-        self.events.put(MarketEvent())
\ No newline at end of file
+            return
+            
+        self.bar_index += 1
+        self.buffer.append([column[self.chunk_index] for column in self.chunk])
+        self.session = SessionArrays(*[column[self.chunk_index]
+                                       for column in self.chunk_sessions])
+        self.chunk_index += 1
+        
+        if self.chunk_index == len(self.chunk.datetime):
+            self.continue_backtest = self._next_chunk()
+        self.events.put(MARKET_EVENT)
@@ -1,24 +1,57 @@
 #! python3
 # event.py
 
+from enum import IntEnum
+
+# IB fixed pricing, see FillEvent.calculate_ib_commission()
+IB_MIN_PER_ORDER = 1.0
+IB_COMMISSION_PER_SHARE = 0.005
+
+class EventType(IntEnum):
+    """
+    The type of an Event, used as the key for EventBus handlers.
+    """
+    
+    MARKET = 0
+    SIGNAL = 1
+    ORDER = 2
+    FILL = 3
+    
 class Event(object):
     """
     Event is base class providing an interface for all subsequent (inherited)
     events, that will trigger further events in the trading infrastructure.
+    
+    Events declare __slots__ so they carry no per-instance dict, and their
+    type is a class attribute. The slots list the constructor arguments in
+    order, which is all that is pickled when an event crosses a process
+    boundary.
     """
     
-    pass
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (self.__class__, 
+                tuple([getattr(self, name) for name in self.__slots__]))
+                
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, 
+                           ", ".join([repr(getattr(self, name)) 
+                                      for name in self.__slots__]))
     
 class MarketEvent(Event):
     """
     Handles the event of receiving a newmarket update with corresponding bars.
+    
+    A MarketEvent carries no data, so data handlers put the shared
+    MARKET_EVENT instance rather than allocating one per bar.
     """
     
-    def __init__(self):
-        """
-        Initializes the MarketEvent.
-        """
-        self.type = 'MARKET'
+    __slots__ = ()
+    type = EventType.MARKET
+    
+# Shared MarketEvent, see MarketEvent
+MARKET_EVENT = MarketEvent()
         
 class SignalEvent(Event):
     """
@@ -26,6 +59,9 @@ class SignalEvent(Event):
     received by a Portfolio object and acted upon.
     """
     
+    __slots__ = ('symbol', 'datetime', 'signal_type')
+    type = EventType.SIGNAL
+    
     def __init__(self, symbol, datetime, signal_type):
         """
         Initializes the SignalEvent.
@@ -36,7 +72,6 @@ class SignalEvent(Event):
         signal_type - 'LONG' or 'SHORT'.
         """
         
-        self.type = 'SIGNAL'
         self.symbol = symbol
         self.datetime = datetime
         self.signal_type = signal_type
@@ -48,30 +83,36 @@ class OrderEvent(Event):
     direction.
     """
     
-    def __init__(self, symbol, order_type, quantity, direction):
+    __slots__ = ('symbol', 'order_type', 'quantity', 'direction', 'price')
+    type = EventType.ORDER
+    
+    def __init__(self, symbol, order_type, quantity, direction, price=None):
         """
-        Initilizes the order type, setting whether it is a Market order ('MKT')
-        or Limit order ('LMT'), has a quantity (integral) and its direction
-        ('BUY' or 'SELL').
+        Initilizes the order type, setting whether it is a Market order ('MKT'),
+        Limit order ('LMT') or Stop order ('STP'), has a quantity (integral),
+        its direction ('BUY' or 'SELL') and, for limit and stop orders, the
+        limit or stop price.
         
         Parameters:
         symbol - The instrument to trade.
-        order_type - 'MKT' or 'LMT' for Market or Limit.
+        order_type - 'MKT', 'LMT' or 'STP' for Market, Limit or Stop.
         quantity - Non-negative integer for quantity.
         direction - 'BUY' or 'SELL' for long or short.
+        price - The limit or stop price, None for market orders.
         """
         
-        self.type = 'ORDER'
         self.symbol = symbol
         self.order_type = order_type
         self.quantity = quantity
         self.direction = direction
+        self.price = price
         
     def print_order(self):
         
         
-        print("Order: Symbol=%s, Type-%s, Quantity=%s, Direction=%s" %
-                (self.symbol, self.order_type, self.quantity, self.direction))
+        print("Order: Symbol=%s, Type-%s, Quantity=%s, Direction=%s, "
+              "Price=%s" % (self.symbol, self.order_type, self.quantity, 
+                            self.direction, self.price))
                 
 class FillEvent(Event):
     """
@@ -80,6 +121,10 @@ class FillEvent(Event):
     In addition, stores the commission of the trade from the brokerage.
     """
     
+    __slots__ = ('timeindex', 'symbol', 'exchange', 'quantity', 'direction',
+                 'fill_cost', 'commission')
+    type = EventType.FILL
+    
     def __init__(self, timeindex, symbol, exchange, quantity, direction, 
                  fill_cost, commission=None):
         """
@@ -95,11 +140,12 @@ class FillEvent(Event):
         exchange - The exchange where the order was filled.
         quantity - The filled quantity.
         direction - The direction of fill ('BUY' or 'SELL')
-        fill_cost - The holdings value in dollars.
+        fill_cost - The fill price times the quantity, in price points
+                    (e.g. index points for the e-mini), not dollars. The
+                    portfolio multiplies it by the contract multiplier.
         commission - An optional commission sent from IB.
         """
                 
-        self.type = 'FILL'
         self.timeindex = timeindex
         self.symbol = symbol
         self.exchange = exchange
@@ -124,8 +170,8 @@ class FillEvent(Event):
         https://www.interactivebrokers.com/en/index.php?f=commission&p=stocks2
         """
 
-        min_per_order = 1.0
-        commission_per_share = 0.005
+        min_per_order = IB_MIN_PER_ORDER
+        commission_per_share = IB_COMMISSION_PER_SHARE
         fill_cost = max(min_per_order, commission_per_share*self.quantity)
 
         return fill_cost
\ No newline at end of file
@@ -0,0 +1,215 @@
+#! python3
+# eventbus.py
+
+import os
+import queue
+from collections import deque
+from multiprocessing import Queue
+
+from abc import ABCMeta, abstractmethod
+
+class EventBus(object):
+    """
+    EventBus is an abstract base class providing an interface for all
+    subsequent (inherited) event buses.
+
+    The bus carries events between the DataHandler, Strategy, Portfolio and
+    ExecutionHandler objects. Handlers are registered against an event type
+    and dispatch() calls them for every queued event of that type, replacing
+    the if/elif chain on event.type in the backtest loop.
+    """
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self):
+        """
+        Initializes the handler registry.
+        """
+
+        self.handlers = {}
+        # Set by Instrumentation.attach() to time the handlers
+        self.instrumentation = None
+
+    def register(self, event_type, handler):
+        """
+        Registers a callable to be invoked with every event of event_type.
+        Handlers for the same type are called in registration order.
+
+        Parameters:
+        event_type - The event type, e.g. EventType.MARKET.
+        handler - A callable taking the event as its only argument.
+        """
+
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    @abstractmethod
+    def put(self, event):
+        """
+        Places an event on the bus. None is ignored, so callers can pass
+        through an optional event without checking it first.
+        """
+
+        raise NotImplementedError("Should implement put()")
+
+    @abstractmethod
+    def get(self):
+        """
+        Removes and returns the next event, or None if the bus is empty.
+        """
+
+        raise NotImplementedError("Should implement get()")
+
+    def qsize(self):
+        """
+        Returns the number of events waiting, or 0 if unknown.
+        """
+
+        return 0
+
+    def dispatch(self):
+        """
+        Drains the bus, calling the registered handlers for each event.
+        Events put by the handlers themselves are dispatched in the same call,
+        so a MarketEvent is followed through its signals, orders and fills
+        before returning.
+
+        Returns the number of events dispatched.
+        """
+
+        if self.instrumentation is not None:
+            return self.instrumentation.dispatch(self)
+        handlers = self.handlers
+        count = 0
+        event = self.get()
+        while event is not None:
+            for handler in handlers.get(event.type, ()):
+                handler(event)
+            count += 1
+            event = self.get()
+        return count
+
+class DequeEventBus(EventBus):
+    """
+    Synchronous, in-process event bus backed by a collections.deque.
+
+    Events are never pickled or passed through a pipe, and an empty bus is
+    detected without waiting on a timeout. This is the default for
+    single-process backtests.
+    """
+
+    def __init__(self):
+        """
+        Initializes the underlying deque.
+        """
+
+        EventBus.__init__(self)
+        self.queue = deque()
+
+    def put(self, event):
+        if event is not None:
+            self.queue.append(event)
+
+    def get(self):
+        try:
+            return self.queue.popleft()
+        except IndexError:
+            return None
+
+    def empty(self):
+        return not self.queue
+
+    def qsize(self):
+        return len(self.queue)
+
+    def dispatch(self):
+        # Inlined version of EventBus.dispatch() without the per-event get()
+        # call, as this is the hot loop of a backtest.
+        if self.instrumentation is not None:
+            return self.instrumentation.dispatch(self)
+        handlers = self.handlers
+        events = self.queue
+        popleft = events.popleft
+        count = 0
+        while events:
+            event = popleft()
+            for handler in handlers.get(event.type, ()):
+                handler(event)
+            count += 1
+        return count
+
+class QueueEventBus(EventBus):
+    """
+    Event bus backed by a multiprocessing.Queue, for when events must cross a
+    process boundary (e.g. a live data feed running in its own process).
+
+    Every event is pickled and sent through a pipe, so this is considerably
+    slower than DequeEventBus and should only be used when needed.
+
+    An event put on the queue only becomes readable once the queue's feeder
+    thread has written it to the pipe. Each event is therefore sent tagged
+    with the bus that put it, and the bus counts its own events still in
+    flight: get() blocks until those have arrived, so a fill is always
+    handled on the bar that produced it, and only events from other
+    processes are treated as absent when the pipe is empty. Every process
+    sharing the queue must put events through a QueueEventBus, and only one
+    of them may get events from it: should another consumer take this bus's
+    events, get() raises a RuntimeError once flush_timeout has passed
+    instead of waiting for them forever.
+    """
+
+    def __init__(self, events=None, timeout=0, flush_timeout=5.0):
+        """
+        Initializes the bus around a (possibly shared) multiprocessing.Queue.
+
+        Parameters:
+        events - An existing multiprocessing.Queue, or None to create one.
+        timeout - Seconds to wait for an event from another process when
+                  none of this bus's own events are in flight, 0 to not
+                  wait.
+        flush_timeout - Seconds to wait for this bus's own events in flight
+                        before concluding another consumer took them.
+        """
+
+        EventBus.__init__(self)
+        if events is None:
+            events = Queue()
+        self.queue = events
+        self.timeout = timeout
+        self.flush_timeout = flush_timeout
+        self.origin = (os.getpid(), id(self))
+        # Events put by this bus and not yet got back
+        self.pending = 0
+
+    def put(self, event):
+        if event is not None:
+            self.queue.put((self.origin, event))
+            self.pending += 1
+
+    def get(self):
+        try:
+            if self.pending:
+                origin, event = self.queue.get(True, self.flush_timeout)
+            elif self.timeout:
+                origin, event = self.queue.get(True, self.timeout)
+            else:
+                origin, event = self.queue.get_nowait()
+        except queue.Empty:
+            if self.pending:
+                raise RuntimeError("%d event(s) put on this bus never "
+                                   "arrived, another process must be "
+                                   "getting events from its queue" %
+                                   self.pending)
+            return None
+        if origin == self.origin:
+            self.pending -= 1
+        return event
+
+    def empty(self):
+        return not self.pending and self.queue.empty()
+
+    def qsize(self):
+        # Not implemented by multiprocessing.Queue on some platforms
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return 0
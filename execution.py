@@ -2,11 +2,15 @@
 # execution.py
 
 import datetime
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
 from multiprocessing import Queue
 
 from abc import ABCMeta, abstractmethod
 
-from event import FillEvent, OrderEvent
+from contracts import get_contract_spec
+from data import epoch_to_datetime, get_latest_bar
+from event import EventType, FillEvent, OrderEvent
 
 class ExecutionHandler(object):
     """
@@ -32,27 +36,40 @@ class ExecutionHandler(object):
         """
         
         raise NotImplementedError("Should implement execute_order()")
+    
+    def update(self, event):
+        """
+        Acts on a MarketEvent before the strategy sees it, e.g. to fill
+        resting orders against the new bar. Does nothing by default.
+        
+        Parameters:
+        event - A MarketEvent object.
+        """
         
+        pass
+
 class SimulatedExecutionHandler(ExecutionHandler):
     """
     The simulated execution handler simply converts all order objects into
     their equivalent fill objects automatically without latency, slippage, or
-    fill-ratio issues.
+    fill-ratio issues, at the close of the latest bar.
     
     This allows a straightforward "first go" test of any strategy, before
     implementation with a more sophisticated execution handler.
     """
     
-    def __init__(self, events):
+    def __init__(self, events, bars):
         """
         Initializes the handler, setting the event queues up internally.
         
         Parameters:
         events - The queue of Event objects.
+        bars - The DataHandler object with current market data.
         """
         
         self.events = events
-        
+        self.bars = bars
+    
     def execute_order(self, event):
         """
         Simply converts Order object into Fill objects naively, i.e. without
@@ -62,11 +79,224 @@ class SimulatedExecutionHandler(ExecutionHandler):
         event - Contains an Event object with order information.
         """
         
-        if event.type == 'ORDER':
-            fill_event = FillEvent(datetime.datetime.utcnow(),
+        if event.type == EventType.ORDER:
+            bar = get_latest_bar(self.bars, event.symbol)
+            fill_event = FillEvent(epoch_to_datetime(bar.datetime[-1]),
                                    event.symbol,
                                    'ARCA',
                                    event.quantity,
                                    event.direction,
-                                   1)
-            self.events.put(fill_event)
\ No newline at end of file
+                                   bar.close[-1]*event.quantity)
+            self.events.put(fill_event)
+
+class PriceBook(object):
+    """
+    Resting orders of one kind (e.g. buy limits) for one symbol, grouped by
+    price level.
+    
+    The levels are kept sorted, so the orders triggered by a bar are found
+    by bisecting on the bar's high or low and taking one end of the list,
+    rather than scanning every resting order.
+    """
+    
+    def __init__(self):
+        self.levels = []
+        self.orders = {}
+    
+    def __len__(self):
+        return len(self.levels)
+    
+    def add(self, order):
+        """
+        Rests an order at its price, behind any orders already there.
+        """
+        
+        if order.price not in self.orders:
+            insort(self.levels, order.price)
+            self.orders[order.price] = [order]
+        else:
+            self.orders[order.price].append(order)
+    
+    def _pop_levels(self, start, end):
+        triggered = []
+        for price in self.levels[start:end]:
+            triggered.extend(self.orders.pop(price))
+        del self.levels[start:end]
+        return triggered
+    
+    def pop_at_or_above(self, price):
+        """
+        Removes and returns the orders resting at price or higher.
+        """
+        
+        return self._pop_levels(bisect_left(self.levels, price),
+                                len(self.levels))
+    
+    def pop_at_or_below(self, price):
+        """
+        Removes and returns the orders resting at price or lower.
+        """
+        
+        return self._pop_levels(0, bisect_right(self.levels, price))
+
+class BarExecutionHandler(ExecutionHandler):
+    """
+    Simulates execution against the bars that follow an order, with latency
+    and slippage.
+    
+    An order becomes active `latency` bars after the bar it was placed on,
+    so with the default latency of 0 it is first checked against the next
+    bar:
+    
+    MKT - fills at the active bar's open (or close, see market_fill) plus
+          slippage against the order.
+    LMT - rests until the bar trades through the limit; a buy fills when
+          the low reaches the limit, at the limit or the open if that is
+          better.
+    STP - rests until the bar trades through the stop; a buy triggers when
+          the high reaches the stop and fills at the stop, or the open if
+          the bar gapped through it, plus slippage.
+    
+    Fills are stamped with the timestamp of the bar they filled on, and the
+    symbols with orders to fill on a bar are filled in alphabetical order.
+    """
+    
+    def __init__(self, events, bars, latency=0, slippage_ticks=0,
+                 specs=None, market_fill='open', exchange='GLOBEX'):
+        """
+        Initializes the handler with no pending orders.
+        
+        Parameters:
+        events - The queue of Event objects.
+        bars - The DataHandler object with current market data.
+        latency - Bars between an order being placed and becoming active.
+        slippage_ticks - Ticks by which market and stop fills are worse than
+                         the reference price, in the tick size of each
+                         symbol's contract.
+        specs - Optional dictionary of symbol to ContractSpec, overriding
+                CONTRACT_SPECS.
+        market_fill - 'open' or 'close' of the active bar for market orders.
+        exchange - Exchange name stamped on the fills.
+        """
+        
+        self.events = events
+        self.bars = bars
+        self.latency = latency
+        self.slippage_ticks = slippage_ticks
+        self.specs = specs
+        # Slippage in price points by symbol, looked up on first use
+        self.slippage = {}
+        self.market_fill = market_fill
+        self.exchange = exchange
+        
+        # (bar index at which the order becomes active, order), in the order
+        # placed, so the head is always the next to activate
+        self.pending = deque()
+        self.market_orders = {}
+        # Per symbol: (buy limits, sell limits, buy stops, sell stops)
+        self.books = {}
+    
+    def _bar_index(self):
+        return self.bars.bar_index
+    
+    def execute_order(self, event):
+        """
+        Queues an order to become active after the configured latency.
+        
+        Parameters:
+        event - Contains an Event object with order information.
+        """
+        
+        if event.type == EventType.ORDER:
+            if event.order_type not in ('MKT', 'LMT', 'STP'):
+                raise ValueError("Unsupported order type %s" %
+                                 event.order_type)
+            self.pending.append((self._bar_index() + 1 + self.latency, event))
+    
+    def _activate(self, bar_index):
+        """
+        Moves every order that is active at bar_index into the market order
+        list or its price book.
+        """
+        
+        pending = self.pending
+        while pending and pending[0][0] <= bar_index:
+            order = pending.popleft()[1]
+            if order.order_type == 'MKT':
+                self.market_orders.setdefault(order.symbol, []).append(order)
+                continue
+            
+            if order.symbol not in self.books:
+                self.books[order.symbol] = (PriceBook(), PriceBook(),
+                                            PriceBook(), PriceBook())
+            buy_limits, sell_limits, buy_stops, sell_stops = \
+                self.books[order.symbol]
+            if order.order_type == 'LMT':
+                book = buy_limits if order.direction == 'BUY' else sell_limits
+            else:
+                book = buy_stops if order.direction == 'BUY' else sell_stops
+            book.add(order)
+    
+    def _slippage(self, symbol):
+        if symbol not in self.slippage:
+            if self.slippage_ticks:
+                self.slippage[symbol] = self.slippage_ticks*get_contract_spec(
+                    symbol, self.specs).tick_size
+            else:
+                self.slippage[symbol] = 0.0
+        return self.slippage[symbol]
+    
+    def _fill(self, order, price, timeindex):
+        self.events.put(FillEvent(timeindex,
+                                  order.symbol,
+                                  self.exchange,
+                                  order.quantity,
+                                  order.direction,
+                                  price*order.quantity))
+    
+    def update(self, event):
+        """
+        Activates orders whose latency has elapsed and fills every active
+        order that the latest bar trades through.
+        
+        Parameters:
+        event - A MarketEvent object.
+        """
+        
+        if event.type != EventType.MARKET:
+            return
+        
+        self._activate(self._bar_index())
+        for symbol in sorted(set(self.market_orders) | set(self.books)):
+            bar = get_latest_bar(self.bars, symbol)
+            slippage = self._slippage(symbol)
+            timeindex = epoch_to_datetime(bar.datetime[-1])
+            close = bar.close[-1]
+            open_ = getattr(bar, 'open', bar.close)[-1]
+            high = getattr(bar, 'high', bar.close)[-1]
+            low = getattr(bar, 'low', bar.close)[-1]
+            
+            price = open_ if self.market_fill == 'open' else close
+            for order in self.market_orders.pop(symbol, ()):
+                if order.direction == 'BUY':
+                    self._fill(order, price + slippage, timeindex)
+                else:
+                    self._fill(order, price - slippage, timeindex)
+            
+            if symbol not in self.books:
+                continue
+            buy_limits, sell_limits, buy_stops, sell_stops = self.books[symbol]
+            if buy_limits:
+                for order in buy_limits.pop_at_or_above(low):
+                    self._fill(order, min(open_, order.price), timeindex)
+            if sell_limits:
+                for order in sell_limits.pop_at_or_below(high):
+                    self._fill(order, max(open_, order.price), timeindex)
+            if buy_stops:
+                for order in buy_stops.pop_at_or_below(high):
+                    self._fill(order, max(open_, order.price) + slippage,
+                               timeindex)
+            if sell_stops:
+                for order in sell_stops.pop_at_or_above(low):
+                    self._fill(order, min(open_, order.price) - slippage,
+                               timeindex)
@@ -1,60 +1,179 @@
 #! python3
 # exposure.py
 
-class ExposureManager():
+import numpy as np
 
-    def __init__(self, 
-                 target_leverage,
-                 target_long_exposure,
-                 target_short_exposure,
-                 initial_balance):
+from event import OrderEvent
+
+class ExposureManager(object):
+    """
+    Tracks the exposure and margin of a FuturesPortfolio and enforces limits
+    on the orders sent to the execution handler.
+    
+    Every bar (and fill) the long, short, gross and net notional exposure,
+    the leverage and the initial and maintenance margin are recomputed as
+    NumPy reductions over the portfolio's per-symbol arrays, so the cost is a
+    handful of vector operations however many symbols are held. Checking an
+    order then only looks at its own symbol and these totals.
+    
+    Limits are fractions of the portfolio's equity. Orders that would breach
+    one are cut down to the largest quantity that does not, or rejected if
+    that is zero; the part of an order that reduces an existing position is
+    always allowed.
+    """
+    
+    def __init__(self,
+                 portfolio,
+                 target_leverage=None,
+                 target_long_exposure=None,
+                 target_short_exposure=None,
+                 enforce_margin=True):
         """
         Initialize the ExposureManager.
         
         Parameters:
-        target_leverage - 
-        target_long_exposure -
-        target_short_exposure -
-        initial_balance -
+        portfolio - The FuturesPortfolio whose positions are checked.
+        target_leverage - Largest gross exposure as a multiple of equity, or
+                          None for no limit.
+        target_long_exposure - Largest long exposure as a multiple of equity,
+                               or None for no limit.
+        target_short_exposure - Largest short exposure as a multiple of
+                                equity, or None for no limit.
+        enforce_margin - Whether to keep the initial margin of the positions
+                         within the equity.
         """
         
-        self.buying_power = initial_balance*2.0
+        self.portfolio = portfolio
         self.target_leverage = target_leverage
         self.target_long_exposure = target_long_exposure
         self.target_short_exposure = target_short_exposure
+        self.enforce_margin = enforce_margin
         
         self.current_long_exposure = 0.0
         self.current_short_exposure = 0.0
+        self.gross_exposure = 0.0
+        self.net_exposure = 0.0
         self.current_leverage = 0.0
+        self.initial_margin = 0.0
+        self.maintenance_margin = 0.0
+        self.equity = float(portfolio.value)
+        self.buying_power = self.equity
+        self.margin_call = False
+        
+        self.resized_orders = 0
+        self.rejected_orders = 0
+    
+    def update(self, event):
+        """
+        Recomputes the exposure and margin totals from the portfolio's
+        positions and latest prices. Register after the portfolio on
+        MarketEvents and on FillEvents.
+        
+        Parameters:
+        event - A MarketEvent or FillEvent object.
+        """
+        
+        portfolio = self.portfolio
+        notional = portfolio.positions*portfolio.multiplier*portfolio.last_price
+        contracts = np.abs(portfolio.positions)
+        
+        self.current_long_exposure = float(np.maximum(notional, 0.0).sum())
+        self.current_short_exposure = float(-np.minimum(notional, 0.0).sum())
+        self.gross_exposure = self.current_long_exposure + \
+            self.current_short_exposure
+        self.net_exposure = self.current_long_exposure - \
+            self.current_short_exposure
+        self.initial_margin = float(np.dot(contracts,
+                                           portfolio.initial_margin))
+        self.maintenance_margin = float(np.dot(contracts,
+                                               portfolio.maintenance_margin))
+        
+        self.equity = float(portfolio.value)
+        self.current_leverage = self.gross_exposure/self.equity \
+            if self.equity > 0 else np.inf
+        self.buying_power = self.equity - self.initial_margin
+        self.margin_call = self.equity < self.maintenance_margin
+    
+    def calculate_current_leverage(self):
+        """
+        Returns the gross exposure as a multiple of equity.
+        """
+        
+        return self.current_leverage
+    
+    def calculate_buying_power(self):
+        """
+        Returns the equity not tied up as initial margin.
+        """
+        
+        return self.buying_power
+    
+    def _max_opening_contracts(self, slot, is_buy, closed):
+        """
+        Returns the largest number of contracts that may be opened in slot
+        after closing `closed` contracts, within every limit.
+        """
+        
+        portfolio = self.portfolio
+        equity = self.equity
+        if equity <= 0:
+            return 0
+        
+        bounds = []
+        contract_value = portfolio.last_price[slot]*portfolio.multiplier[slot]
+        if contract_value > 0:
+            # Closing contracts lowers the gross exposure before opening
+            if self.target_leverage is not None:
+                bounds.append((self.target_leverage*equity -
+                               self.gross_exposure +
+                               closed*contract_value)/contract_value)
+            if is_buy and self.target_long_exposure is not None:
+                bounds.append((self.target_long_exposure*equity -
+                               self.current_long_exposure)/contract_value)
+            if not is_buy and self.target_short_exposure is not None:
+                bounds.append((self.target_short_exposure*equity -
+                               self.current_short_exposure)/contract_value)
+        
+        margin = portfolio.initial_margin[slot]
+        if self.enforce_margin and margin > 0:
+            bounds.append((equity - self.initial_margin + closed*margin) /
+                          margin)
+        
+        if not bounds:
+            return None
+        # Allow for rounding error in the totals before taking the floor
+        return max(int(np.floor(min(bounds) + 1e-9)), 0)
+    
+    def check_order(self, order):
+        """
+        Checks an OrderEvent against the limits.
+        
+        Parameters:
+        order - The OrderEvent to check.
+        
+        Returns the order if it is within the limits, a smaller OrderEvent
+        for the quantity that is, or None if no part of it is.
+        """
+        
+        portfolio = self.portfolio
+        slot = portfolio.symbol_slot[order.symbol]
+        is_buy = order.direction == 'BUY'
+        position = int(portfolio.positions[slot])
+        
+        # Contracts of the order that reduce the current position
+        if (position < 0 and is_buy) or (position > 0 and not is_buy):
+            closed = min(order.quantity, abs(position))
+        else:
+            closed = 0
+        
+        opening = self._max_opening_contracts(slot, is_buy, closed)
+        if opening is None or closed + opening >= order.quantity:
+            return order
         
-        self.available_cash_short = 0.0
-        self.available_cash_long = 0.0
-        
-    def calculate_current_leverage(self, portfolio):
-        #total number of long positions
-        #total number of short positions
-        #total capital in portfolio
-        #return gross leverage
-        #self.current_leverage = portfolio.current_holdings/portfolio.value
-        #return self.current_leverage
-        return 1
-    def update(self, current_holdings, symbol_list):
-        self.current_long_exposure = 0
-        self.current_short_exposure = 0
-        for ticker in symbol_list:
-            if current_holdings[ticker] < 0:
-                self.current_short_exposure += abs(current_holdings[ticker])
-            elif current_holdings[ticker] > 0:
-                self.current_long_exposure += current_holdings[ticker]      
-        
-    def calculate_buying_power(self, portfolio):
-        """
-        Calculate cash based on non-day-trading margin.
-        """
-        
-        self.buying_power = portfolio.current_holdings['cash']*2.0
-        self.calculate_current_leverage(portfolio)
-        self.available_cash_short = self.buying_power*(1.0-self.current_leverage)
-        self.available_cash_long = self.buying_power
-        
-        return self.available_cash_short, self.available_cash_long
+        quantity = closed + opening
+        if quantity == 0:
+            self.rejected_orders += 1
+            return None
+        self.resized_orders += 1
+        return OrderEvent(order.symbol, order.order_type, quantity,
+                          order.direction, order.price)
@@ -0,0 +1,371 @@
+#! python3
+# indicators.py
+
+import math
+from collections import deque
+
+from abc import ABCMeta, abstractmethod
+
+class Indicator(object):
+    """
+    Indicator is an abstract base class providing an interface for all
+    subsequent (inherited) streaming indicators.
+
+    A streaming indicator is updated with one new observation per bar and
+    keeps just enough state to produce its latest value in O(1), instead of
+    recomputing over a window of history. Each indicator reproduces the
+    result of its pandas batch equivalent, noted in the class docstring.
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def update(self, value):
+        """
+        Adds the next observation and returns the latest indicator value,
+        which is also kept in self.value.
+        """
+
+        raise NotImplementedError("Should implement update()")
+
+class SMA(Indicator):
+    """
+    Simple moving average over a ring buffer with a running (Kahan
+    compensated) sum. NaN observations take their place in the window but
+    are left out of the sum and the count of observations, as in pandas.
+
+    Equivalent to Series.rolling(window, min_periods).mean().
+    """
+
+    def __init__(self, window, min_periods=None):
+        """
+        Initializes the moving average.
+
+        Parameters:
+        window - Number of observations in the average.
+        min_periods - Observations required for a value, default window.
+        """
+
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.buffer = [0.0] * window
+        self.index = 0
+        # Observations seen, up to window, and the valid ones among them
+        self.count = 0
+        self.nobs = 0
+        self.sum = 0.0
+        self.compensation = 0.0
+        self.value = float('nan')
+
+    def _add(self, value):
+        y = value - self.compensation
+        t = self.sum + y
+        self.compensation = (t - self.sum) - y
+        self.sum = t
+
+    def update(self, value):
+        if self.count == self.window:
+            old = self.buffer[self.index]
+            if old == old:
+                self.nobs -= 1
+                if self.nobs:
+                    self._add(-old)
+                else:
+                    self.sum = 0.0
+                    self.compensation = 0.0
+        else:
+            self.count += 1
+        if value == value:
+            self.nobs += 1
+            self._add(value)
+        self.buffer[self.index] = value
+        self.index = (self.index + 1) % self.window
+
+        if self.nobs >= self.min_periods and self.nobs:
+            self.value = self.sum / self.nobs
+        else:
+            self.value = float('nan')
+        return self.value
+
+class EMA(Indicator):
+    """
+    Exponentially weighted moving average, updated recursively.
+
+    Equivalent to Series.ewm(span=span, adjust=adjust).mean() (or alpha=
+    alpha), including the bias adjustment of the early values when adjust
+    is True, the pandas default. A NaN observation leaves the average
+    unchanged but still decays the weight of the earlier ones, as pandas
+    does with ignore_na=False.
+    """
+
+    def __init__(self, span=None, alpha=None, adjust=True):
+        """
+        Initializes the average from either a span or a smoothing factor.
+
+        Parameters:
+        span - Decay in terms of span, alpha = 2 / (span + 1).
+        alpha - Smoothing factor, 0 < alpha <= 1.
+        adjust - Weight early observations as pandas' adjust=True does.
+        """
+
+        if alpha is None:
+            if span is None:
+                raise ValueError("Must pass either span or alpha")
+            alpha = 2.0 / (span + 1.0)
+        self.alpha = alpha
+        self.adjust = adjust
+        self.new_weight = 1.0 if adjust else alpha
+        self.old_weight_factor = 1.0 - alpha
+        self.old_weight = 1.0
+        self.value = float('nan')
+
+    def update(self, value):
+        if self.value != self.value:
+            if value == value:
+                self.value = value
+                self.old_weight = 1.0
+        else:
+            self.old_weight *= self.old_weight_factor
+            if value == value:
+                if self.value != value:
+                    self.value = ((self.old_weight * self.value) +
+                                  (self.new_weight * value)) / \
+                                 (self.old_weight + self.new_weight)
+                if self.adjust:
+                    self.old_weight += self.new_weight
+                else:
+                    self.old_weight = 1.0
+        return self.value
+
+class RollingStd(Indicator):
+    """
+    Rolling standard deviation using Welford's online update, adding the new
+    observation and removing the one leaving the window. NaN observations
+    take their place in the window but are left out of the mean, the sum of
+    squared differences and the count of observations, as in pandas.
+
+    Equivalent to Series.rolling(window, min_periods).std(ddof=ddof).
+    """
+
+    def __init__(self, window, min_periods=None, ddof=1):
+        """
+        Initializes the rolling standard deviation.
+
+        Parameters:
+        window - Number of observations in the window.
+        min_periods - Observations required for a value, default window.
+        ddof - Delta degrees of freedom, 1 for the sample deviation.
+        """
+
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.ddof = ddof
+        self.buffer = [0.0] * window
+        self.index = 0
+        # Observations seen, up to window, and the valid ones among them
+        self.count = 0
+        self.nobs = 0
+        self.mean = 0.0
+        self.ssqdm = 0.0
+        self.value = float('nan')
+
+    def update(self, value):
+        if self.count == self.window:
+            old = self.buffer[self.index]
+            if old == old:
+                self.nobs -= 1
+                if self.nobs:
+                    delta = old - self.mean
+                    self.mean -= delta / self.nobs
+                    self.ssqdm -= ((self.nobs + 1) * delta * delta) / \
+                                  self.nobs
+                else:
+                    self.mean = 0.0
+                    self.ssqdm = 0.0
+        else:
+            self.count += 1
+
+        if value == value:
+            self.nobs += 1
+            delta = value - self.mean
+            self.mean += delta / self.nobs
+            self.ssqdm += ((self.nobs - 1) * delta * delta) / self.nobs
+        self.buffer[self.index] = value
+        self.index = (self.index + 1) % self.window
+
+        if self.nobs >= self.min_periods and self.nobs > self.ddof:
+            if self.nobs == 1:
+                self.value = 0.0
+            else:
+                self.value = math.sqrt(max(self.ssqdm, 0.0) /
+                                       (self.nobs - self.ddof))
+        else:
+            self.value = float('nan')
+        return self.value
+
+class RollingMax(Indicator):
+    """
+    Rolling maximum using a monotonic deque of (bar number, value) pairs,
+    giving amortized O(1) updates. NaN observations never enter the deque
+    and are left out of the count of observations, as in pandas.
+
+    Equivalent to Series.rolling(window, min_periods).max().
+    """
+
+    def __init__(self, window, min_periods=None):
+        """
+        Initializes the rolling maximum.
+
+        Parameters:
+        window - Number of observations in the window.
+        min_periods - Observations required for a value, default window.
+        """
+
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.candidates = deque()
+        # Whether each observation in the window is valid, as a ring buffer
+        self.valid = [False] * window
+        self.count = 0
+        self.nobs = 0
+        self.value = float('nan')
+
+    def _dominates(self, new, old):
+        return new >= old
+
+    def update(self, value):
+        index = self.count % self.window
+        if self.valid[index]:
+            self.nobs -= 1
+        candidates = self.candidates
+        if value == value:
+            while candidates and self._dominates(value, candidates[-1][1]):
+                candidates.pop()
+            candidates.append((self.count, value))
+            self.nobs += 1
+            self.valid[index] = True
+        else:
+            self.valid[index] = False
+        while candidates and candidates[0][0] <= self.count - self.window:
+            candidates.popleft()
+        self.count += 1
+
+        if self.nobs >= self.min_periods and self.nobs:
+            self.value = candidates[0][1]
+        else:
+            self.value = float('nan')
+        return self.value
+
+class RollingMin(RollingMax):
+    """
+    Rolling minimum, the mirror image of RollingMax.
+
+    Equivalent to Series.rolling(window, min_periods).min().
+    """
+
+    def _dominates(self, new, old):
+        return new <= old
+
+class VWAP(Indicator):
+    """
+    Volume weighted average price accumulated from each bar's WAP and volume.
+
+    Equivalent to (wap * volume).cumsum() / volume.cumsum() over the bars
+    with both a WAP and a volume, carried forward over missing (NaN) bars,
+    and restarted whenever reset() is called, e.g. at the start of each
+    session.
+    """
+
+    def __init__(self):
+        """
+        Initializes the cumulative sums.
+        """
+
+        self.reset()
+
+    def reset(self):
+        """
+        Restarts the accumulation from the next bar.
+        """
+
+        self.price_volume = 0.0
+        self.volume = 0
+        self.value = float('nan')
+
+    def update(self, wap, volume=1):
+        """
+        Adds a bar's WAP and volume and returns the latest VWAP. A bar with
+        no volume, or a NaN WAP or volume, leaves the VWAP unchanged.
+        """
+
+        if wap != wap or volume != volume:
+            return self.value
+        self.price_volume += wap * volume
+        self.volume += volume
+        if self.volume:
+            self.value = self.price_volume / self.volume
+        return self.value
+
+class SharedIndicator(Indicator):
+    """
+    Wraps an indicator shared by several strategies replaying the same data
+    handler. The first update() of a bar updates the wrapped indicator and
+    later ones on the same bar return its value, so however many strategies
+    use it the indicator is updated once per bar.
+
+    Every strategy must update it with the same observation, e.g. the close.
+    """
+
+    def __init__(self, indicator, bars):
+        """
+        Parameters:
+        indicator - The Indicator object to share.
+        bars - The DataHandler object whose bar_index marks a new bar.
+        """
+
+        self.indicator = indicator
+        self.bars = bars
+        self.bar_index = None
+        self.value = indicator.value
+
+    def update(self, value):
+        if self.bars.bar_index != self.bar_index:
+            self.bar_index = self.bars.bar_index
+            self.value = self.indicator.update(value)
+        return self.value
+
+class IndicatorRegistry(object):
+    """
+    Hands out one SharedIndicator per symbol, price field, indicator class
+    and parameters, so strategies fed by the same data handler, e.g. by
+    multiplex.py, share the indicators they have in common instead of each
+    computing its own.
+    """
+
+    def __init__(self, bars):
+        """
+        Parameters:
+        bars - The DataHandler object shared by the strategies.
+        """
+
+        self.bars = bars
+        self.indicators = {}
+
+    def get(self, symbol, field, indicator_class, *args, **kwargs):
+        """
+        Returns the SharedIndicator for indicator_class(*args, **kwargs)
+        observing field of symbol, creating it on first use.
+
+        Parameters:
+        symbol - The symbol whose bars the indicator is updated with.
+        field - The bar field it is updated with, e.g. 'close'.
+        indicator_class - The Indicator class.
+        args, kwargs - The indicator's parameters.
+        """
+
+        key = (symbol, field, indicator_class, args,
+               tuple(sorted(kwargs.items())))
+        if key not in self.indicators:
+            self.indicators[key] = SharedIndicator(
+                indicator_class(*args, **kwargs), self.bars)
+        return self.indicators[key]
@@ -0,0 +1,538 @@
+#! python3
+# live.py
+
+import asyncio
+import datetime
+import logging
+import threading
+import time
+import zoneinfo
+
+import backtest
+import data
+import eventbus
+import execution
+import portfolio
+import strategy
+
+from data import (BarAggregator, BarRingBuffer, DataHandler,
+                  epoch_to_datetime)
+from event import MARKET_EVENT, EventType, FillEvent
+from execution import ExecutionHandler
+from sessions import CME_CALENDAR
+
+logger = logging.getLogger(__name__)
+
+# Broker callbacks are delivered to the trading loop as tuples:
+#   ('tick', symbol, timestamp, price, size)
+#   ('bar', symbol, (timestamp, open, high, low, close, volume, count, wap))
+#   ('partial', symbol, (timestamp, open, high, low, close, volume, count,
+#                        wap))
+#   ('fill', order_id, timestamp, price, quantity)
+#   ('next_order_id', order_id)
+#   ('end',)
+# where timestamps are naive exchange-local epoch seconds, as in the bar
+# arrays. A 'partial' bar is shorter than the bars being built, e.g. a
+# 5-second real time bar. The trading loop calls broker.acknowledge(message)
+# after handling each message.
+
+# Time zone of the bar data, the session calendar and the strategies'
+# trading windows
+EXCHANGE_TIMEZONE = zoneinfo.ZoneInfo('America/Chicago')
+
+def to_exchange_time(timestamp, timezone=EXCHANGE_TIMEZONE):
+    """
+    Converts UTC epoch seconds, as reported by a broker, into the naive
+    exchange-local epoch seconds used by the bar data.
+
+    Parameters:
+    timestamp - Seconds since the epoch in UTC.
+    timezone - The exchange's time zone.
+    """
+
+    offset = datetime.datetime.fromtimestamp(timestamp, timezone).utcoffset()
+    return int(timestamp + offset.total_seconds())
+
+def execution_time_to_exchange_time(text, tws_timezone,
+                                     timezone=EXCHANGE_TIMEZONE):
+    """
+    Converts the time of an IB execution report, e.g. '20161215  14:05:12'
+    or '20161215 14:05:12 US/Central', into the naive exchange-local epoch
+    seconds used by the bar data.
+
+    Parameters:
+    text - The execution's m_time.
+    tws_timezone - Time zone TWS reports the time in when the text names
+                   none, that of the TWS login.
+    timezone - The exchange's time zone.
+    """
+
+    parts = text.split()
+    if len(parts) > 2:
+        tws_timezone = zoneinfo.ZoneInfo(parts[2])
+    reported = datetime.datetime.strptime(' '.join(parts[:2]),
+                                          '%Y%m%d %H:%M:%S')
+    return to_exchange_time(int(reported.replace(tzinfo=tws_timezone)
+                                .timestamp()), timezone)
+
+def create_ib_order(order):
+    """
+    Creates the ibpy Order for an OrderEvent, with the limit price of a LMT
+    order or the trigger price of a STP order. ibpy is imported on first
+    use.
+    """
+
+    from ib.ext.Order import Order
+
+    ib_order = Order()
+    ib_order.m_orderType = order.order_type
+    ib_order.m_totalQuantity = order.quantity
+    ib_order.m_action = order.direction
+    if order.order_type == 'LMT':
+        ib_order.m_lmtPrice = order.price
+    elif order.order_type == 'STP':
+        ib_order.m_auxPrice = order.price
+    return ib_order
+
+class CallbackBridge(object):
+    """
+    Thread-safe bridge from broker callbacks, which arrive on the broker's
+    own thread, into an asyncio.Queue owned by the trading loop.
+    """
+
+    def __init__(self, loop, queue):
+        """
+        Parameters:
+        loop - The asyncio event loop running the trading loop.
+        queue - The asyncio.Queue the trading loop consumes.
+        """
+
+        self.loop = loop
+        self.queue = queue
+
+    def __call__(self, message):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+class LiveDataHandler(DataHandler):
+    """
+    Data handler fed by broker callbacks instead of a file.
+
+    Ticks are aggregated into bars on the fly and completed bars are kept in
+    a BarRingBuffer, so strategies and portfolios read them exactly as in a
+    backtest.
+    """
+
+    def __init__(self, events, bar_seconds=60, max_lookback=1000,
+                 calendar=CME_CALENDAR):
+        """
+        Parameters:
+        events - The Event Queue.
+        bar_seconds - Length of the bars built from ticks.
+        max_lookback - Most bars get_latest_bars() can return.
+        calendar - The SessionCalendar classifying each bar as it arrives.
+        """
+
+        self.events = events
+        self.aggregator = BarAggregator(bar_seconds)
+        self.buffer = BarRingBuffer(max_lookback)
+        self.calendar = calendar
+        self.session = None
+        self.bar_index = -1
+        self.continue_backtest = True
+
+    def get_latest_bars(self, N=1):
+        """
+        Returns the last N completed bars as a Bars tuple of read-only views.
+        """
+
+        return self.buffer.get_latest_bars(N)
+
+    def get_latest_session(self):
+        """
+        Returns the session of the latest bar, classified when it arrived.
+        """
+
+        return self.session
+
+    def update_bars(self):
+        """
+        Bars arrive from the broker, see on_tick() and on_bar().
+        """
+
+        pass
+
+    def on_bar(self, bar):
+        """
+        Adds a completed bar and places a MarketEvent on the queue.
+
+        Parameters:
+        bar - Tuple of values in BAR_FIELDS order.
+        """
+
+        self.buffer.append(bar)
+        self.session = self.calendar.classify(bar[0])
+        self.bar_index += 1
+        self.events.put(MARKET_EVENT)
+
+    def on_tick(self, timestamp, price, size):
+        """
+        Adds a trade, releasing the previous bar if the tick starts a new
+        one.
+        """
+
+        bar = self.aggregator.add_tick(timestamp, price, size)
+        if bar is not None:
+            self.on_bar(bar)
+
+    def on_partial_bar(self, bar):
+        """
+        Adds a bar shorter than bar_seconds, releasing the previous bar if
+        this one starts a new one.
+        """
+
+        bar = self.aggregator.add_bar(bar)
+        if bar is not None:
+            self.on_bar(bar)
+
+    def flush(self):
+        """
+        Releases the bar in progress, e.g. when the feed ends.
+        """
+
+        bar = self.aggregator.flush()
+        if bar is not None:
+            self.on_bar(bar)
+
+class LiveExecutionHandler(ExecutionHandler):
+    """
+    Sends orders to a broker and turns the broker's fill callbacks into
+    FillEvents.
+    """
+
+    def __init__(self, events, broker, exchange='GLOBEX'):
+        """
+        Parameters:
+        events - The queue of Event objects.
+        broker - The broker connection, with place_order(order_id, order).
+        exchange - Exchange name stamped on the fills.
+        """
+
+        self.events = events
+        self.broker = broker
+        self.exchange = exchange
+        # Seeded from the broker's next valid id, see set_next_order_id()
+        self.next_order_id = 1
+        # Order id -> [order, quantity still to fill]
+        self.open_orders = {}
+
+    def execute_order(self, event):
+        """
+        Sends an Order event to the broker.
+
+        Parameters:
+        event - Contains an Event object with order information.
+        """
+
+        if event.type == EventType.ORDER:
+            order_id = self.next_order_id
+            self.next_order_id += 1
+            self.open_orders[order_id] = [event, event.quantity]
+            self.broker.place_order(order_id, event)
+
+    def set_next_order_id(self, order_id):
+        """
+        Sets the id of the next order from the broker's next valid id, never
+        reusing an id already sent.
+        """
+
+        self.next_order_id = max(self.next_order_id, order_id)
+
+    def on_fill(self, order_id, timestamp, price, quantity):
+        """
+        Places a FillEvent on the queue for a (possibly partial) fill.
+        Executions of orders this handler did not send, or has seen fill
+        completely, are logged and ignored.
+        """
+
+        open_order = self.open_orders.get(order_id)
+        if open_order is None:
+            logger.warning("Ignoring execution of unknown order %s: %s at %s",
+                           order_id, quantity, price)
+            return
+        order = open_order[0]
+        open_order[1] -= quantity
+        if open_order[1] <= 0:
+            del self.open_orders[order_id]
+        self.events.put(FillEvent(epoch_to_datetime(timestamp),
+                                  order.symbol,
+                                  self.exchange,
+                                  quantity,
+                                  order.direction,
+                                  price*quantity))
+
+class LiveTrader(object):
+    """
+    Runs the strategy, portfolio and execution objects used in backtest.py
+    against a live broker connection on an asyncio event loop.
+    """
+
+    def __init__(self, broker, events, bars, strategy, portfolio, execution,
+                 risk_stage=None):
+        """
+        Parameters:
+        broker - The broker connection, see FakeBroker for the interface.
+        events - The EventBus shared by the components.
+        bars - A LiveDataHandler.
+        strategy - The Strategy object.
+        portfolio - The Portfolio object.
+        execution - A LiveExecutionHandler.
+        risk_stage - Optional PreTradeRiskStage sending orders on to
+                     execution.
+        """
+
+        self.broker = broker
+        self.events = events
+        self.bars = bars
+        self.strategy = strategy
+        self.portfolio = portfolio
+        self.execution = execution
+        backtest.register_handlers(events, strategy, portfolio, execution,
+                                   risk_stage)
+
+    async def run(self):
+        """
+        Consumes broker messages until the feed ends, dispatching the events
+        each one produces before awaiting the next.
+        """
+
+        queue = asyncio.Queue()
+        self.broker.register(CallbackBridge(asyncio.get_running_loop(),
+                                            queue))
+        self.broker.start()
+        try:
+            while True:
+                message = await queue.get()
+                kind = message[0]
+                if kind == 'tick':
+                    self.bars.on_tick(*message[2:])
+                elif kind == 'bar':
+                    self.bars.on_bar(message[2])
+                elif kind == 'partial':
+                    self.bars.on_partial_bar(message[2])
+                elif kind == 'fill':
+                    self.execution.on_fill(*message[1:])
+                elif kind == 'next_order_id':
+                    self.execution.set_next_order_id(message[1])
+                elif kind == 'end':
+                    self.bars.flush()
+                    self.events.dispatch()
+                    break
+                self.events.dispatch()
+                self.broker.acknowledge(message)
+        finally:
+            self.broker.stop()
+
+class FakeBroker(object):
+    """
+    Local stand-in for a broker connection that replays an e-mini CSV file
+    from a background thread, for running the live pipeline without TWS.
+
+    Each bar is sent either whole or as four ticks (open, high, low, close)
+    15 seconds apart, at `speed` bars per second of wall time (None for as
+    fast as possible). The replay waits for the trading loop to acknowledge
+    each message before sending the next, so orders fill immediately at the
+    price of the message they were placed on and a replay is deterministic:
+    sending whole bars reproduces backtest.run_backtest().
+    """
+
+    def __init__(self, csv_filename, symbol='ES', speed=None, ticks=True):
+        """
+        Parameters:
+        csv_filename - Path to the CSV file to replay.
+        symbol - Symbol of the replayed instrument.
+        speed - Bars per second, or None for no delay.
+        ticks - Send each bar as ticks rather than as a bar.
+        """
+
+        self.columns = data.load_emini_csv(csv_filename)
+        self.symbol = symbol
+        self.speed = speed
+        self.ticks = ticks
+        self.callbacks = []
+        self.last_price = None
+        self.last_timestamp = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # Released by acknowledge() once the loop has handled a message
+        self.handled = threading.Semaphore(0)
+        self.thread = None
+
+    def register(self, callback):
+        self.callbacks.append(callback)
+
+    def _send(self, message):
+        for callback in self.callbacks:
+            callback(message)
+
+    def _send_and_wait(self, message):
+        self._send(message)
+        while not self.stopped.is_set():
+            if self.handled.acquire(timeout=0.1):
+                break
+
+    def acknowledge(self, message):
+        """
+        Called by the trading loop after handling a message, releasing the
+        replay to send the next one.
+        """
+
+        if message[0] in ('tick', 'bar'):
+            self.handled.release()
+
+    def _trade(self, timestamp, price):
+        with self.lock:
+            self.last_timestamp = timestamp
+            self.last_price = price
+
+    def _replay(self):
+        rows = zip(*[column.tolist() for column in self.columns])
+        for bar in rows:
+            if self.stopped.is_set():
+                break
+            timestamp, open_, high, low, close, volume = bar[:6]
+            if self.ticks:
+                size = volume // 4
+                prices = (open_, high, low, close)
+                sizes = (size, size, size, volume - 3*size)
+                for i, (price, tick_size) in enumerate(zip(prices, sizes)):
+                    self._trade(timestamp + 15*i, price)
+                    self._send_and_wait(('tick', self.symbol,
+                                         timestamp + 15*i, price, tick_size))
+            else:
+                self._trade(timestamp, close)
+                self._send_and_wait(('bar', self.symbol, bar))
+            if self.speed:
+                time.sleep(1.0 / self.speed)
+        self._send(('end',))
+
+    def start(self):
+        self.thread = threading.Thread(target=self._replay, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def place_order(self, order_id, order):
+        with self.lock:
+            timestamp, price = self.last_timestamp, self.last_price
+        self._send(('fill', order_id, timestamp, price, order.quantity))
+
+class IBBroker(object):
+    """
+    Broker connection to Interactive Brokers' TWS through ibpy, with the
+    same interface as FakeBroker.
+
+    Streams 5-second real time bars for the contract, which LiveDataHandler
+    aggregates into longer bars, and reports executions as fills. Bar times
+    arrive in UTC and execution times in the time zone of the TWS login, and
+    both are converted to the exchange's time zone. ibpy is only imported
+    when connecting.
+    """
+
+    def __init__(self, contract, symbol='ES', port=7497, client_id=100,
+                 timezone=EXCHANGE_TIMEZONE, tws_timezone=None):
+        """
+        Parameters:
+        contract - The ibpy Contract to trade, see IBpy_test.py.
+        symbol - Symbol used for the contract's bars and orders.
+        port - TWS port.
+        client_id - TWS client id.
+        timezone - Time zone of the exchange, and of the bar data.
+        tws_timezone - Time zone of the TWS login, in which it reports
+                       execution times, default timezone.
+        """
+
+        self.contract = contract
+        self.symbol = symbol
+        self.port = port
+        self.client_id = client_id
+        self.timezone = timezone
+        self.tws_timezone = timezone if tws_timezone is None else tws_timezone
+        self.callbacks = []
+        self.connection = None
+        # Ids of the executions reported, as TWS may repeat execDetails
+        self.executions = set()
+
+    def register(self, callback):
+        self.callbacks.append(callback)
+
+    def _send(self, message):
+        for callback in self.callbacks:
+            callback(message)
+
+    def acknowledge(self, message):
+        pass
+
+    def _on_realtime_bar(self, msg):
+        self._send(('partial', self.symbol,
+                    (to_exchange_time(int(msg.time), self.timezone),
+                     msg.open, msg.high, msg.low, msg.close,
+                     msg.volume, msg.count, msg.wap)))
+
+    def _on_next_valid_id(self, msg):
+        self._send(('next_order_id', msg.orderId))
+
+    def _on_execution(self, msg):
+        execution = msg.execution
+        if execution.m_execId in self.executions:
+            return
+        self.executions.add(execution.m_execId)
+        self._send(('fill', execution.m_orderId,
+                    execution_time_to_exchange_time(execution.m_time,
+                                                    self.tws_timezone,
+                                                    self.timezone),
+                    execution.m_price, execution.m_shares))
+
+    def start(self):
+        from ib.opt import Connection, message
+
+        self.connection = Connection.create(port=self.port,
+                                            clientId=self.client_id)
+        self.connection.connect()
+        self.connection.register(self._on_next_valid_id, message.nextValidId)
+        self.connection.register(self._on_realtime_bar, message.realtimeBar)
+        self.connection.register(self._on_execution, message.execDetails)
+        self.connection.reqRealTimeBars(1, self.contract, 5, 'TRADES', 0)
+
+    def stop(self):
+        if self.connection is not None:
+            self.connection.disconnect()
+
+    def place_order(self, order_id, order):
+        self.connection.placeOrder(order_id, self.contract,
+                                   create_ib_order(order))
+
+def run_fake_session(csv_filename='1weekemini.csv', speed=None, ticks=True,
+                     initial_capital=100000):
+    """
+    Runs SMAtoEMA live against a FakeBroker replaying csv_filename.
+
+    Returns the portfolio at the end of the replay.
+    """
+
+    events = eventbus.DequeEventBus()
+    bars = LiveDataHandler(events)
+    broker = FakeBroker(csv_filename, speed=speed, ticks=ticks)
+    es_portfolio = portfolio.EMiniPortfolio(bars, events,
+                                            datetime.datetime.now(),
+                                            initial_capital)
+    sma_to_ema = strategy.SMAtoEMA(bars, events)
+    trader = LiveTrader(broker, events, bars, sma_to_ema, es_portfolio,
+                        LiveExecutionHandler(events, broker))
+    asyncio.run(trader.run())
+    return es_portfolio
+
+if __name__ == "__main__":
+    es_portfolio = run_fake_session(speed=2000, ticks=False)
+    print("position: %s" % es_portfolio.es_positions)
+    print("cash: %s" % es_portfolio.cash)
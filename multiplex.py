@@ -0,0 +1,176 @@
+#! python3
+# multiplex.py
+
+import inspect
+import pandas as pd
+
+import backtest
+import eventbus
+import resultcache
+
+from event import EventType
+from indicators import IndicatorRegistry
+from sweep import expand_grid
+
+# Settings that decide the bars replayed, which every multiplexed backtest
+# must share
+DATA_KEYS = ('csv_filename', 'cache_dir', 'chunksize')
+
+class FanOut(object):
+    """
+    Stands in for the event bus of a data handler feeding several
+    backtests, putting each MarketEvent on every backtest's own bus.
+    """
+
+    def __init__(self):
+        self.buses = []
+
+    def put(self, event):
+        for events in self.buses:
+            events.put(event)
+
+class Stack(object):
+    """
+    One backtest of a multiplexed run: its own event bus, strategy,
+    portfolio, execution handler and risk stage, on the shared data
+    handler.
+    """
+
+    def __init__(self, settings, bars, indicators=None):
+        """
+        Parameters:
+        settings - The full config of the backtest.
+        bars - The shared DataHandler object.
+        indicators - Optional IndicatorRegistry shared by the strategies.
+        """
+
+        self.settings = settings
+        self.events = eventbus.DequeEventBus()
+        self.strategy, self.portfolio, self.broker, self.risk_stage = \
+            backtest.create_components(settings, bars, self.events,
+                                       indicators)
+        self.fills = []
+        self.events.register(EventType.FILL, self.fills.append)
+        backtest.register_handlers(self.events, self.strategy,
+                                   self.portfolio, self.broker,
+                                   self.risk_stage)
+
+    def results(self):
+        return backtest.collect_results(self.settings, self.portfolio,
+                                        self.fills)
+
+def _accepts_indicators(strategy_class):
+    """
+    Returns whether a strategy's constructor takes an indicators registry.
+    """
+
+    try:
+        parameters = inspect.signature(strategy_class).parameters
+    except (TypeError, ValueError):
+        return False
+    return 'indicators' in parameters
+
+def run_multiplexed(configs, columns=None, share_indicators=True):
+    """
+    Runs several backtests over one pass of the data: a single data handler
+    releases each bar once and every backtest handles it on its own event
+    bus, so N backtests cost one replay of the data plus N sets of per-bar
+    updates instead of N replays. Strategies that take an indicators
+    registry, like SMAtoEMA, share the indicators they have in common.
+
+    Backtests found in the result cache (see resultcache.py) are not run,
+    and nothing is replayed if all of them are. Every backtest uses an
+    in-process event bus, whatever its multiprocess_events setting.
+
+    Parameters:
+    configs - List of configs, see backtest.DEFAULT_CONFIG, all replaying
+              the same data.
+    columns - Optional Bars tuple of already loaded bar arrays, used instead
+              of reading the csv_filename of the configs.
+    share_indicators - Share indicators between the strategies.
+
+    Returns the list of results of backtest.run_backtest(), in the order of
+    configs.
+    """
+
+    settings = []
+    for config in configs:
+        run_settings = dict(backtest.DEFAULT_CONFIG)
+        run_settings.update(config)
+        settings.append(run_settings)
+    if not settings:
+        return []
+    for run_settings in settings[1:]:
+        for key in DATA_KEYS:
+            if run_settings[key] != settings[0][key]:
+                raise ValueError("Multiplexed backtests must replay the same "
+                                 "data, got %s %r and %r" %
+                                 (key, settings[0][key], run_settings[key]))
+
+    results = [None]*len(settings)
+    caches = [None]*len(settings)
+    for i, run_settings in enumerate(settings):
+        if run_settings['result_cache'] is not None:
+            cache = resultcache.ResultCache(run_settings['result_cache'],
+                                            run_settings['result_cache_size'])
+            key = resultcache.result_key(run_settings, columns)
+            cached = cache.load(key)
+            if cached is not None:
+                results[i] = cached['results']
+            else:
+                caches[i] = (cache, key)
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    fan_out = FanOut()
+    bars = backtest.create_data_handler(settings[pending[0]], fan_out,
+                                        columns)
+    registry = IndicatorRegistry(bars) if share_indicators else None
+
+    stacks = []
+    for i in pending:
+        indicators = registry if _accepts_indicators(
+            settings[i]['strategy']) else None
+        stack = Stack(settings[i], bars, indicators)
+        fan_out.buses.append(stack.events)
+        stacks.append(stack)
+
+    buses = fan_out.buses
+    while bars.continue_backtest:
+        bars.update_bars()
+        for events in buses:
+            events.dispatch()
+
+    for i, stack in zip(pending, stacks):
+        results[i] = stack.results()
+        if caches[i] is not None:
+            cache, key = caches[i]
+            cache.store(key, results[i], stack.portfolio.get_history(),
+                        stack.fills)
+    return results
+
+def run_multiplexed_grid(config, grid, columns=None, share_indicators=True):
+    """
+    Runs a backtest for every combination in grid over one pass of the
+    data, the single-process counterpart of sweep.run_sweep().
+
+    Parameters:
+    config - Base config shared by every run, see backtest.DEFAULT_CONFIG.
+    grid - Dictionary mapping strategy parameter names to lists of values.
+    columns - Optional Bars tuple of already loaded bar arrays.
+    share_indicators - Share indicators between the strategies.
+
+    Returns a DataFrame with one row of parameters and results per run.
+    """
+
+    settings = dict(backtest.DEFAULT_CONFIG)
+    settings.update(config)
+    return pd.DataFrame(run_multiplexed(expand_grid(settings, grid), columns,
+                                        share_indicators))
+
+if __name__ == "__main__":
+    results = run_multiplexed_grid(backtest.DEFAULT_CONFIG,
+                                   {'sma_window': [10, 20, 30, 50],
+                                    'ema_span': [5, 9, 15]})
+    print(results.sort_values('total', ascending=False).to_string())
@@ -0,0 +1,225 @@
+#! python3
+# performance.py
+
+import numpy as np
+
+from sessions import CME_CALENDAR
+
+TRADING_DAYS = 252
+
+def estimate_periods_per_year(datetime, trading_days=TRADING_DAYS,
+                              calendar=CME_CALENDAR):
+    """
+    Estimates the number of bars per year from the bar timestamps, as the
+    average number of bars per trading session times the trading days in a
+    year. For 1-minute e-mini bars this counts the overnight session, giving
+    about 1365*252 rather than the 390*252 of an equity day session.
+
+    Parameters:
+    datetime - Array of bar timestamps in epoch seconds.
+    trading_days - Trading sessions per year.
+    calendar - The SessionCalendar mapping bar times to sessions.
+    """
+
+    sessions = np.unique(calendar.session_id(np.asarray(datetime)))
+    return trading_days*len(datetime)/float(max(len(sessions), 1))
+
+def create_returns(total):
+    """
+    Returns the simple returns of the equity between consecutive bars, one
+    row shorter than total.
+
+    Parameters:
+    total - Array of portfolio values, one row per bar and optionally one
+            column per backtest.
+    """
+
+    total = np.asarray(total, dtype=np.float64)
+    return total[1:]/total[:-1] - 1.0
+
+def create_sharpe_ratio(returns, periods):
+    """
+    Create the Sharpe ratio for the strategy, based on a benchmark of zero
+    (i.e. no risk-free rate information).
+
+    Parameters:
+    returns - Array of per-bar returns, optionally one column per backtest.
+    periods - Bars per year, see estimate_periods_per_year().
+    """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(periods)*np.mean(returns, axis=0) / \
+            np.std(returns, axis=0, ddof=1)
+
+def create_sortino_ratio(returns, periods):
+    """
+    Create the Sortino ratio for the strategy, i.e. the Sharpe ratio with
+    the standard deviation replaced by the downside deviation below zero.
+
+    Parameters:
+    returns - Array of per-bar returns, optionally one column per backtest.
+    periods - Bars per year, see estimate_periods_per_year().
+    """
+
+    downside = np.sqrt(np.mean(np.minimum(returns, 0.0)**2, axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(periods)*np.mean(returns, axis=0)/downside
+
+def create_drawdowns(total):
+    """
+    Calculate the largest peak-to-trough drawdown of the equity curve and
+    the duration of the longest drawdown.
+
+    Parameters:
+    total - Array of portfolio values, optionally one column per backtest.
+
+    Returns the maximum drawdown as a fraction of the high-water mark and
+    the longest time below the high-water mark in bars.
+    """
+
+    total = np.asarray(total, dtype=np.float64)
+    high_water_mark = np.maximum.accumulate(total, axis=0)
+    drawdown = 1.0 - total/high_water_mark
+
+    # Bars since the last high-water mark
+    index = np.arange(len(total)).reshape((-1,) + (1,)*(total.ndim - 1))
+    last_peak = np.maximum.accumulate(
+        np.where(total >= high_water_mark, index, 0), axis=0)
+    duration = index - last_peak
+    return drawdown.max(axis=0), duration.max(axis=0)
+
+def create_calmar_ratio(total, periods, max_drawdown):
+    """
+    Create the Calmar ratio, the annualised return divided by the maximum
+    drawdown.
+
+    Parameters:
+    total - Array of portfolio values, optionally one column per backtest.
+    periods - Bars per year, see estimate_periods_per_year().
+    max_drawdown - Maximum drawdown, see create_drawdowns().
+    """
+
+    total = np.asarray(total, dtype=np.float64)
+    years = (len(total) - 1)/float(periods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annual_return = (total[-1]/total[0])**(1.0/years) - 1.0
+        return annual_return/max_drawdown
+
+def create_turnover(cash, commission, total, periods, initial_capital):
+    """
+    Create the annualised turnover, the notional value traded per year as a
+    multiple of the average equity. The notional traded on each bar is the
+    change in cash not explained by commission, so contract multipliers need
+    no special handling.
+
+    Parameters:
+    cash - Array of cash held after each bar, optionally one column per
+           backtest.
+    commission - Array of commission paid on each bar, shaped like cash.
+    total - Array of portfolio values, shaped like cash.
+    periods - Bars per year, see estimate_periods_per_year().
+    initial_capital - The cash held before the first bar.
+    """
+
+    cash = np.asarray(cash, dtype=np.float64)
+    traded = np.abs(np.diff(cash, axis=0, prepend=initial_capital) +
+                    commission)
+    years = len(cash)/float(periods)
+    return traded.sum(axis=0)/np.mean(total, axis=0)/years
+
+def create_exposure(positions):
+    """
+    Returns the fraction of bars on which a position is held.
+
+    Parameters:
+    positions - Array of positions held after each bar, optionally one
+                column per backtest.
+    """
+
+    return np.count_nonzero(positions, axis=0)/float(len(positions))
+
+def create_trade_statistics(positions, total):
+    """
+    Splits the equity curve into trades, a trade being a run of bars over
+    which the same non-zero position is held (so a reversal closes one trade
+    and opens another), and returns the number of trades, the win rate and
+    the average PnL per trade. The commission of a position change is
+    charged to the position being exited, and a position still open on the
+    last bar counts as a trade marked to market.
+
+    Parameters:
+    positions - Array of positions held after each bar, optionally one
+                column per backtest.
+    total - Array of portfolio values, shaped like positions.
+    """
+
+    positions = np.asarray(positions)
+    shape = positions.shape[1:]
+    num_bars = len(positions)
+    positions = positions.reshape(num_bars, -1)
+    total = np.asarray(total, dtype=np.float64).reshape(num_bars, -1)
+    num_columns = positions.shape[1]
+
+    # The PnL of each bar belongs to the position held going into it
+    held = np.concatenate([np.zeros((1, num_columns), positions.dtype),
+                           positions[:-1]])
+    pnl = np.diff(total, axis=0, prepend=total[:1])
+    trade_id = np.cumsum(np.diff(held, axis=0, prepend=held[:1]) != 0, axis=0)
+
+    # Sum the PnL of every trade of every column in one pass, giving each
+    # column its own range of trade ids
+    ids = (trade_id + num_bars*np.arange(num_columns)).ravel()
+    size = num_bars*num_columns
+    trade_pnl = np.bincount(ids, weights=pnl.ravel(), minlength=size)
+    is_trade = np.bincount(ids, weights=(held != 0).ravel(),
+                           minlength=size) > 0
+    trade_pnl = trade_pnl.reshape(num_columns, num_bars)
+    is_trade = is_trade.reshape(num_columns, num_bars)
+
+    num_trades = is_trade.sum(axis=1)
+    wins = ((trade_pnl > 0) & is_trade).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        win_rate = wins/num_trades.astype(np.float64)
+        average = np.where(is_trade, trade_pnl, 0.0).sum(axis=1)/num_trades
+    return (num_trades.reshape(shape), win_rate.reshape(shape),
+            average.reshape(shape))
+
+def create_summary(datetime, positions, cash, commission, total,
+                   initial_capital, periods=None):
+    """
+    Computes every statistic in this module from the equity arrays of one
+    or more backtests, e.g. EMiniPortfolio.get_history() or the result of
+    vectorized.run_vectorized(). Passing 2-D arrays with one column per
+    backtest scores them all at once, each statistic then being an array
+    with one value per column.
+
+    Parameters:
+    datetime - Array of bar timestamps in epoch seconds.
+    positions - Array of positions held after each bar.
+    cash - Array of cash held after each bar, shaped like positions.
+    commission - Array of commission paid on each bar, shaped like
+                 positions (not the cumulative commission).
+    total - Array of portfolio values, shaped like positions.
+    initial_capital - The cash held before the first bar.
+    periods - Bars per year, estimated from datetime if None.
+
+    Returns a dictionary of the statistics.
+    """
+
+    if periods is None:
+        periods = estimate_periods_per_year(datetime)
+    returns = create_returns(total)
+    max_drawdown, drawdown_duration = create_drawdowns(total)
+    num_trades, win_rate, average_trade = \
+        create_trade_statistics(positions, total)
+    return {'sharpe': create_sharpe_ratio(returns, periods),
+            'sortino': create_sortino_ratio(returns, periods),
+            'max_drawdown': max_drawdown,
+            'drawdown_duration': drawdown_duration,
+            'calmar': create_calmar_ratio(total, periods, max_drawdown),
+            'turnover': create_turnover(cash, commission, total, periods,
+                                        initial_capital),
+            'trades': num_trades,
+            'win_rate': win_rate,
+            'average_trade': average_trade,
+            'exposure': create_exposure(positions)}
@@ -2,6 +2,7 @@
 # portfolio.py
 
 import datetime
+import logging
 import numpy as np
 import pandas as pd
 from multiprocessing import Queue
@@ -9,7 +10,10 @@ from multiprocessing import Queue
 from abc import ABCMeta, abstractmethod
 from math import floor
 
-from event import FillEvent, OrderEvent
+from contracts import get_contract_spec
+from event import EventType, FillEvent, OrderEvent
+
+logger = logging.getLogger(__name__)
 
 class Portfolio(object):
     """
@@ -28,7 +32,7 @@ class Portfolio(object):
         """
         
         raise NotImplementedError("Should implement update_signal()")
-        
+    
     @abstractmethod
     def update_fill(self, event):
         """
@@ -36,13 +40,36 @@ class Portfolio(object):
         """
         
         raise NotImplementedError("Should implement update_fill()")
-        
-class EMiniPortfolio(Portfolio):
+
+# Per-bar history recorded by FuturesPortfolio, with the dtype of each column.
+# The positions column has one entry per symbol.
+HISTORY_DTYPES = (('datetime', np.int64),
+                  ('positions', np.int64),
+                  ('cash', np.float64),
+                  ('holdings', np.float64),
+                  ('commission', np.float64),
+                  ('realized_pnl', np.float64),
+                  ('unrealized_pnl', np.float64),
+                  ('total', np.float64))
+
+class FuturesPortfolio(Portfolio):
     """
-    E-mini S&P500
+    Portfolio of futures contracts on any number of symbols.
+    
+    Each symbol has a slot (see symbol_slot) in arrays holding its position,
+    average entry price, realized PnL and contract specification, so a fill
+    updates one slot in O(1) and marking to market is a few array operations
+    over all symbols. Cash is debited the notional value (price times
+    quantity times multiplier) of every purchase and credited that of every
+    sale, so the total is cash plus the notional value of the positions.
+    
+    The positions, cash, holdings, cumulative commission, PnL and total value
+    at the close of every bar are recorded into preallocated NumPy arrays
+    that double in size when full, see create_equity_curve_dataframe().
     """
     
-    def __init__(self, bars, events, start_date, initial_capital):
+    def __init__(self, bars, events, start_date, initial_capital,
+                 symbol_list=None, specs=None, quantity=1):
         """
         Initializes the portfolio with bars and event queue. Also includes a
         starting datetime index and intial capital (USD).
@@ -52,37 +79,150 @@ class EMiniPortfolio(Portfolio):
         events - The Event Queue object.
         start_date - The start date (bar) of the portfolio.
         initial_capital - The starting capital in USD.
+        symbol_list - Symbols traded, by default those of bars.
+        specs - Optional dictionary of symbol to ContractSpec, overriding
+                CONTRACT_SPECS.
+        quantity - Contracts ordered per signal.
         """
         
         self.bars = bars
         self.events = events
         self.start_date = start_date
         self.initial_capital = initial_capital
-        self.es_positions = 0
-        self.es_holdings = 0
-             
+        self.quantity = quantity
+        
+        if symbol_list is None:
+            symbol_list = bars.symbol_list
+        self.symbol_list = list(symbol_list)
+        self.symbol_slot = dict((s, i) for i, s in enumerate(self.symbol_list))
+        
+        contract_specs = [get_contract_spec(s, specs) for s in self.symbol_list]
+        self.multiplier = np.array([c.multiplier for c in contract_specs])
+        self.tick_size = np.array([c.tick_size for c in contract_specs])
+        self.initial_margin = np.array([c.initial_margin
+                                        for c in contract_specs])
+        self.maintenance_margin = np.array([c.maintenance_margin
+                                            for c in contract_specs])
+        
+        num_symbols = len(self.symbol_list)
+        self.positions = np.zeros(num_symbols, dtype=np.int64)
+        self.avg_cost = np.zeros(num_symbols)
+        self.realized_pnl = np.zeros(num_symbols)
+        self.unrealized_pnl = np.zeros(num_symbols)
+        self.last_price = np.zeros(num_symbols)
+        
+        # Slots of the portfolio's symbols in a multi-symbol data handler
+        if hasattr(bars, 'symbol_slot'):
+            self.bar_slots = np.array([bars.symbol_slot[s]
+                                       for s in self.symbol_list])
+        else:
+            self.bar_slots = None
+        
         self.debt = 0
         self.cash = initial_capital
+        self.holdings = 0.0
         self.value = initial_capital
+        self.commission = 0.0
+        
+        # Preallocate the history for the whole replay when its length is
+        # known, otherwise grow it as needed
+        capacity = max(getattr(bars, 'num_bars', 0), 1024)
+        self.history = {}
+        for name, dtype in HISTORY_DTYPES:
+            if name == 'positions':
+                self.history[name] = np.zeros((capacity, num_symbols), dtype)
+            else:
+                self.history[name] = np.zeros(capacity, dtype)
+        self.history_size = 0
+    
+    def get_position(self, symbol):
+        """
+        Returns the number of contracts held in symbol, negative if short.
+        """
+        
+        return int(self.positions[self.symbol_slot[symbol]])
+    
+    def get_margin(self):
+        """
+        Returns the initial and maintenance margin required by the current
+        positions.
+        """
+        
+        contracts = np.abs(self.positions)
+        return (float(np.dot(contracts, self.initial_margin)),
+                float(np.dot(contracts, self.maintenance_margin)))
+    
+    def _grow_history(self):
+        """
+        Doubles the capacity of the history arrays.
+        """
+        
+        for name, column in self.history.items():
+            grown = np.zeros((2*len(column),) + column.shape[1:],
+                             dtype=column.dtype)
+            grown[:len(column)] = column
+            self.history[name] = grown
+    
+    def _mark_to_market(self):
+        """
+        Updates the latest price, unrealized PnL and holdings of every symbol
+        from the latest closes. Returns the latest bar timestamp.
+        """
+        
+        if self.bar_slots is None:
+            bars = self.bars.get_latest_bars(N=1)
+            self.last_price[:] = bars.close[-1]
+            timestamp = bars.datetime[-1]
+        else:
+            prices = self.bars.get_latest_bar_values('close')[self.bar_slots]
+            # Keep the last known price of symbols with no bar yet
+            np.copyto(self.last_price, prices, where=~np.isnan(prices))
+            timestamp = self.bars.datetime[self.bars.bar_index]
+        
+        contract_value = self.positions*self.multiplier
+        self.unrealized_pnl = contract_value*(self.last_price - self.avg_cost)
+        self.holdings = float(np.dot(contract_value, self.last_price))
+        self.value = self.cash + self.holdings
+        return timestamp
+    
+    def _record_history(self, row):
+        """
+        Marks the positions to the latest closes and writes the current state
+        into the given row of the history.
+        """
+        
+        timestamp = self._mark_to_market()
         
+        history = self.history
+        history['datetime'][row] = timestamp
+        history['positions'][row] = self.positions
+        history['cash'][row] = self.cash
+        history['holdings'][row] = self.holdings
+        history['commission'][row] = self.commission
+        history['realized_pnl'][row] = self.realized_pnl.sum()
+        history['unrealized_pnl'][row] = self.unrealized_pnl.sum()
+        history['total'][row] = self.value
+    
     def update(self, event):
         """
         Adds a new record to the positions matrix for the current market data
         bar. This reflects the PREVIOUS bar, i.e. all current market data at
         this stage is known (OLHCVI).
         
-        Makes use of a MarketEvent from the events queue.
+        Makes use of a MarketEvent from the events queue. Fills later in the
+        same bar update this record, so it holds the state at the close.
         """
         
-        bars = self.bars.get_latest_bars(N=1)
-        price_close = bars[0][4]
-        self.es_holdings = self.es_positions * price_close
-        
-        
+        if event.type == EventType.MARKET:
+            if self.history_size == len(self.history['total']):
+                self._grow_history()
+            self._record_history(self.history_size)
+            self.history_size += 1
+    
     def update_positions_from_fill(self, fill):
         """
-        Takes a FillEvent object and updates the positions matrix to reflect
-        the new position.
+        Takes a FillEvent object and updates the position, average entry
+        price and realized PnL of its symbol.
         
         Parameters:
         fill - The FillEvent object to update the positions with.
@@ -94,10 +234,34 @@ class EMiniPortfolio(Portfolio):
             fill_dir = 1
         if fill.direction == 'SELL':
             fill_dir = -1
-            
-        # Update positions list with new quantities
-        self.es_positions += fill_dir*fill.quantity
         
+        # A fill of nothing, e.g. a zero-quantity execution report, leaves
+        # the position and its average price as they are
+        quantity = fill_dir*fill.quantity
+        if quantity == 0:
+            return
+        
+        slot = self.symbol_slot[fill.symbol]
+        price = fill.fill_cost/fill.quantity
+        position = int(self.positions[slot])
+        new_position = position + quantity
+        
+        if position == 0 or (position > 0) == (quantity > 0):
+            # Opening or adding: average the entry price
+            self.avg_cost[slot] = (self.avg_cost[slot]*abs(position) +
+                                   price*abs(quantity))/abs(new_position)
+        else:
+            # Reducing, closing or reversing: realize the closed contracts
+            closed = min(abs(quantity), abs(position))
+            direction = 1 if position > 0 else -1
+            self.realized_pnl[slot] += direction*closed * \
+                (price - self.avg_cost[slot])*self.multiplier[slot]
+            if new_position == 0:
+                self.avg_cost[slot] = 0.0
+            elif (new_position > 0) != (position > 0):
+                self.avg_cost[slot] = price
+        self.positions[slot] = new_position
+    
     def update_holdings_from_fill(self, fill):
         """
         Takes a FillEvent object and updates the holdings matrix to reflect the
@@ -111,27 +275,29 @@ class EMiniPortfolio(Portfolio):
         fill_dir = 0
         if fill.direction == 'BUY':
             fill_dir = 1
-            buy_price = self.bars.get_latest_bars(N=1)[0][4] # Close price
-            #self.cash -= abs(fill_dir * buy_price * fill.quantity)
         if fill.direction == 'SELL':
             fill_dir = -1
-            buy_price = self.bars.get_latest_bars(N=1)[0][4] # Close price
-            #self.debt += abs(fill_dir * buy_price * fill.quantity)
-        self.cash -= fill.commission    
-        # Update holdings list with new quanities
-        fill_cost = self.bars.get_latest_bars(N=1)[0][4] # Close price
-        cost = fill_dir * fill_cost * fill.quantity
+        self.cash -= fill.commission
+        self.commission += fill.commission
+        # Update holdings list with the value the execution handler filled at
+        multiplier = self.multiplier[self.symbol_slot[fill.symbol]]
+        cost = fill_dir * fill.fill_cost * multiplier
         self.cash -= cost
-        print(cost)
-        print(self.cash)    
+        logger.info("Fill: %s %s %s, cost=%.2f commission=%.2f cash=%.2f",
+                    fill.direction, fill.quantity, fill.symbol, cost,
+                    fill.commission, self.cash)
+    
     def update_fill(self, event):
         """
         Updates the portfolio current positions and holdings from a FillEvent.
         """
         
-        if event.type == 'FILL':
+        if event.type == EventType.FILL:
             self.update_positions_from_fill(event)
             self.update_holdings_from_fill(event)
+            if self.history_size:
+                self._record_history(self.history_size - 1)
+    
     def generate_naive_order(self, signal):
         """
         Simply transacts an OrderEvent object as a constant quantity sizing of
@@ -147,38 +313,85 @@ class EMiniPortfolio(Portfolio):
         direction = signal.signal_type
         strength = 1
         
-        mkt_quantity = floor(1*strength)
-        cur_quantity = self.es_positions
+        mkt_quantity = floor(self.quantity*strength)
+        cur_quantity = self.get_position(symbol)
         order_type = 'MKT'
         
         if direction == 'LONG':
             order = OrderEvent(symbol, order_type, mkt_quantity, 'BUY')
         if direction == 'SHORT':
             order = OrderEvent(symbol, order_type, mkt_quantity, 'SELL')
-            
+        
         if direction == 'EXIT' and cur_quantity > 0:
             order = OrderEvent(symbol, order_type, abs(cur_quantity), 'SELL')
         if direction == 'EXIT' and cur_quantity < 0:
             order = OrderEvent(symbol, order_type, abs(cur_quantity), 'BUY')
         return order
-        
+    
     def update_signal(self, event):
         """
         Acts on a SignalEvent to generate new orders based on the portfolio
         logic.
         """
         
-        if event.type == 'SIGNAL':
+        if event.type == EventType.SIGNAL:
             order_event = self.generate_naive_order(event)
             self.events.put(order_event)
-            
+    
+    def get_history(self):
+        """
+        Returns the recorded history as a dictionary of arrays, one entry per
+        bar, without copying. The positions are a (bars x symbols) array.
+        """
+        
+        return dict((name, column[:self.history_size])
+                    for name, column in self.history.items())
+    
     def create_equity_curve_dataframe(self):
         """
-        Creates a pandas DataFrame from the all_holdings list of dictionaries.
+        Creates a pandas DataFrame from the history arrays, indexed by bar
+        datetime, with one position column per symbol and adding the returns
+        and the equity curve (growth of 1.0).
         """
         
-        curve = pd.DataFrame(self.all_holdings)
-        curve.set_index('datetime', inplace=True)
+        history = self.get_history()
+        index = pd.to_datetime(history.pop('datetime'), unit='s')
+        positions = history.pop('positions')
+        curve = pd.DataFrame(history, index=index)
+        for slot, symbol in enumerate(self.symbol_list):
+            curve[symbol] = positions[:, slot]
+        curve.index.name = 'datetime'
         curve['returns'] = curve['total'].pct_change()
-        curve['equity_curve'] = (1.0*curve['returns'].cumprod())
+        curve['equity_curve'] = (1.0 + curve['returns'].fillna(0.0)).cumprod()
         self.equity_curve = curve
+        return curve
+
+class EMiniPortfolio(FuturesPortfolio):
+    """
+    E-mini S&P500
+    
+    A FuturesPortfolio trading only ES, from a single-instrument data handler.
+    """
+    
+    def __init__(self, bars, events, start_date, initial_capital):
+        """
+        Initializes the portfolio with bars and event queue. Also includes a
+        starting datetime index and intial capital (USD).
+        
+        Parameters:
+        bars - The DataHandler objext with current market data.
+        events - The Event Queue object.
+        start_date - The start date (bar) of the portfolio.
+        initial_capital - The starting capital in USD.
+        """
+        
+        FuturesPortfolio.__init__(self, bars, events, start_date,
+                                  initial_capital, symbol_list=['ES'])
+    
+    @property
+    def es_positions(self):
+        return int(self.positions[0])
+    
+    @property
+    def es_holdings(self):
+        return self.holdings
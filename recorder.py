@@ -0,0 +1,138 @@
+#! python3
+# recorder.py
+
+import csv
+import datetime
+import os
+import time
+import numpy as np
+
+from data import BAR_RECORD_DTYPE, epoch_to_datetime, load_bar_records
+
+# Header and timestamp format of the e-mini CSV files, as sent by IB
+CSV_HEADER = ['Datetime', 'Open', 'High', 'Low', 'Close', 'Volume', 'Count',
+              'WAP']
+CSV_DATETIME_FORMAT = '%Y%m%d  %H:%M:%S'
+
+def ib_date_to_epoch(date):
+    """
+    Converts an IB bar date string, e.g. '20160915  17:00:00', to epoch
+    seconds.
+    """
+
+    dt = datetime.datetime.strptime(date, '%Y%m%d %H:%M:%S')
+    return int((dt - datetime.datetime(1970, 1, 1)).total_seconds())
+
+class BarRecorder(object):
+    """
+    Appends bars from any source (e.g. IB historicalData messages) to a CSV
+    file in the e-mini format or to a binary file of BAR_RECORD_DTYPE
+    records.
+
+    The file is opened once, bars are batched in memory and written when
+    flush_rows bars are waiting or flush_seconds have passed since the last
+    write, and bars whose timestamp has already been recorded (in this
+    session or already in the file) are dropped, so overlapping historical
+    requests do not produce duplicates.
+    """
+
+    def __init__(self, filename, binary=False, flush_rows=1000,
+                 flush_seconds=5.0):
+        """
+        Opens filename for appending, reading the timestamps it already
+        holds.
+
+        Parameters:
+        filename - Path of the file to append to.
+        binary - Write BAR_RECORD_DTYPE records instead of CSV rows.
+        flush_rows - Bars to batch before writing.
+        flush_seconds - Longest time a bar waits before being written.
+        """
+
+        self.filename = filename
+        self.binary = binary
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.recorded = self._read_recorded()
+        self.last_flush = time.monotonic()
+
+        if binary:
+            self.file = open(filename, 'ab')
+        else:
+            new_file = not os.path.exists(filename) or \
+                os.path.getsize(filename) == 0
+            self.file = open(filename, 'a', newline='')
+            self.writer = csv.writer(self.file)
+            if new_file:
+                self.writer.writerow(CSV_HEADER)
+
+    def _read_recorded(self):
+        """
+        Returns the set of timestamps already in the file.
+        """
+
+        if not os.path.exists(self.filename) or \
+           os.path.getsize(self.filename) == 0:
+            return set()
+        if self.binary:
+            return set(load_bar_records(self.filename).datetime.tolist())
+
+        recorded = set()
+        with open(self.filename, newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if row:
+                    recorded.add(ib_date_to_epoch(row[0]))
+        return recorded
+
+    def record(self, bar):
+        """
+        Adds a bar unless its timestamp has already been recorded, writing
+        the batch if it is due.
+
+        Parameters:
+        bar - Tuple of values in BAR_FIELDS order, with the timestamp in
+              epoch seconds.
+        """
+
+        timestamp = int(bar[0])
+        if timestamp not in self.recorded:
+            self.recorded.add(timestamp)
+            self.rows.append(tuple(bar))
+
+        if len(self.rows) >= self.flush_rows or \
+           time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the batched bars and flushes the file.
+        """
+
+        if self.rows:
+            if self.binary:
+                np.array(self.rows, dtype=BAR_RECORD_DTYPE).tofile(self.file)
+            else:
+                self.writer.writerows(
+                    [[epoch_to_datetime(row[0]).strftime(CSV_DATETIME_FORMAT)]
+                     + list(row[1:]) for row in self.rows])
+            self.rows = []
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Writes any batched bars and closes the file.
+        """
+
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
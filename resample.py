@@ -0,0 +1,174 @@
+#! python3
+# resample.py
+
+from data import BarAggregator, BarRingBuffer, DataHandler
+from sessions import CME_CALENDAR
+
+# Length in seconds of the named timeframes
+TIMEFRAMES = {'5min': 300,
+              '15min': 900,
+              '30min': 1800,
+              '60min': 3600,
+              'daily': 86400}
+
+class BarResampler(object):
+    """
+    Builds bars of several longer timeframes from a stream of shorter bars,
+    e.g. 5, 15, 30 and 60-minute and daily bars from 1-minute bars, as each
+    input bar arrives.
+
+    Every timeframe has a BarAggregator holding its bar in progress and a
+    BarRingBuffer of its completed bars, so an input bar costs O(1) per
+    timeframe. A bar is completed as soon as the input bar ending its period
+    arrives, or by the first input bar of the next period if the last one is
+    missing. Intraday bars are aligned on the clock (the 60-minute bars
+    start on the hour) and daily bars on the session open. A daily bar's
+    period ends at the session close of the calendar, early on the early
+    close dates, so it is completed by the session's last input bar.
+    """
+
+    def __init__(self, timeframes=('5min', '15min', '30min', '60min',
+                                   'daily'),
+                 input_seconds=60, max_lookback=1000,
+                 calendar=CME_CALENDAR):
+        """
+        Parameters:
+        timeframes - Names from TIMEFRAMES or lengths in seconds.
+        input_seconds - Length of the input bars.
+        max_lookback - Most completed bars kept per timeframe.
+        calendar - The SessionCalendar whose sessions the daily bars
+                   cover.
+        """
+
+        self.input_seconds = input_seconds
+        self.calendar = calendar
+        self.timeframes = list(timeframes)
+        self.aggregators = []
+        self.buffers = {}
+        for timeframe in self.timeframes:
+            seconds = TIMEFRAMES.get(timeframe, timeframe)
+            offset = calendar.session_offset if seconds % 86400 == 0 else 0
+            self.aggregators.append((timeframe, BarAggregator(seconds, offset),
+                                     seconds == 86400))
+            self.buffers[timeframe] = BarRingBuffer(max_lookback)
+        # Timeframes whose bar was completed by the latest input bar
+        self.completed = []
+
+    def add_bar(self, bar):
+        """
+        Adds an input bar to every timeframe.
+
+        Parameters:
+        bar - Tuple of values in BAR_FIELDS order.
+
+        Returns the list of timeframes that completed a bar.
+        """
+
+        completed = self.completed = []
+        end = bar[0] + self.input_seconds
+        for timeframe, aggregator, daily in self.aggregators:
+            previous = aggregator.add_bar(bar)
+            if previous is not None:
+                self.buffers[timeframe].append(previous)
+                completed.append(timeframe)
+            period_end = aggregator.start + aggregator.bar_seconds
+            if daily:
+                period_end = min(period_end,
+                                 self.calendar.session_close(aggregator.start))
+            if end >= period_end:
+                self.buffers[timeframe].append(aggregator.flush())
+                if previous is None:
+                    completed.append(timeframe)
+        return completed
+
+    def flush(self):
+        """
+        Completes the bar in progress of every timeframe, e.g. at the end of
+        the data. Returns the list of timeframes that completed a bar.
+        """
+
+        completed = self.completed = []
+        for timeframe, aggregator, daily in self.aggregators:
+            bar = aggregator.flush()
+            if bar is not None:
+                self.buffers[timeframe].append(bar)
+                completed.append(timeframe)
+        return completed
+
+    def get_latest_bars(self, timeframe, N=1):
+        """
+        Returns the last N completed bars of timeframe as a Bars tuple of
+        read-only views.
+        """
+
+        return self.buffers[timeframe].get_latest_bars(N)
+
+class MultiTimeframeHandler(DataHandler):
+    """
+    Wraps a single-instrument data handler, resampling each bar it releases
+    into longer timeframes before the MarketEvent is dispatched, so a
+    strategy can read several timeframes in one pass over the data.
+
+    get_latest_bars(N) returns the wrapped handler's bars as before, and
+    get_latest_bars(N, timeframe) the completed bars of a longer timeframe.
+    completed lists the timeframes whose bar closed on the latest bar.
+    """
+
+    def __init__(self, bars, timeframes=('5min', '15min', '30min', '60min',
+                                         'daily'),
+                 input_seconds=60, max_lookback=1000, calendar=None):
+        """
+        Parameters:
+        bars - The wrapped DataHandler, e.g. an EMiniCSVHandler.
+        timeframes - Names from TIMEFRAMES or lengths in seconds.
+        input_seconds - Length of the wrapped handler's bars.
+        max_lookback - Most completed bars kept per timeframe.
+        calendar - The SessionCalendar whose sessions the daily bars
+                   cover, default the wrapped handler's.
+        """
+
+        self.bars = bars
+        self.events = bars.events
+        if calendar is None:
+            calendar = getattr(bars, 'calendar', CME_CALENDAR)
+        self.resampler = BarResampler(timeframes, input_seconds,
+                                      max_lookback, calendar)
+
+    def __getattr__(self, name):
+        # Everything else, e.g. continue_backtest, bar_index or num_bars, is
+        # the wrapped handler's
+        if name == 'bars':
+            raise AttributeError(name)
+        return getattr(self.bars, name)
+
+    @property
+    def completed(self):
+        return self.resampler.completed
+
+    def get_latest_bars(self, N=1, timeframe=None):
+        """
+        Returns the last N bars of the wrapped handler, or the last N
+        completed bars of timeframe, as a Bars tuple of read-only views.
+        """
+
+        if timeframe is None:
+            return self.bars.get_latest_bars(N)
+        return self.resampler.get_latest_bars(timeframe, N)
+
+    def update_bars(self):
+        """
+        Releases the next bar of the wrapped handler and adds it to every
+        timeframe. Once the wrapped handler runs out of bars the bars still
+        in progress are completed, so the last partial bar of each timeframe
+        is available with the last MarketEvent.
+        """
+
+        bar_index = self.bars.bar_index
+        self.bars.update_bars()
+        completed = []
+        if self.bars.bar_index != bar_index:
+            latest = self.bars.get_latest_bars(N=1)
+            completed = self.resampler.add_bar([column[-1]
+                                                for column in latest])
+        if not self.bars.continue_backtest:
+            self.resampler.completed = completed + self.resampler.flush()
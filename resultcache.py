@@ -0,0 +1,275 @@
+#! python3
+# resultcache.py
+
+import datetime
+import hashlib
+import inspect
+import io
+import json
+import os
+import tempfile
+import zipfile
+import numpy as np
+
+import data
+
+# Bump to invalidate every stored result, e.g. when the layout changes
+RESULT_CACHE_VERSION = 1
+
+# Modules whose code decides the result of a backtest, besides the modules
+# of the strategy and execution classes named in its config
+ENGINE_MODULES = ('backtest', 'contracts', 'data', 'event', 'eventbus',
+                  'execution', 'exposure', 'indicators', 'performance',
+                  'portfolio', 'risk', 'sessions', 'strategy')
+
+# Config keys that change how a backtest runs but not its result
+IGNORED_KEYS = ('csv_filename', 'cache_dir', 'chunksize',
+                'multiprocess_events', 'instrument', 'result_cache',
+                'result_cache_size')
+
+FILL_DTYPE = np.dtype([('datetime', np.int64),
+                       ('symbol', 'U16'),
+                       ('exchange', 'U16'),
+                       ('quantity', np.int64),
+                       ('direction', 'U4'),
+                       ('fill_cost', np.float64),
+                       ('commission', np.float64)])
+
+# SHA-1 of files already hashed by this process, keyed by path, size and
+# modification time
+_file_digests = {}
+_engine_digest = None
+
+def _source_sha1(filename):
+    """
+    Returns the SHA-1 of a file's contents, hashing it only once per
+    process while its size and modification time are unchanged.
+    """
+
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (filename, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_digests:
+        _file_digests[key] = data._file_sha1(filename)
+    return _file_digests[key]
+
+def engine_fingerprint():
+    """
+    Returns a hash of the source of ENGINE_MODULES, so editing the portfolio
+    or the event loop invalidates the stored results.
+    """
+
+    global _engine_digest
+    if _engine_digest is None:
+        digest = hashlib.sha1(str(RESULT_CACHE_VERSION).encode('utf-8'))
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in ENGINE_MODULES:
+            digest.update(_source_sha1(os.path.join(directory,
+                                                    '%s.py' % name))
+                          .encode('utf-8'))
+        _engine_digest = digest.hexdigest()
+    return _engine_digest
+
+def class_fingerprint(cls):
+    """
+    Returns the qualified name of a class followed by a hash of the source
+    files of the modules defining it and its base classes, so editing
+    module-level code they use, e.g. strategy.TRADING_WINDOW, changes it.
+    Classes whose source is not available contribute their name alone.
+    """
+
+    digest = hashlib.sha1()
+    for base in inspect.getmro(cls):
+        if base is object:
+            continue
+        try:
+            digest.update(_source_sha1(inspect.getsourcefile(base))
+                          .encode('utf-8'))
+        except (OSError, TypeError):
+            digest.update(base.__qualname__.encode('utf-8'))
+    return '%s.%s:%s' % (cls.__module__, cls.__qualname__, digest.hexdigest())
+
+def data_fingerprint(settings, columns=None):
+    """
+    Returns the SHA-1 of the bars a backtest replays: of the column arrays
+    when they are passed in, otherwise of the CSV file's contents, taken
+    from the bar cache's meta.json when a cache_dir is configured.
+    """
+
+    if columns is not None:
+        digest = hashlib.sha1()
+        for column in columns:
+            digest.update(np.ascontiguousarray(column).data)
+        return digest.hexdigest()
+    if settings.get('cache_dir') is not None:
+        return data.load_cache_meta(settings['csv_filename'],
+                                    settings['cache_dir'])['sha1']
+    return _source_sha1(settings['csv_filename'])
+
+def _canonical(value):
+    """
+    Converts a config value into plain JSON values with a stable order.
+    """
+
+    if isinstance(value, type):
+        return class_fingerprint(value)
+    if isinstance(value, dict):
+        return sorted((str(k), _canonical(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def result_key(settings, columns=None):
+    """
+    Returns the cache key of a backtest: a hash of the bar data, the engine
+    code, the strategy and execution classes and every setting that can
+    change the result.
+
+    Parameters:
+    settings - The full config of the backtest, see backtest.DEFAULT_CONFIG.
+    columns - Optional Bars tuple replayed instead of the CSV file.
+    """
+
+    key = {'data': data_fingerprint(settings, columns),
+           'engine': engine_fingerprint(),
+           'settings': _canonical(dict((k, v) for k, v in settings.items()
+                                       if k not in IGNORED_KEYS))}
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=repr)
+                        .encode('utf-8')).hexdigest()
+
+def fills_to_records(fills):
+    """
+    Converts a list of FillEvents into a FILL_DTYPE array.
+    """
+
+    records = np.zeros(len(fills), dtype=FILL_DTYPE)
+    for i, fill in enumerate(fills):
+        timeindex = fill.timeindex
+        if isinstance(timeindex, datetime.datetime):
+            timeindex = (timeindex - data.EPOCH).total_seconds()
+        records[i] = (int(timeindex), fill.symbol, fill.exchange,
+                      fill.quantity, fill.direction, fill.fill_cost,
+                      fill.commission)
+    return records
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+class ResultCache(object):
+    """
+    Persistent store of backtest results in a directory, one compressed
+    .npz file per result holding the per-bar history of the portfolio, the
+    fills and the summary statistics.
+
+    Entries are written to a temporary file and renamed into place, so
+    concurrent sweeps never read a partly written result. Loading an entry
+    touches its modification time, and storing one evicts the least
+    recently used entries until the directory is within max_bytes.
+    """
+
+    def __init__(self, directory='.resultcache', max_bytes=256*2**20):
+        """
+        Parameters:
+        directory - Directory holding the entries, created when needed.
+        max_bytes - Largest total size of the entries.
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.npz' % key)
+
+    def load(self, key):
+        """
+        Returns the entry stored under key, or None if there is none.
+
+        The entry is a dictionary of the 'results' dictionary returned by
+        backtest.run_backtest(), the per-bar 'history' arrays of the
+        portfolio and the 'fills' as a FILL_DTYPE array.
+        """
+
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                arrays = dict(entry.items())
+            results = json.loads(str(arrays.pop('results')))
+            fills = arrays.pop('fills')
+            os.utime(path)
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            # Missing, evicted meanwhile, empty or corrupt
+            return None
+        return {'results': results, 'history': arrays, 'fills': fills}
+
+    def store(self, key, results, history, fills):
+        """
+        Stores the result of a backtest under key and evicts old entries.
+
+        Parameters:
+        key - The result_key() of the backtest.
+        results - The dictionary returned by backtest.run_backtest().
+        history - Dictionary of per-bar arrays, e.g. from
+                  FuturesPortfolio.get_history().
+        fills - List of FillEvents.
+        """
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer,
+                            results=np.array(json.dumps(
+                                dict((k, _plain(v))
+                                     for k, v in results.items()))),
+                            fills=fills_to_records(fills), **history)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, self.path(key))
+        except:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size of the
+        rest is at most max_bytes.
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                # Another process evicted it first
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, name))
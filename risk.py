@@ -0,0 +1,356 @@
+#! python3
+# risk.py
+
+from collections import deque
+
+from abc import ABCMeta, abstractmethod
+
+from data import get_latest_bar
+from event import EventType, OrderEvent
+from sessions import CME_CALENDAR
+
+class RiskCheck(object):
+    """
+    RiskCheck is an abstract base class providing an interface for the
+    pre-trade checks run by a PreTradeRiskStage.
+
+    A check sees every order before it reaches the execution handler and
+    returns it unchanged, returns a smaller order, or rejects it. Checks keep
+    running counters updated from the events they see, so checking an order
+    is O(1).
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def check(self, order, timestamp):
+        """
+        Checks an order.
+
+        Parameters:
+        order - The OrderEvent to check.
+        timestamp - Epoch seconds of the latest bar.
+
+        Returns the order, a smaller OrderEvent, or None to reject it.
+        """
+
+        raise NotImplementedError("Should implement check()")
+
+    def on_order(self, order, timestamp):
+        """
+        Records an order that passed every check and was sent on. Does
+        nothing by default.
+        """
+
+        pass
+
+    def update(self, event, timestamp):
+        """
+        Acts on a MarketEvent or FillEvent. Does nothing by default.
+        """
+
+        pass
+
+def _limit_for(limit, symbol):
+    """
+    Returns the limit of symbol from a single limit or a dictionary of
+    per-symbol limits, or None if there is none.
+    """
+
+    if isinstance(limit, dict):
+        return limit.get(symbol)
+    return limit
+
+def _resize(order, quantity):
+    """
+    Returns order, or a copy of it for the given smaller quantity, or None
+    if the quantity is not positive.
+    """
+
+    if quantity >= order.quantity:
+        return order
+    if quantity <= 0:
+        return None
+    return OrderEvent(order.symbol, order.order_type, quantity,
+                      order.direction, order.price)
+
+class MaxPositionCheck(RiskCheck):
+    """
+    Keeps the absolute position of each symbol, counting orders sent but
+    not yet filled, within a limit. Orders that would exceed it are cut
+    down to the quantity that reaches it.
+    """
+
+    def __init__(self, portfolio, max_position):
+        """
+        Parameters:
+        portfolio - The Portfolio object, for the current positions.
+        max_position - Largest number of contracts held in a symbol, or a
+                       dictionary of symbol to limit.
+        """
+
+        self.portfolio = portfolio
+        self.max_position = max_position
+        # Net signed quantity of orders sent but not yet filled, per symbol
+        self.working = {}
+
+    def check(self, order, timestamp):
+        limit = _limit_for(self.max_position, order.symbol)
+        if limit is None:
+            return order
+        sign = 1 if order.direction == 'BUY' else -1
+        position = self.portfolio.get_position(order.symbol) + \
+            self.working.get(order.symbol, 0)
+        return _resize(order, limit - sign*position)
+
+    def on_order(self, order, timestamp):
+        sign = 1 if order.direction == 'BUY' else -1
+        self.working[order.symbol] = self.working.get(order.symbol, 0) + \
+            sign*order.quantity
+
+    def update(self, event, timestamp):
+        if event.type == EventType.FILL and event.symbol in self.working:
+            sign = 1 if event.direction == 'BUY' else -1
+            self.working[event.symbol] -= sign*event.quantity
+
+class MaxOrderSizeCheck(RiskCheck):
+    """
+    Rejects orders for more than a maximum quantity, e.g. a mistyped size.
+    """
+
+    def __init__(self, max_quantity):
+        """
+        Parameters:
+        max_quantity - Largest quantity of a single order, or a dictionary
+                       of symbol to limit.
+        """
+
+        self.max_quantity = max_quantity
+
+    def check(self, order, timestamp):
+        limit = _limit_for(self.max_quantity, order.symbol)
+        if limit is not None and order.quantity > limit:
+            return None
+        return order
+
+class OrderRateCheck(RiskCheck):
+    """
+    Rejects orders once max_orders have been sent within the last period
+    seconds. The times of the recent orders are kept in a deque, so each
+    order is appended once and dropped once.
+    """
+
+    def __init__(self, max_orders, period=60):
+        """
+        Parameters:
+        max_orders - Orders allowed within any period.
+        period - Length of the window in seconds.
+        """
+
+        self.max_orders = max_orders
+        self.period = period
+        self.sent = deque()
+
+    def check(self, order, timestamp):
+        sent = self.sent
+        while sent and timestamp - sent[0] >= self.period:
+            sent.popleft()
+        if len(sent) >= self.max_orders:
+            return None
+        return order
+
+    def on_order(self, order, timestamp):
+        self.sent.append(timestamp)
+
+class PriceBandCheck(RiskCheck):
+    """
+    Rejects limit and stop orders priced more than a fraction away from the
+    latest close, e.g. a mistyped price. Market orders pass.
+    """
+
+    def __init__(self, bars, band=0.05):
+        """
+        Parameters:
+        bars - The DataHandler object with current market data.
+        band - Largest distance from the latest close, as a fraction of it.
+        """
+
+        self.bars = bars
+        self.band = band
+
+    def check(self, order, timestamp):
+        if order.price is None:
+            return order
+        close = get_latest_bar(self.bars, order.symbol).close[-1]
+        if abs(order.price - close) > self.band*close:
+            return None
+        return order
+
+class DailyLossCheck(RiskCheck):
+    """
+    Kill switch that stops new risk being taken once the equity has fallen
+    max_loss below its value at the start of the trading session. Orders
+    that reduce a position are still allowed; the switch resets at the next
+    session.
+    """
+
+    def __init__(self, portfolio, max_loss, calendar=CME_CALENDAR):
+        """
+        Parameters:
+        portfolio - The Portfolio object, for the equity and positions.
+        max_loss - Loss in USD from the session's starting equity at which
+                   trading stops.
+        calendar - The SessionCalendar mapping bar times to sessions.
+        """
+
+        self.portfolio = portfolio
+        self.max_loss = max_loss
+        self.calendar = calendar
+        self.session = None
+        self.session_equity = portfolio.value
+        self.killed = False
+
+    def update(self, event, timestamp):
+        session = self.calendar.session_id(timestamp)
+        if session != self.session:
+            self.session = session
+            self.session_equity = self.portfolio.value
+            self.killed = False
+        if self.session_equity - self.portfolio.value >= self.max_loss:
+            self.killed = True
+
+    def check(self, order, timestamp):
+        if not self.killed:
+            return order
+        position = self.portfolio.get_position(order.symbol)
+        if (position > 0 and order.direction == 'SELL') or \
+           (position < 0 and order.direction == 'BUY'):
+            return _resize(order, abs(position))
+        return None
+
+class ExposureCheck(RiskCheck):
+    """
+    Runs an ExposureManager's leverage, exposure and margin limits as a
+    pre-trade check.
+    """
+
+    def __init__(self, exposure_manager):
+        """
+        Parameters:
+        exposure_manager - The ExposureManager object.
+        """
+
+        self.exposure_manager = exposure_manager
+
+    def check(self, order, timestamp):
+        return self.exposure_manager.check_order(order)
+
+    def update(self, event, timestamp):
+        self.exposure_manager.update(event)
+
+class PreTradeRiskStage(object):
+    """
+    Sits between the portfolio and the execution handler, passing every
+    OrderEvent through a list of RiskChecks in turn. Each check may shrink
+    the order for those after it; if any rejects it the order goes no
+    further, otherwise it is sent to the execution handler.
+
+    Register execute_order() for OrderEvents in place of the execution
+    handler, and update() for MarketEvents and FillEvents after the
+    portfolio, see backtest.register_handlers().
+    """
+
+    def __init__(self, bars, broker, checks):
+        """
+        Parameters:
+        bars - The DataHandler object, for the latest bar time.
+        broker - The ExecutionHandler orders are sent to.
+        checks - List of RiskCheck objects, run in order.
+        """
+
+        self.bars = bars
+        self.broker = broker
+        self.checks = list(checks)
+        # Only call the checks that act on market data and fills
+        self.updating = [check for check in self.checks
+                         if type(check).update is not RiskCheck.update]
+
+        self.accepted = 0
+        self.rejected = dict((type(check).__name__, 0)
+                             for check in self.checks)
+
+    def _timestamp(self):
+        """
+        Returns the epoch seconds of the latest bar.
+        """
+
+        if hasattr(self.bars, 'symbol_slot'):
+            return int(self.bars.datetime[self.bars.bar_index])
+        return int(self.bars.get_latest_bars(N=1).datetime[-1])
+
+    def execute_order(self, event):
+        """
+        Runs an OrderEvent through the checks and sends what is left of it
+        to the execution handler.
+
+        Parameters:
+        event - Contains an Event object with order information.
+        """
+
+        if event.type != EventType.ORDER:
+            return
+
+        timestamp = self._timestamp()
+        order = event
+        for check in self.checks:
+            order = check.check(order, timestamp)
+            if order is None:
+                self.rejected[type(check).__name__] += 1
+                return
+
+        for check in self.checks:
+            check.on_order(order, timestamp)
+        self.accepted += 1
+        self.broker.execute_order(order)
+
+    def update(self, event):
+        """
+        Passes a MarketEvent or FillEvent to the checks that track them.
+
+        Parameters:
+        event - A MarketEvent or FillEvent object.
+        """
+
+        if self.updating:
+            timestamp = self._timestamp()
+            for check in self.updating:
+                check.update(event, timestamp)
+
+def create_risk_checks(bars, portfolio, max_position=None,
+                       max_order_size=None, max_orders_per_minute=None,
+                       price_band=None, max_daily_loss=None):
+    """
+    Returns the RiskChecks for the given limits, skipping any that are None.
+
+    Parameters:
+    bars - The DataHandler object with current market data.
+    portfolio - The Portfolio object.
+    max_position - See MaxPositionCheck.
+    max_order_size - See MaxOrderSizeCheck.
+    max_orders_per_minute - See OrderRateCheck.
+    price_band - See PriceBandCheck.
+    max_daily_loss - See DailyLossCheck.
+    """
+
+    checks = []
+    if max_order_size is not None:
+        checks.append(MaxOrderSizeCheck(max_order_size))
+    if price_band is not None:
+        checks.append(PriceBandCheck(bars, price_band))
+    if max_daily_loss is not None:
+        checks.append(DailyLossCheck(portfolio, max_daily_loss))
+    if max_position is not None:
+        checks.append(MaxPositionCheck(portfolio, max_position))
+    if max_orders_per_minute is not None:
+        checks.append(OrderRateCheck(max_orders_per_minute))
+    return checks
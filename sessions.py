@@ -0,0 +1,271 @@
+#! python3
+# sessions.py
+
+import datetime
+
+import numpy as np
+
+from collections import namedtuple
+
+# The e-mini trades from 17:00 to 16:00 Central Time (the time zone of the
+# bar data), so shifting a timestamp forward by 7 hours maps every bar of a
+# session, including the overnight part, onto the calendar day it closes.
+SESSION_OFFSET = 7*3600
+
+# Per-bar session information: the session (days since the epoch of the
+# date it closes on), whether the market is open, and whether it is in
+# regular trading hours
+SessionArrays = namedtuple('SessionArrays', ('session_id', 'in_session',
+                                             'rth'))
+
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+def minute_of_day(timestamp):
+    """
+    Returns the minutes since midnight of an epoch seconds timestamp, or of
+    an array of them.
+    """
+
+    return (timestamp % 86400)//60
+
+def time_of_day_mask(timestamps, start_minute, end_minute):
+    """
+    Returns a boolean array, True for the timestamps whose time of day is
+    in [start_minute, end_minute), wrapping past midnight if start_minute
+    is the later of the two.
+
+    Parameters:
+    timestamps - Array of epoch seconds.
+    start_minute - Minutes since midnight the window opens.
+    end_minute - Minutes since midnight the window closes.
+    """
+
+    minutes = minute_of_day(np.asarray(timestamps))
+    if start_minute <= end_minute:
+        return (minutes >= start_minute) & (minutes < end_minute)
+    return (minutes >= start_minute) | (minutes < end_minute)
+
+def in_time_window(timestamp, start_minute, end_minute):
+    """
+    Scalar form of time_of_day_mask() for a single timestamp.
+    """
+
+    minutes = minute_of_day(timestamp)
+    if start_minute <= end_minute:
+        return start_minute <= minutes < end_minute
+    return minutes >= start_minute or minutes < end_minute
+
+def _nth_weekday(year, month, weekday, n):
+    """
+    Returns the n-th given weekday (Monday=0) of a month, counting from the
+    end of the month if n is negative.
+    """
+
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7
+                                          + 7*(n - 1))
+    if month == 12:
+        last = datetime.date(year, 12, 31)
+    else:
+        last = datetime.date(year, month + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7
+                                     + 7*(-n - 1))
+
+def _easter(year):
+    """
+    Returns the date of Easter Sunday (anonymous Gregorian algorithm).
+    """
+
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8)//25
+    g = (b - f + 1)//3
+    h = (19*a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2*e + 2*i - h - k) % 7
+    m = (a + 11*h + 22*l)//451
+    month, day = divmod(h + l - 7*m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+def _observed(date):
+    """
+    Moves a holiday falling on a weekend to the Friday before or the Monday
+    after.
+    """
+
+    if date.weekday() == 5:
+        return date - datetime.timedelta(days=1)
+    if date.weekday() == 6:
+        return date + datetime.timedelta(days=1)
+    return date
+
+def cme_equity_holidays(first_year, last_year):
+    """
+    Returns the holiday schedule of the CME equity index futures for the
+    given years, following the exchange's usual rules: closed on New Year's
+    Day, Good Friday and Christmas, halted at 12:00 CT on the other US
+    federal holidays and at 12:15 CT the day after Thanksgiving and on
+    Christmas Eve. Individual years can differ, so check them against the
+    exchange's published calendar where it matters.
+
+    Returns the list of dates with no session and a dictionary of date to
+    the early close in minutes since midnight CT.
+    """
+
+    holidays = []
+    early_closes = {}
+    for year in range(first_year, last_year + 1):
+        new_year = datetime.date(year, 1, 1)
+        # A Saturday New Year's Day is not moved back into December
+        if new_year.weekday() != 5:
+            holidays.append(_observed(new_year))
+        holidays.append(_easter(year) - datetime.timedelta(days=2))
+        christmas = _observed(datetime.date(year, 12, 25))
+        holidays.append(christmas)
+
+        for date in (_nth_weekday(year, 1, 0, 3),
+                     _nth_weekday(year, 2, 0, 3),
+                     _nth_weekday(year, 5, 0, -1),
+                     _observed(datetime.date(year, 7, 4)),
+                     _nth_weekday(year, 9, 0, 1),
+                     _nth_weekday(year, 11, 3, 4)):
+            early_closes[date] = 12*60
+        early_closes[_nth_weekday(year, 11, 3, 4) +
+                     datetime.timedelta(days=1)] = 12*60 + 15
+        christmas_eve = datetime.date(year, 12, 24)
+        if christmas_eve.weekday() < 5 and christmas_eve != christmas:
+            early_closes[christmas_eve] = 12*60 + 15
+    return holidays, early_closes
+
+class SessionCalendar(object):
+    """
+    Trading sessions of a futures contract in the time zone of the bar
+    timestamps.
+
+    A session opens at open_minute on the day before its trading date and
+    closes at close_minute on it, with trading halted during each of the
+    halts. Sessions trade Monday to Friday, except on holidays, and close
+    early on the dates in early_closes. Regular trading hours (RTH) are the
+    part of the session between rth_start and rth_end; the rest is the
+    electronic (ETH) session.
+
+    precompute() classifies a whole array of bars at once, so data handlers
+    can do it when the data is loaded and each bar's session is then an
+    array lookup. classify() does the same for a single bar as it arrives.
+    """
+
+    def __init__(self, open_minute=17*60, close_minute=16*60,
+                 halts=((15*60 + 15, 15*60 + 30),),
+                 rth=(8*60 + 30, 15*60 + 15), holidays=(),
+                 early_closes=None):
+        """
+        Parameters:
+        open_minute - Minutes since midnight the session opens, on the day
+                      before the trading date.
+        close_minute - Minutes since midnight the session closes.
+        halts - (start, end) minutes of the daily trading halts.
+        rth - (start, end) minutes of regular trading hours.
+        holidays - Trading dates (datetime.date) with no session.
+        early_closes - Dictionary of trading date to its close in minutes.
+        """
+
+        self.open_minute = open_minute
+        self.close_minute = close_minute
+        self.halts = tuple(halts)
+        self.rth = rth
+        self.session_offset = 86400 - 60*open_minute
+
+        # Dates are held as session ids for the array lookups
+        self.holidays = np.array(sorted((date - EPOCH_DATE).days
+                                        for date in holidays),
+                                 dtype=np.int64)
+        self.early_closes = dict(((date - EPOCH_DATE).days, minute)
+                                 for date, minute
+                                 in (early_closes or {}).items())
+        self._early_ids = np.array(sorted(self.early_closes), dtype=np.int64)
+        self._early_minutes = np.array([self.early_closes[i]
+                                        for i in self._early_ids],
+                                       dtype=np.int64)
+        self._holiday_set = set(self.holidays.tolist())
+
+    def session_id(self, timestamp):
+        """
+        Returns the session of an epoch seconds timestamp, or of an array of
+        them, as days since the epoch of its trading date.
+        """
+
+        return (timestamp + self.session_offset)//86400
+
+    def session_close(self, timestamp):
+        """
+        Returns the close of the session of an epoch seconds timestamp, in
+        epoch seconds, early on the early close dates.
+        """
+
+        session_id = int(self.session_id(timestamp))
+        return session_id*86400 + 60*self.early_closes.get(session_id,
+                                                            self.close_minute)
+
+    def precompute(self, timestamps):
+        """
+        Classifies every bar of an array of epoch seconds timestamps.
+
+        Returns a SessionArrays tuple of read-only arrays.
+        """
+
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        session_id = self.session_id(timestamps)
+        minutes = minute_of_day(timestamps)
+
+        # 1970-01-01 was a Thursday, so this is Monday=0 to Sunday=6
+        trading_day = ((session_id + 3) % 7 < 5) & \
+            ~np.isin(session_id, self.holidays)
+
+        # Close of each bar's session, early on the early close dates
+        close = np.full(len(timestamps), self.close_minute, dtype=np.int64)
+        if len(self._early_ids):
+            slot = np.searchsorted(self._early_ids, session_id)
+            slot = np.minimum(slot, len(self._early_ids) - 1)
+            early = self._early_ids[slot] == session_id
+            close[early] = self._early_minutes[slot[early]]
+
+        # Bars before the close on the trading date or after the open on
+        # the evening before
+        in_session = trading_day & ((minutes < close) |
+                                    (minutes >= self.open_minute))
+        for start, end in self.halts:
+            in_session &= (minutes < start) | (minutes >= end)
+        rth = in_session & (minutes >= self.rth[0]) & \
+            (minutes < np.minimum(self.rth[1], close))
+
+        for array in (session_id, in_session, rth):
+            array.flags.writeable = False
+        return SessionArrays(session_id, in_session, rth)
+
+    def classify(self, timestamp):
+        """
+        Classifies a single bar, e.g. a live bar as it arrives.
+
+        Returns a SessionArrays tuple of scalars.
+        """
+
+        session_id = int(self.session_id(timestamp))
+        minutes = minute_of_day(timestamp)
+        close = self.early_closes.get(session_id, self.close_minute)
+
+        in_session = (session_id + 3) % 7 < 5 and \
+            session_id not in self._holiday_set and \
+            (minutes < close or minutes >= self.open_minute)
+        for start, end in self.halts:
+            if start <= minutes < end:
+                in_session = False
+        rth = in_session and \
+            self.rth[0] <= minutes < min(self.rth[1], close)
+        return SessionArrays(session_id, bool(in_session), bool(rth))
+
+_holidays, _early_closes = cme_equity_holidays(2000, 2035)
+
+# CME Globex equity index futures (ES, NQ, YM, RTY) in Central Time
+CME_CALENDAR = SessionCalendar(holidays=_holidays, early_closes=_early_closes)
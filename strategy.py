@@ -2,13 +2,22 @@
 # strategy.py
 
 import datetime
+import logging
 import numpy as np
 import pandas as pd
 from multiprocessing import Queue
 
 from abc import ABCMeta, abstractmethod
 
-from event import SignalEvent
+from data import epoch_to_datetime, get_latest_bar
+from event import EventType, SignalEvent
+from indicators import SMA, EMA
+from sessions import in_time_window, time_of_day_mask
+
+logger = logging.getLogger(__name__)
+
+# SMAtoEMA trades from 16:30 to 09:29, in minutes since midnight
+TRADING_WINDOW = (16*60 + 30, 9*60 + 29)
 
 class Strategy(object):
     """
@@ -36,87 +45,179 @@ class Strategy(object):
         
 class SMAtoEMA(Strategy):
     """
-    Buy an e-mini contract and hold it.
+    Trades crossovers of a fast EMA through a slow SMA of the close, outside
+    of 09:29-16:29.
+    
+    Both averages are streaming indicators updated once per bar, so each
+    MarketEvent costs a few float operations.
     """
     
-    def __init__(self, bars, events):
+    def __init__(self, bars, events, sma_window=30, ema_span=9, symbol='ES',
+                 indicators=None):
         """
-        Initializes the buy adn hold strategy.
+        Initializes the SMA to EMA crossover strategy.
         
         Parameters:
         bars - The DataHandler object that provides the bar information.
         events - The Event Queue ojbect.
+        sma_window - Number of bars in the simple moving average.
+        ema_span - Span of the exponential moving average.
+        symbol - The symbol traded.
+        indicators - Optional IndicatorRegistry to take the averages from,
+                     sharing them with other strategies on the same bars.
         """
         
         self.bars = bars
         self.events = events
+        self.sma_window = sma_window
+        self.ema_span = ema_span
+        self.symbol = symbol
         self.relative_ema_to_sma = 0
         
-    def calculate_signals(self, event, portfolio):
+        if indicators is not None:
+            self.sma = indicators.get(symbol, 'close', SMA, sma_window)
+            self.ema = indicators.get(symbol, 'close', EMA, span=ema_span)
+        else:
+            self.sma = SMA(sma_window)
+            self.ema = EMA(span=ema_span)
+        
+        # Handlers holding the whole history let the trading window be
+        # looked up per bar instead of computed from each timestamp
+        columns = getattr(bars, 'columns', None)
+        if columns is not None:
+            self.tradable = time_of_day_mask(columns.datetime, 
+                                             *TRADING_WINDOW)
+        else:
+            self.tradable = None
+        
+    @staticmethod
+    def vectorized_positions(bars, sma_window=30, ema_span=9):
+        """
+        Computes the same trades as calculate_signals() over a whole history
+        at once, for the vectorized backtest.
+        
+        Within the trading window the strategy tracks which side of the SMA
+        the EMA is on and trades one contract each time that side changes
+        (buying on a cross up, selling on a cross down), so the position is
+        the running sum of those crossings.
+        
+        Parameters:
+        bars - A Bars tuple of column arrays, e.g. DataHandler.columns.
+        sma_window - Number of bars in the simple moving average.
+        ema_span - Span of the exponential moving average.
+        
+        Returns the number of contracts held after each bar.
+        """
+        
+        close = pd.Series(bars.close)
+        sma = close.rolling(sma_window).mean().values
+        ema = close.ewm(span=ema_span).mean().values
+        return SMAtoEMA.positions_from_averages(bars.datetime, sma, ema)
+        
+    @staticmethod
+    def positions_from_averages(datetime, sma, ema):
+        """
+        Computes the positions of vectorized_positions() from averages that
+        have already been computed, e.g. once over the full history and then
+        sliced for each window of a walk-forward optimization.
+        
+        Parameters:
+        datetime - Array of bar timestamps in epoch seconds.
+        sma - Array of the simple moving average of the close.
+        ema - Array of the exponential moving average of the close.
+        
+        Returns the number of contracts held after each bar, starting flat.
         """
         
+        side = np.sign(np.nan_to_num(ema - sma))
+        
+        in_window = time_of_day_mask(datetime, *TRADING_WINDOW)
+        
+        observed = np.flatnonzero(in_window & (side != 0))
+        observed_side = side[observed]
+        crossed = observed_side[1:] != observed_side[:-1]
+        
+        trades = np.zeros(len(side), dtype=np.int64)
+        trades[observed[1:][crossed]] = observed_side[1:][crossed]
+        return np.cumsum(trades)
+        
+    def calculate_signals(self, event, portfolio):
+        """
+        Updates the averages with the latest close and places a SignalEvent
+        on the queue when the EMA crosses the SMA.
         
         Parameters
         event - A MarketEvent object.
+        portfolio - The Portfolio object, for the current position.
         """
         
-        if event.type == 'MARKET':
-            print(portfolio.es_positions)
-            dataset = pd.DataFrame(self.bars.get_latest_bars(N=60))
-            time_of_day = datetime.datetime(1,1,1,
-                                            dataset[0][-1:].dt.hour,
-                                            dataset[0][-1:].dt.minute,
-                                            0)
-                                            
-            if time_of_day < datetime.datetime(1,1,1,9,29,0) or \
-               time_of_day > datetime.datetime(1,1,1,16,29,0):
-               
-                dataset['SMA'] = pd.rolling_mean(dataset[4], window=30)
-                dataset['EMA'] = pd.ewma(dataset[4], span=9)
+        if event.type == EventType.MARKET:
+            position = portfolio.get_position(self.symbol)
+            bars = get_latest_bar(self.bars, self.symbol)
+            timestamp = bars.datetime[-1]
+            sma = self.sma.update(bars.close[-1])
+            ema = self.ema.update(bars.close[-1])
+            
+            if self.tradable is not None:
+                in_window = self.tradable[self.bars.bar_index]
+            else:
+                in_window = in_time_window(timestamp, *TRADING_WINDOW)
+            
+            if in_window:
                 
-                if dataset['EMA'].iloc[-1] < dataset['SMA'].iloc[-1] and \
-                   self.relative_ema_to_sma == 0:
+                if ema < sma and self.relative_ema_to_sma == 0:
                    
                     self.relative_ema_to_sma = -1
                     
-                elif dataset['EMA'].iloc[-1] > dataset['SMA'].iloc[-1] and \
-                   self.relative_ema_to_sma == 0:
+                elif ema > sma and self.relative_ema_to_sma == 0:
                    
                     self.relative_ema_to_sma = 1
                     
-                if dataset['EMA'].iloc[-1] > dataset['SMA'].iloc[-1] and \
+                if ema > sma and \
                    self.relative_ema_to_sma == -1 and \
-                   portfolio.es_positions == 0:
+                   position == 0:
                    
                     self.relative_ema_to_sma = 1
-                    signal = SignalEvent('ES', dataset[0], 'LONG')
+                    signal = SignalEvent(self.symbol,
+                                         epoch_to_datetime(timestamp),
+                                         'LONG')
                     self.events.put(signal)
-                    print("Buy to Open")
+                    logger.info("Buy to Open: %s %s", self.symbol,
+                                signal.datetime)
                     
-                elif dataset['EMA'].iloc[-1] < dataset['SMA'].iloc[-1] and \
+                elif ema < sma and \
                    self.relative_ema_to_sma == 1 and \
-                   portfolio.es_positions == 0:
+                   position == 0:
                    
                     self.relative_ema_to_sma = -1
-                    signal = SignalEvent('ES', dataset[0], 'SHORT')
+                    signal = SignalEvent(self.symbol,
+                                         epoch_to_datetime(timestamp),
+                                         'SHORT')
                     self.events.put(signal)
-                    print("Sell to Open")
+                    logger.info("Sell to Open: %s %s", self.symbol,
+                                signal.datetime)
                     
-                elif dataset['EMA'].iloc[-1] > dataset['SMA'].iloc[-1] and \
+                elif ema > sma and \
                    self.relative_ema_to_sma == -1 and \
-                   portfolio.es_positions < 0:
+                   position < 0:
                    
                     self.relative_ema_to_sma = 1
-                    signal = SignalEvent('ES', dataset[0], 'LONG')
+                    signal = SignalEvent(self.symbol,
+                                         epoch_to_datetime(timestamp),
+                                         'LONG')
                     self.events.put(signal)
-                    print("Buy to Close")
+                    logger.info("Buy to Close: %s %s", self.symbol,
+                                signal.datetime)
                     
-                elif dataset['EMA'].iloc[-1] < dataset['SMA'].iloc[-1] and \
+                elif ema < sma and \
                    self.relative_ema_to_sma == 1 and \
-                   portfolio.es_positions > 0:
+                   position > 0:
                    
                     self.relative_ema_to_sma = -1
-                    signal = SignalEvent('ES', dataset[0], 'SHORT')
+                    signal = SignalEvent(self.symbol,
+                                         epoch_to_datetime(timestamp),
+                                         'SHORT')
                     self.events.put(signal)
-                    print("Sell to Close")
+                    logger.info("Sell to Close: %s %s", self.symbol,
+                                signal.datetime)
 
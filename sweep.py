@@ -0,0 +1,137 @@
+#! python3
+# sweep.py
+
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import backtest
+import data
+
+class SharedBars(object):
+    """
+    Holds a Bars tuple in a single shared memory block so that worker
+    processes can map the parsed bar data instead of re-reading the CSV.
+
+    Every field in BAR_FIELDS is 8 bytes wide, so the columns are laid out
+    back to back and described by (name, length) alone.
+    """
+
+    def __init__(self, columns):
+        """
+        Copies the columns into a new shared memory block.
+
+        Parameters:
+        columns - A Bars tuple of column arrays.
+        """
+
+        self.length = len(columns.datetime)
+        size = max(self.length*8*len(data.BAR_FIELDS), 1)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        for shared, column in zip(attach_columns(self.shm, self.length),
+                                  columns):
+            shared.flags.writeable = True
+            shared[:] = column
+        self.spec = (self.shm.name, self.length)
+
+    def close(self):
+        """
+        Releases and removes the shared memory block.
+        """
+
+        self.shm.close()
+        self.shm.unlink()
+
+def attach_columns(shm, length):
+    """
+    Returns a Bars tuple of read-only arrays over a shared memory block laid
+    out by SharedBars.
+    """
+
+    columns = []
+    for i, field in enumerate(data.BAR_FIELDS):
+        column = np.ndarray((length,), dtype=data.BAR_DTYPES[field],
+                            buffer=shm.buf, offset=i*length*8)
+        column.flags.writeable = False
+        columns.append(column)
+    return data.Bars(*columns)
+
+# Bars shared with this worker process, set by _attach_worker()
+_worker_shm = None
+_worker_columns = None
+
+def _attach_worker(spec):
+    """
+    ProcessPoolExecutor initializer mapping the shared bars into the worker.
+    """
+
+    global _worker_shm, _worker_columns
+    name, length = spec
+    _worker_shm = shared_memory.SharedMemory(name=name)
+    _worker_columns = attach_columns(_worker_shm, length)
+
+def _run_worker(config):
+    return backtest.run_backtest(config, columns=_worker_columns)
+
+def expand_grid(config, grid):
+    """
+    Expands a parameter grid into one backtest config per combination.
+
+    Parameters:
+    config - Base config shared by every run, see backtest.DEFAULT_CONFIG.
+    grid - Dictionary mapping strategy parameter names to lists of values,
+           e.g. {'sma_window': [20, 30], 'ema_span': [5, 9]}.
+    """
+
+    names = sorted(grid)
+    configs = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        run_config = dict(config)
+        params = dict(config.get('strategy_params', {}))
+        params.update(zip(names, values))
+        run_config['strategy_params'] = params
+        configs.append(run_config)
+    return configs
+
+def run_sweep(config, grid, max_workers=None):
+    """
+    Runs a backtest for every combination in grid over a process pool.
+
+    The CSV is parsed once here and shared with the workers through shared
+    memory, so each worker only replays the bars.
+
+    Parameters:
+    config - Base config shared by every run, see backtest.DEFAULT_CONFIG.
+    grid - Dictionary mapping strategy parameter names to lists of values.
+    max_workers - Number of worker processes, default os.cpu_count().
+
+    Returns a DataFrame with one row of parameters and results per run.
+    """
+
+    settings = dict(backtest.DEFAULT_CONFIG)
+    settings.update(config)
+    configs = expand_grid(settings, grid)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    chunksize = max(1, len(configs) // (max_workers*4))
+
+    shared = SharedBars(data.load_emini_csv(settings['csv_filename']))
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_attach_worker,
+                                 initargs=(shared.spec,)) as pool:
+            results = list(pool.map(_run_worker, configs,
+                                    chunksize=chunksize))
+    finally:
+        shared.close()
+    return pd.DataFrame(results)
+
+if __name__ == "__main__":
+    results = run_sweep(backtest.DEFAULT_CONFIG,
+                        {'sma_window': [10, 20, 30, 50],
+                         'ema_span': [5, 9, 15]})
+    print(results.sort_values('total', ascending=False).to_string())
@@ -0,0 +1,27 @@
+#! python3
+# test_eventbus.py
+
+import pytest
+
+import eventbus
+
+from event import MARKET_EVENT, EventType
+
+def test_queue_bus_dispatches_own_events():
+    bus = eventbus.QueueEventBus()
+    seen = []
+    bus.register(EventType.MARKET, seen.append)
+    for i in range(100):
+        bus.put(MARKET_EVENT)
+    assert bus.dispatch() == 100
+    assert len(seen) == 100
+    assert bus.empty()
+    assert bus.get() is None
+
+def test_queue_bus_detects_second_consumer():
+    bus = eventbus.QueueEventBus(flush_timeout=0.1)
+    other = eventbus.QueueEventBus(bus.queue, timeout=1)
+    bus.put(MARKET_EVENT)
+    assert other.get().type == EventType.MARKET
+    with pytest.raises(RuntimeError):
+        bus.get()
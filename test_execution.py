@@ -0,0 +1,121 @@
+#! python3
+# test_execution.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+import eventbus
+
+from event import EventType, OrderEvent
+from execution import BarExecutionHandler
+
+START = 1474290000
+
+# (open, high, low, close) of the bars replayed, bar 3 gapping down
+PRICES = [(100.0, 101.0, 99.0, 100.0),
+          (102.0, 104.0, 101.0, 103.0),
+          (103.0, 103.5, 98.0, 99.0),
+          (95.0, 96.0, 94.0, 95.0),
+          (97.0, 100.0, 96.0, 99.0)]
+
+def _columns(prices):
+    length = len(prices)
+    open_, high, low, close = [np.array(column) for column in zip(*prices)]
+    return data.Bars(START + 60*np.arange(length, dtype=np.int64), open_,
+                     high, low, close, np.ones(length, dtype=np.int64),
+                     np.ones(length, dtype=np.int64), close)
+
+def _run(bars, events, orders, **kwargs):
+    """
+    Replays bars through a BarExecutionHandler, placing orders[i] after bar
+    i is released, and returns the (bar, price) of every fill.
+    """
+
+    broker = BarExecutionHandler(events, bars, **kwargs)
+    fills = []
+    events.register(EventType.MARKET, broker.update)
+    events.register(EventType.ORDER, broker.execute_order)
+    events.register(EventType.FILL, fills.append)
+    while bars.continue_backtest:
+        bars.update_bars()
+        for order in orders.get(bars.bar_index, ()):
+            events.put(order)
+        events.dispatch()
+    return [(int((fill.timeindex - data.EPOCH).total_seconds() - START)//60,
+             fill.symbol, fill.direction, fill.fill_cost/fill.quantity)
+            for fill in fills]
+
+def _run_es(orders, **kwargs):
+    events = eventbus.DequeEventBus()
+    bars = data.EMiniArrayHandler(events, _columns(PRICES))
+    return _run(bars, events, orders, **kwargs)
+
+def test_market_fills_at_next_open():
+    fills = _run_es({0: [OrderEvent('ES', 'MKT', 1, 'BUY')],
+                     2: [OrderEvent('ES', 'MKT', 1, 'SELL')]})
+    assert fills == [(1, 'ES', 'BUY', 102.0), (3, 'ES', 'SELL', 95.0)]
+
+def test_market_fill_at_close():
+    fills = _run_es({0: [OrderEvent('ES', 'MKT', 1, 'BUY')]},
+                    market_fill='close')
+    assert fills == [(1, 'ES', 'BUY', 103.0)]
+
+def test_market_slippage():
+    fills = _run_es({0: [OrderEvent('ES', 'MKT', 1, 'BUY'),
+                         OrderEvent('ES', 'MKT', 1, 'SELL')]},
+                    slippage_ticks=2)
+    assert fills == [(1, 'ES', 'BUY', 102.5), (1, 'ES', 'SELL', 101.5)]
+
+def test_latency():
+    fills = _run_es({0: [OrderEvent('ES', 'MKT', 1, 'BUY')]}, latency=2)
+    assert fills == [(3, 'ES', 'BUY', 95.0)]
+
+def test_limit_orders():
+    fills = _run_es({0: [OrderEvent('ES', 'LMT', 1, 'BUY', 99.0),
+                         OrderEvent('ES', 'LMT', 1, 'SELL', 103.5)],
+                     2: [OrderEvent('ES', 'LMT', 1, 'BUY', 100.0)]},
+                    slippage_ticks=4)
+    # Limits fill at the limit, without slippage, or at a better open
+    assert fills == [(1, 'ES', 'SELL', 103.5), (2, 'ES', 'BUY', 99.0),
+                     (3, 'ES', 'BUY', 95.0)]
+
+def test_limit_not_reached():
+    assert _run_es({0: [OrderEvent('ES', 'LMT', 1, 'BUY', 90.0),
+                        OrderEvent('ES', 'LMT', 1, 'SELL', 105.0)]}) == []
+
+def test_stop_orders():
+    fills = _run_es({0: [OrderEvent('ES', 'STP', 1, 'BUY', 103.0),
+                         OrderEvent('ES', 'STP', 1, 'SELL', 99.0)]},
+                    slippage_ticks=1)
+    assert fills == [(1, 'ES', 'BUY', 103.25), (2, 'ES', 'SELL', 98.75)]
+
+def test_stop_gap_through():
+    # Bar 3 opens below the sell stop and bar 4 above the buy stop
+    fills = _run_es({2: [OrderEvent('ES', 'STP', 1, 'SELL', 97.0)],
+                     3: [OrderEvent('ES', 'STP', 1, 'BUY', 96.0)]},
+                    slippage_ticks=1)
+    assert fills == [(3, 'ES', 'SELL', 94.75), (4, 'ES', 'BUY', 97.25)]
+
+def test_unsupported_order_type():
+    with pytest.raises(ValueError):
+        _run_es({0: [OrderEvent('ES', 'MOC', 1, 'BUY')]})
+
+def test_slippage_per_contract(tmp_path):
+    timestamps = pd.to_datetime(START + 60*np.arange(len(PRICES)),
+                                unit='s').strftime('%Y-%m-%d %H:%M:%S')
+    for symbol, scale in (('ES', 1.0), ('YM', 100.0)):
+        frame = pd.DataFrame(np.array(PRICES)*scale,
+                             columns=['open', 'high', 'low', 'close'])
+        frame.insert(0, 'datetime', timestamps)
+        frame.to_csv(str(tmp_path / ('%s.csv' % symbol)), index=False)
+    events = eventbus.DequeEventBus()
+    bars = data.HistoricCSVDataHandler(events, str(tmp_path), ['YM', 'ES'],
+                                       fields=('open', 'high', 'low',
+                                               'close'))
+    # Placed YM first, filled in symbol order, each with its own tick size
+    fills = _run(bars, events, {0: [OrderEvent('YM', 'MKT', 1, 'BUY'),
+                                    OrderEvent('ES', 'MKT', 1, 'BUY')]},
+                 slippage_ticks=2)
+    assert fills == [(1, 'ES', 'BUY', 102.5), (1, 'YM', 'BUY', 10202.0)]
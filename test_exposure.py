@@ -0,0 +1,120 @@
+#! python3
+# test_exposure.py
+
+import numpy as np
+
+import data
+import eventbus
+import portfolio
+
+from event import MARKET_EVENT, FillEvent, OrderEvent
+from exposure import ExposureManager
+
+def _es_portfolio(closes, initial_capital):
+    """
+    Returns an ES FuturesPortfolio on bars with the given closes, its data
+    handler and the event bus.
+    """
+
+    length = len(closes)
+    close = np.array(closes, dtype=np.float64)
+    columns = data.Bars(1474290000 + 60*np.arange(length, dtype=np.int64),
+                        close, close, close, close,
+                        np.ones(length, dtype=np.int64),
+                        np.ones(length, dtype=np.int64), close)
+    events = eventbus.DequeEventBus()
+    bars = data.EMiniArrayHandler(events, columns)
+    futures = portfolio.FuturesPortfolio(bars, events, None, initial_capital,
+                                         symbol_list=['ES'])
+    return futures, bars
+
+def _mark(futures, bars, manager):
+    bars.update_bars()
+    futures.update(MARKET_EVENT)
+    manager.update(MARKET_EVENT)
+
+def _fill(futures, manager, quantity, direction, price):
+    fill = FillEvent(None, 'ES', 'GLOBEX', quantity, direction,
+                     price*quantity, 0.0)
+    futures.update_fill(fill)
+    manager.update(fill)
+
+def test_leverage_limit():
+    # One ES contract at 2000 is worth 100000, the whole equity
+    futures, bars = _es_portfolio([2000.0], 100000)
+    manager = ExposureManager(futures, target_leverage=2,
+                              enforce_margin=False)
+    _mark(futures, bars, manager)
+    at_limit = OrderEvent('ES', 'MKT', 2, 'BUY')
+    assert manager.check_order(at_limit) is at_limit
+    assert manager.check_order(OrderEvent('ES', 'MKT', 3, 'BUY')).quantity \
+        == 2
+
+    _fill(futures, manager, 2, 'BUY', 2000.0)
+    assert manager.current_leverage == 2.0
+    assert manager.check_order(OrderEvent('ES', 'MKT', 1, 'BUY')) is None
+    assert manager.rejected_orders == 1
+    assert manager.resized_orders == 1
+    # Selling closes the long before opening a short within the limit
+    reversal = OrderEvent('ES', 'MKT', 4, 'SELL')
+    assert manager.check_order(reversal) is reversal
+    assert manager.check_order(OrderEvent('ES', 'MKT', 5, 'SELL')).quantity \
+        == 4
+
+def test_long_and_short_exposure_limits():
+    futures, bars = _es_portfolio([2000.0], 100000)
+    manager = ExposureManager(futures, target_long_exposure=1,
+                              target_short_exposure=2, enforce_margin=False)
+    _mark(futures, bars, manager)
+    long_order = OrderEvent('ES', 'MKT', 1, 'BUY')
+    short_order = OrderEvent('ES', 'MKT', 2, 'SELL')
+    assert manager.check_order(long_order) is long_order
+    assert manager.check_order(OrderEvent('ES', 'MKT', 2, 'BUY')).quantity \
+        == 1
+    assert manager.check_order(short_order) is short_order
+    assert manager.check_order(OrderEvent('ES', 'MKT', 3, 'SELL')).quantity \
+        == 2
+
+def test_margin_limit():
+    # ES needs 5500 initial margin per contract
+    futures, bars = _es_portfolio([2000.0], 11000)
+    manager = ExposureManager(futures)
+    _mark(futures, bars, manager)
+    assert manager.buying_power == 11000
+    at_limit = OrderEvent('ES', 'MKT', 2, 'BUY')
+    assert manager.check_order(at_limit) is at_limit
+    assert manager.check_order(OrderEvent('ES', 'MKT', 3, 'BUY')).quantity \
+        == 2
+
+    _fill(futures, manager, 2, 'BUY', 2000.0)
+    assert manager.initial_margin == 11000
+    assert manager.buying_power == 0
+    assert manager.check_order(OrderEvent('ES', 'MKT', 1, 'BUY')) is None
+
+def test_equity_between_marks():
+    """
+    Orders are checked against the equity of the latest update, a mark or a
+    fill, until the next one.
+    """
+
+    futures, bars = _es_portfolio([2000.0, 1900.0], 17000)
+    manager = ExposureManager(futures)
+    _mark(futures, bars, manager)
+    _fill(futures, manager, 1, 'BUY', 2000.0)
+    assert manager.equity == 17000
+    assert manager.check_order(OrderEvent('ES', 'MKT', 2, 'BUY')).quantity \
+        == 2
+
+    # The next bar loses 100 points on the long, which the checks only see
+    # once the manager is updated
+    bars.update_bars()
+    futures.update(MARKET_EVENT)
+    assert futures.value == 12000
+    assert manager.equity == 17000
+    assert manager.check_order(OrderEvent('ES', 'MKT', 2, 'BUY')).quantity \
+        == 2
+    manager.update(MARKET_EVENT)
+    assert manager.equity == 12000
+    assert manager.check_order(OrderEvent('ES', 'MKT', 2, 'BUY')).quantity \
+        == 1
+    assert not manager.margin_call
@@ -0,0 +1,165 @@
+#! python3
+# test_indicators.py
+
+import numpy as np
+import pandas as pd
+
+import data
+import eventbus
+import execution
+import portfolio
+import strategy
+
+from event import EventType
+from indicators import (EMA, SMA, VWAP, IndicatorRegistry, RollingMax,
+                        RollingMin, RollingStd)
+
+def _with_gaps(length=500, seed=0):
+    """
+    Returns a random walk with a leading run of NaN and NaN gaps, like a
+    symbol aligned on a master clock before its first bar.
+    """
+
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=length).cumsum()
+    values[rng.random(length) < 0.1] = np.nan
+    values[:7] = np.nan
+    return values
+
+def _stream(indicator, values):
+    return np.array([indicator.update(value) for value in values])
+
+def test_sma_skips_nan():
+    values = [1.0, 2.0, np.nan, 4.0, 5.0, 6.0, 7.0]
+    expected = pd.Series(values).rolling(2).mean().values
+    assert np.allclose(_stream(SMA(2), values), expected, equal_nan=True)
+
+def test_sma_matches_pandas():
+    values = _with_gaps()
+    for window, min_periods in ((1, None), (5, None), (5, 2), (30, 10)):
+        expected = pd.Series(values).rolling(
+            window, min_periods=min_periods).mean().values
+        assert np.allclose(_stream(SMA(window, min_periods), values),
+                           expected, equal_nan=True)
+
+def test_ema_matches_pandas():
+    values = _with_gaps()
+    for adjust in (True, False):
+        expected = pd.Series(values).ewm(span=9, adjust=adjust).mean().values
+        assert np.allclose(_stream(EMA(span=9, adjust=adjust), values),
+                           expected, equal_nan=True)
+
+def test_rolling_std_matches_pandas():
+    values = _with_gaps()
+    for window, min_periods, ddof in ((5, None, 1), (5, 2, 1), (30, 10, 0),
+                                      (2, 1, 0)):
+        expected = pd.Series(values).rolling(
+            window, min_periods=min_periods).std(ddof=ddof).values
+        assert np.allclose(_stream(RollingStd(window, min_periods, ddof),
+                                   values), expected, equal_nan=True)
+
+def test_rolling_max_min_match_pandas():
+    values = _with_gaps()
+    for window, min_periods in ((1, None), (5, None), (5, 2), (30, 10)):
+        rolling = pd.Series(values).rolling(window, min_periods=min_periods)
+        assert np.allclose(_stream(RollingMax(window, min_periods), values),
+                           rolling.max().values, equal_nan=True)
+        assert np.allclose(_stream(RollingMin(window, min_periods), values),
+                           rolling.min().values, equal_nan=True)
+
+def test_vwap_matches_pandas():
+    rng = np.random.default_rng(1)
+    wap = pd.Series(100 + _with_gaps(seed=1))
+    volume = pd.Series(rng.integers(0, 50, size=len(wap)).astype(float))
+    volume[rng.random(len(wap)) < 0.05] = np.nan
+    valid = wap.notna() & volume.notna()
+    expected = ((wap*volume)[valid].cumsum() / volume[valid].cumsum()) \
+        .reindex(wap.index).ffill().values
+    vwap = VWAP()
+    result = np.array([vwap.update(w, v) for w, v in zip(wap, volume)])
+    assert np.allclose(result, expected, equal_nan=True)
+
+def _write_symbols(directory, starts, mirrored=()):
+    """
+    Writes a CSV file per symbol of the 1weekemini.csv closes from the bar
+    given in starts on, reflecting the closes of the mirrored symbols so
+    their averages cross the other way.
+    """
+
+    columns = data.load_emini_csv('1weekemini.csv')
+    timestamps = pd.to_datetime(columns.datetime, unit='s').strftime(
+        '%Y-%m-%d %H:%M:%S')
+    frame = pd.DataFrame({'datetime': timestamps, 'close': columns.close,
+                          'volume': columns.volume})
+    for symbol, start in starts.items():
+        bars = frame.iloc[start:].copy()
+        if symbol in mirrored:
+            bars['close'] = 4400.0 - bars['close']
+        bars.to_csv(str(directory / ('%s.csv' % symbol)), index=False)
+
+def _run_symbols(directory, symbol_list, indicators=False):
+    """
+    Runs one SMAtoEMA per symbol on the CSV files in directory, sharing an
+    IndicatorRegistry if indicators is True, and returns the strategies
+    and every fill as a (timeindex, symbol, direction) tuple.
+    """
+
+    events = eventbus.DequeEventBus()
+    bars = data.HistoricCSVDataHandler(events, str(directory), symbol_list)
+    futures = portfolio.FuturesPortfolio(bars, events, None, 10**6)
+    broker = execution.SimulatedExecutionHandler(events, bars)
+    registry = IndicatorRegistry(bars) if indicators else None
+    strategies = [strategy.SMAtoEMA(bars, events, symbol=symbol,
+                                    indicators=registry)
+                  for symbol in symbol_list]
+    fills = []
+
+    def calculate_signals(event):
+        for s in strategies:
+            s.calculate_signals(event, futures)
+
+    def record_fill(event):
+        fills.append((event.timeindex, event.symbol, event.direction))
+    events.register(EventType.MARKET, broker.update)
+    events.register(EventType.MARKET, futures.update)
+    events.register(EventType.MARKET, calculate_signals)
+    events.register(EventType.SIGNAL, futures.update_signal)
+    events.register(EventType.ORDER, broker.execute_order)
+    events.register(EventType.FILL, futures.update_fill)
+    events.register(EventType.FILL, record_fill)
+    while bars.continue_backtest:
+        bars.update_bars()
+        events.dispatch()
+    return strategies, fills
+
+def test_late_symbol_trades(tmp_path):
+    """
+    A symbol whose data starts after the master clock's first bar is NaN
+    until then, which must not stop its averages or its strategy.
+    """
+
+    _write_symbols(tmp_path, {'ES': 0, 'NQ': 5})
+    strategies, fills = _run_symbols(tmp_path, ['ES', 'NQ'])
+    assert not np.isnan(strategies[1].sma.value)
+    symbols = [symbol for _, symbol, _ in fills]
+    assert symbols.count('ES') > 0
+    assert symbols.count('NQ') > 0
+
+def test_registry_keys_on_symbol():
+    registry = IndicatorRegistry(None)
+    es = registry.get('ES', 'close', SMA, 20)
+    assert registry.get('ES', 'close', SMA, 20) is es
+    assert registry.get('NQ', 'close', SMA, 20) is not es
+    assert registry.get('ES', 'wap', SMA, 20) is not es
+    assert registry.get('ES', 'close', SMA, 30) is not es
+
+def test_shared_indicators_per_symbol(tmp_path):
+    """
+    Strategies on different symbols sharing a registry trade exactly as
+    they do with their own indicators.
+    """
+
+    _write_symbols(tmp_path, {'ES': 0, 'NQ': 7}, mirrored=('NQ',))
+    _, own = _run_symbols(tmp_path, ['ES', 'NQ'])
+    _, shared = _run_symbols(tmp_path, ['ES', 'NQ'], indicators=True)
+    assert shared == own
@@ -0,0 +1,51 @@
+#! python3
+# test_live.py
+
+import calendar
+import zoneinfo
+
+import pytest
+
+import backtest
+import live
+
+from event import OrderEvent
+
+def test_fake_session_matches_backtest():
+    """
+    Replaying whole bars through the live pipeline trades exactly as the
+    backtest does, every time.
+    """
+
+    results = backtest.run_backtest({'csv_filename': '1weekemini.csv'})
+    for speed in (None, 20000):
+        es_portfolio = live.run_fake_session('1weekemini.csv', speed=speed,
+                                             ticks=False)
+        history = es_portfolio.get_history()
+        assert es_portfolio.es_positions == results['positions']
+        assert es_portfolio.value == results['total']
+        assert history['commission'][-1] == results['commission']
+
+def test_to_exchange_time():
+    # 22:00 UTC is 17:00 CDT in September and 16:00 CST in December
+    summer = calendar.timegm((2016, 9, 15, 22, 0, 0))
+    winter = calendar.timegm((2016, 12, 15, 22, 0, 0))
+    assert live.to_exchange_time(summer) == summer - 5*3600
+    assert live.to_exchange_time(winter) == winter - 6*3600
+
+def test_execution_time_to_exchange_time():
+    # 14:05:12 in New York is 13:05:12 in Chicago
+    expected = calendar.timegm((2016, 12, 15, 13, 5, 12))
+    new_york = zoneinfo.ZoneInfo('America/New_York')
+    assert live.execution_time_to_exchange_time('20161215  14:05:12',
+                                                new_york) == expected
+    assert live.execution_time_to_exchange_time(
+        '20161215 14:05:12 US/Eastern', live.EXCHANGE_TIMEZONE) == expected
+
+def test_create_ib_order_prices():
+    pytest.importorskip('ib.ext.Order')
+    limit = live.create_ib_order(OrderEvent('ES', 'LMT', 2, 'BUY', 2150.25))
+    stop = live.create_ib_order(OrderEvent('ES', 'STP', 1, 'SELL', 2140.0))
+    assert (limit.m_orderType, limit.m_totalQuantity, limit.m_action,
+            limit.m_lmtPrice) == ('LMT', 2, 'BUY', 2150.25)
+    assert (stop.m_orderType, stop.m_auxPrice) == ('STP', 2140.0)
@@ -0,0 +1,80 @@
+#! python3
+# test_resample.py
+
+import calendar
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+
+from resample import TIMEFRAMES, BarResampler
+from sessions import SESSION_OFFSET
+
+def _resample(columns):
+    """
+    Feeds every bar of columns to a BarResampler of every timeframe.
+
+    Returns the resampler and, per timeframe, the timestamps of the input
+    bars that completed a bar.
+    """
+
+    resampler = BarResampler(tuple(TIMEFRAMES), max_lookback=100000)
+    completed_on = dict((timeframe, []) for timeframe in TIMEFRAMES)
+    for bar in zip(*[column.tolist() for column in columns]):
+        for timeframe in resampler.add_bar(bar):
+            completed_on[timeframe].append(bar[0])
+    resampler.flush()
+    return resampler, completed_on
+
+def _pandas_bars(columns, seconds):
+    """
+    Resamples columns with pandas, daily bars starting at the session open.
+    """
+
+    frame = pd.DataFrame(columns._asdict())
+    offset = SESSION_OFFSET if seconds == 86400 else 0
+    frame.index = pd.to_datetime(frame['datetime'] + offset, unit='s')
+    frame['price_volume'] = frame['wap']*frame['volume']
+    grouped = frame.resample('%ds' % seconds).agg(
+        {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
+         'volume': 'sum', 'count': 'sum', 'price_volume': 'sum'})
+    grouped = grouped.dropna(subset=['close'])
+    grouped['datetime'] = grouped.index.values.astype('datetime64[s]') \
+        .astype(np.int64) - offset
+    grouped['wap'] = grouped['price_volume']/grouped['volume']
+    return grouped
+
+@pytest.mark.parametrize('timeframe', list(TIMEFRAMES))
+def test_matches_pandas(timeframe):
+    columns = data.load_emini_csv('1weekemini.csv')
+    resampler, _ = _resample(columns)
+    expected = _pandas_bars(columns, TIMEFRAMES[timeframe])
+    bars = resampler.get_latest_bars(timeframe, N=100000)
+    assert len(bars.datetime) == len(expected)
+    for field in data.BAR_FIELDS:
+        assert np.allclose(getattr(bars, field), expected[field].values), \
+            field
+
+def test_daily_bar_closes_with_session():
+    columns = data.load_emini_csv('1weekemini.csv')
+    _, completed_on = _resample(columns)
+    # Every whole session of the week ends on its 15:59 bar, the data
+    # stopping at 15:14 in the last one
+    assert len(completed_on['daily']) == 4
+    for timestamp in completed_on['daily']:
+        assert (timestamp % 86400)//60 == 15*60 + 59
+
+def test_daily_bar_closes_early():
+    # Thanksgiving 2016 closes at 12:00
+    open_ = calendar.timegm((2016, 11, 23, 17, 0, 0))
+    close = calendar.timegm((2016, 11, 24, 12, 0, 0))
+    resampler = BarResampler(('daily',))
+    for timestamp in range(open_, close, 60):
+        completed = resampler.add_bar((timestamp, 1.0, 1.0, 1.0, 1.0, 1, 1,
+                                       1.0))
+        assert completed == (['daily'] if timestamp == close - 60 else [])
+    bar = resampler.get_latest_bars('daily')
+    assert bar.datetime[-1] == open_
+    assert bar.volume[-1] == (close - open_)//60
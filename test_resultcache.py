@@ -0,0 +1,104 @@
+#! python3
+# test_resultcache.py
+
+import os
+import shutil
+
+import numpy as np
+
+import backtest
+import data
+import resultcache
+
+def _settings(**config):
+    settings = dict(backtest.DEFAULT_CONFIG)
+    settings.update(config)
+    return settings
+
+def test_key_follows_settings():
+    key = resultcache.result_key(_settings())
+    assert resultcache.result_key(_settings()) == key
+    for config in ({'strategy_params': {'sma_window': 20}},
+                   {'strategy_params': {'ema_span': 5}},
+                   {'initial_capital': 50000},
+                   {'risk_params': {'max_position': 1}}):
+        assert resultcache.result_key(_settings(**config)) != key
+    # Settings that do not change the result are left out
+    for config in ({'result_cache': 'elsewhere'},
+                   {'result_cache_size': 1},
+                   {'multiprocess_events': True}):
+        assert resultcache.result_key(_settings(**config)) == key
+
+def test_key_follows_data(tmp_path):
+    same = str(tmp_path / 'same.csv')
+    changed = str(tmp_path / 'changed.csv')
+    shutil.copy('1weekemini.csv', same)
+    with open('1weekemini.csv') as f:
+        lines = f.readlines()
+    with open(changed, 'w') as f:
+        f.writelines(lines[:-1])
+    key = resultcache.result_key(_settings())
+    # The bars are hashed by content, not by file name
+    assert resultcache.result_key(_settings(csv_filename=same)) == key
+    assert resultcache.result_key(_settings(csv_filename=changed)) != key
+
+    columns = data.load_emini_csv('1weekemini.csv')
+    column_key = resultcache.result_key(_settings(), columns)
+    assert resultcache.result_key(_settings(), columns) == column_key
+    close = columns.close.copy()
+    close[-1] += 0.25
+    assert resultcache.result_key(_settings(), columns._replace(
+        close=close)) != column_key
+
+def _store(cache, key, size=100):
+    cache.store(key, {'total': float(size)},
+                {'total': np.arange(size, dtype=np.float64)}, [])
+
+def test_lru_eviction(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    for i, key in enumerate(('a', 'b', 'c')):
+        _store(cache, key)
+        os.utime(cache.path(key), ns=(10**18 + i, 10**18 + i))
+    sizes = dict((key, os.path.getsize(cache.path(key)))
+                 for key in ('a', 'b', 'c'))
+
+    # Loading 'a' makes it the most recently used, so 'b' goes first
+    assert cache.load('a')['results'] == {'total': 100.0}
+    cache.max_bytes = sizes['a'] + sizes['c']
+    cache.evict()
+    assert sorted(os.listdir(str(tmp_path))) == ['a.npz', 'c.npz']
+    cache.max_bytes = sizes['a']
+    cache.evict()
+    assert os.listdir(str(tmp_path)) == ['a.npz']
+    assert cache.load('b') is None
+
+def test_corrupt_entries(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    _store(cache, 'good')
+    with open(cache.path('good'), 'rb') as f:
+        contents = f.read()
+    for key, damaged in (('empty', b''), ('garbage', b'not a zip file'),
+                         ('truncated', contents[:len(contents)//2]),
+                         ('tail', contents[:-10])):
+        with open(cache.path(key), 'wb') as f:
+            f.write(damaged)
+        assert cache.load(key) is None
+    # An archive without the entry's arrays, or with unreadable results
+    np.savez(cache.path('other'), total=np.zeros(3))
+    assert cache.load('other') is None
+    np.savez(cache.path('json'), results=np.array('{'), fills=np.zeros(0))
+    assert cache.load('json') is None
+    assert cache.load('good') is not None
+
+def test_run_backtest_uses_cache(tmp_path):
+    config = {'result_cache': str(tmp_path)}
+    key = resultcache.result_key(_settings(**config))
+    # A corrupt entry is run again and replaced
+    with open(os.path.join(str(tmp_path), '%s.npz' % key), 'wb') as f:
+        f.write(b'partial')
+    results = backtest.run_backtest(config)
+    entry = resultcache.ResultCache(str(tmp_path)).load(key)
+    assert entry['results'] == results
+    assert len(entry['fills']) == results['fills']
+    assert entry['history']['total'][-1] == results['total']
+    assert backtest.run_backtest(config) == results
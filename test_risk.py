@@ -0,0 +1,193 @@
+#! python3
+# test_risk.py
+
+import numpy as np
+
+import data
+import eventbus
+import portfolio
+import risk
+
+from event import MARKET_EVENT, FillEvent, OrderEvent
+from exposure import ExposureManager
+
+START = 1474290000
+
+class RecordingBroker(object):
+    """
+    Stands in for the execution handler, recording the orders sent to it.
+    """
+
+    def __init__(self):
+        self.orders = []
+
+    def execute_order(self, event):
+        self.orders.append(event)
+
+def _stage(checks_for, closes=(2000.0,), initial_capital=100000):
+    """
+    Returns a PreTradeRiskStage with the checks returned by
+    checks_for(bars, portfolio), its portfolio, data handler and broker,
+    with the first bar released.
+    """
+
+    length = len(closes)
+    close = np.array(closes, dtype=np.float64)
+    columns = data.Bars(START + 60*np.arange(length, dtype=np.int64),
+                        close, close, close, close,
+                        np.ones(length, dtype=np.int64),
+                        np.ones(length, dtype=np.int64), close)
+    events = eventbus.DequeEventBus()
+    bars = data.EMiniArrayHandler(events, columns)
+    futures = portfolio.FuturesPortfolio(bars, events, None, initial_capital,
+                                         symbol_list=['ES'])
+    broker = RecordingBroker()
+    stage = risk.PreTradeRiskStage(bars, broker, checks_for(bars, futures))
+    _next_bar(stage, bars, futures)
+    return stage, futures, bars, broker
+
+def _next_bar(stage, bars, futures):
+    bars.update_bars()
+    futures.update(MARKET_EVENT)
+    stage.update(MARKET_EVENT)
+
+def _fill(stage, futures, quantity, direction, price=2000.0):
+    fill = FillEvent(None, 'ES', 'GLOBEX', quantity, direction,
+                     price*quantity, 0.0)
+    futures.update_fill(fill)
+    stage.update(fill)
+
+def _order(quantity, direction='BUY', order_type='MKT', price=None):
+    return OrderEvent('ES', order_type, quantity, direction, price)
+
+def test_max_order_size():
+    stage, _, _, broker = _stage(
+        lambda bars, futures: [risk.MaxOrderSizeCheck(5)])
+    at_limit = _order(5)
+    stage.execute_order(at_limit)
+    stage.execute_order(_order(6))
+    assert broker.orders == [at_limit]
+    assert stage.accepted == 1
+    assert stage.rejected == {'MaxOrderSizeCheck': 1}
+
+def test_max_order_size_per_symbol():
+    check = risk.MaxOrderSizeCheck({'ES': 2})
+    assert check.check(_order(2), START) is not None
+    assert check.check(_order(3), START) is None
+    assert check.check(OrderEvent('NQ', 'MKT', 3, 'BUY'), START) is not None
+
+def test_max_position_counts_working_orders():
+    stage, futures, _, broker = _stage(
+        lambda bars, futures: [risk.MaxPositionCheck(futures, 3)])
+    stage.execute_order(_order(2))
+    # Two contracts are working, so only one more may be bought
+    stage.execute_order(_order(2))
+    assert [order.quantity for order in broker.orders] == [2, 1]
+    stage.execute_order(_order(1))
+    assert stage.rejected == {'MaxPositionCheck': 1}
+
+    # Filling the working orders leaves the position at the limit
+    _fill(stage, futures, 3, 'BUY')
+    stage.execute_order(_order(1))
+    assert stage.rejected == {'MaxPositionCheck': 2}
+    # Selling may go from the long limit to the short one
+    stage.execute_order(_order(7, 'SELL'))
+    assert broker.orders[-1].quantity == 6
+
+def test_order_rate():
+    stage, _, bars, broker = _stage(
+        lambda bars, futures: [risk.OrderRateCheck(2, period=120)],
+        closes=(2000.0,)*3)
+    stage.execute_order(_order(1))
+    stage.execute_order(_order(1))
+    stage.execute_order(_order(1))
+    assert len(broker.orders) == 2
+    assert stage.rejected == {'OrderRateCheck': 1}
+    # 60 seconds later both orders are still within the period, 120 seconds
+    # later they have left it
+    bars.update_bars()
+    stage.execute_order(_order(1))
+    assert len(broker.orders) == 2
+    bars.update_bars()
+    stage.execute_order(_order(1))
+    assert len(broker.orders) == 3
+
+def test_price_band():
+    stage, _, _, broker = _stage(
+        lambda bars, futures: [risk.PriceBandCheck(bars, band=0.05)])
+    market = _order(1)
+    at_band = _order(1, order_type='LMT', price=1900.0)
+    stage.execute_order(market)
+    stage.execute_order(at_band)
+    stage.execute_order(_order(1, 'SELL', 'STP', 2100.25))
+    assert broker.orders == [market, at_band]
+    assert stage.rejected == {'PriceBandCheck': 1}
+
+def test_daily_loss_kill_switch():
+    # 17:00 CT starts a new session on the fourth bar
+    closes = (2000.0, 1990.0, 1990.0, 1990.0)
+    stage, futures, bars, broker = _stage(
+        lambda bars, futures: [risk.DailyLossCheck(futures, 1000)],
+        closes=closes)
+    bars.columns = bars.columns._replace(
+        datetime=np.array([START, START + 60, START + 120,
+                           START - START % 86400 + 17*3600]))
+    _fill(stage, futures, 2, 'BUY')
+
+    # A loss of 10 points on two contracts is exactly the limit
+    _next_bar(stage, bars, futures)
+    assert futures.value == 99000
+    stage.execute_order(_order(1))
+    assert broker.orders == []
+    # Reducing the position is still allowed, up to its size
+    stage.execute_order(_order(3, 'SELL'))
+    assert broker.orders[-1].quantity == 2
+
+    _next_bar(stage, bars, futures)
+    stage.execute_order(_order(1))
+    assert len(broker.orders) == 1
+    _next_bar(stage, bars, futures)
+    stage.execute_order(_order(1))
+    assert len(broker.orders) == 2
+
+def test_daily_loss_under_limit():
+    stage, futures, bars, broker = _stage(
+        lambda bars, futures: [risk.DailyLossCheck(futures, 1000)],
+        closes=(2000.0, 1990.25))
+    _fill(stage, futures, 2, 'BUY')
+    _next_bar(stage, bars, futures)
+    assert futures.value == 99025
+    order = _order(1)
+    stage.execute_order(order)
+    assert broker.orders == [order]
+
+def test_exposure_check():
+    stage, futures, _, broker = _stage(
+        lambda bars, futures: [risk.ExposureCheck(ExposureManager(
+            futures, target_leverage=1, enforce_margin=False))])
+    at_limit = _order(1)
+    stage.execute_order(at_limit)
+    assert broker.orders == [at_limit]
+    _fill(stage, futures, 1, 'BUY')
+    stage.execute_order(_order(1))
+    assert broker.orders == [at_limit]
+    assert stage.rejected == {'ExposureCheck': 1}
+
+def test_checks_run_in_order():
+    """
+    Each check sees the order as resized by the ones before it, and a
+    rejection stops the order before the later checks record it.
+    """
+
+    stage, futures, _, broker = _stage(
+        lambda bars, futures: [risk.MaxPositionCheck(futures, 2),
+                               risk.MaxOrderSizeCheck(2),
+                               risk.OrderRateCheck(1)])
+    stage.execute_order(_order(3))
+    assert [order.quantity for order in broker.orders] == [2]
+    stage.execute_order(_order(1, 'SELL'))
+    assert stage.rejected == {'MaxPositionCheck': 0,
+                              'MaxOrderSizeCheck': 0,
+                              'OrderRateCheck': 1}
+    # The rejected sell was never counted as working
+    assert stage.checks[0].working == {'ES': 2}
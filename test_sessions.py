@@ -0,0 +1,130 @@
+#! python3
+# test_sessions.py
+
+import calendar
+
+import numpy as np
+
+import data
+import live
+
+from sessions import CME_CALENDAR, in_time_window, time_of_day_mask
+
+def _local(year, month, day, hour=0, minute=0):
+    """
+    Returns naive exchange-local epoch seconds, as in the bar data.
+    """
+
+    return calendar.timegm((year, month, day, hour, minute, 0))
+
+def _minutes(start, end):
+    return np.arange(start, end, 60, dtype=np.int64)
+
+def test_sunday_open_and_friday_close():
+    # Friday 2016-09-16 to Monday 2016-09-19
+    timestamps = _minutes(_local(2016, 9, 16), _local(2016, 9, 19, 18))
+    sessions = CME_CALENDAR.precompute(timestamps)
+    open_ = timestamps[sessions.in_session]
+    weekend = open_[(open_ > _local(2016, 9, 16, 12)) &
+                    (open_ < _local(2016, 9, 19))]
+    # Friday's session ends on its 15:59 bar and Monday's opens on Sunday
+    # at 17:00
+    assert weekend[weekend < _local(2016, 9, 17)][-1] == \
+        _local(2016, 9, 16, 15, 59)
+    assert weekend[weekend > _local(2016, 9, 17)][0] == \
+        _local(2016, 9, 18, 17)
+    sunday_open = CME_CALENDAR.classify(_local(2016, 9, 18, 17))
+    assert sunday_open.in_session and not sunday_open.rth
+    assert sunday_open.session_id == \
+        CME_CALENDAR.classify(_local(2016, 9, 19, 10)).session_id
+    for timestamp in (_local(2016, 9, 16, 17), _local(2016, 9, 17, 12),
+                      _local(2016, 9, 18, 16, 59)):
+        assert not CME_CALENDAR.classify(timestamp).in_session
+
+def test_daily_break_and_halt():
+    monday = CME_CALENDAR.precompute(_minutes(_local(2016, 9, 19),
+                                              _local(2016, 9, 20)))
+    minutes = np.arange(24*60)
+    # Closed 16:00-17:00 for the daily maintenance and halted 15:15-15:30
+    closed = ((minutes >= 16*60) & (minutes < 17*60)) | \
+        ((minutes >= 15*60 + 15) & (minutes < 15*60 + 30))
+    assert np.array_equal(monday.in_session, ~closed)
+    assert np.array_equal(monday.rth, (minutes >= 8*60 + 30) &
+                          (minutes < 15*60 + 15))
+    # Bars from 17:00 belong to the next day's session
+    assert monday.session_id[17*60] == monday.session_id[16*60 - 1] + 1
+
+def test_session_close():
+    assert CME_CALENDAR.session_close(_local(2016, 9, 18, 17)) == \
+        _local(2016, 9, 19, 16)
+    assert CME_CALENDAR.session_close(_local(2016, 9, 19, 15, 59)) == \
+        _local(2016, 9, 19, 16)
+    # Thanksgiving closes at 12:00
+    assert CME_CALENDAR.session_close(_local(2016, 11, 23, 20)) == \
+        _local(2016, 11, 24, 12)
+
+def test_holidays_and_early_closes():
+    # Good Friday 2016 has no session
+    good_friday = CME_CALENDAR.precompute(_minutes(_local(2016, 3, 24, 17),
+                                                   _local(2016, 3, 25, 16)))
+    assert not good_friday.in_session.any()
+    thanksgiving = CME_CALENDAR.precompute(_minutes(_local(2016, 11, 24),
+                                                    _local(2016, 11, 24,
+                                                           16)))
+    minutes = np.arange(16*60)
+    assert np.array_equal(thanksgiving.in_session, minutes < 12*60)
+    assert np.array_equal(thanksgiving.rth, (minutes >= 8*60 + 30) &
+                          (minutes < 12*60))
+
+def test_dst_transitions():
+    """
+    UTC minute bars converted to exchange time open at 17:00 local on
+    either side of a DST change, an hour apart in UTC, and every whole
+    session keeps its 23 hours less the halt.
+    """
+
+    # Clocks go forward on Sunday 2016-03-13 and back on Sunday 2016-11-06
+    for first, last, utc_hours in (((2016, 3, 9), (2016, 3, 16),
+                                    [23, 23, 22, 22, 22]),
+                                   ((2016, 11, 2), (2016, 11, 9),
+                                    [22, 22, 23, 23, 23])):
+        utc = _minutes(calendar.timegm(first + (0, 0, 0)),
+                       calendar.timegm(last + (0, 0, 0)))
+        timestamps = np.array([live.to_exchange_time(int(timestamp))
+                               for timestamp in utc])
+        sessions = CME_CALENDAR.precompute(timestamps)
+
+        opened = np.flatnonzero(sessions.in_session[1:] &
+                                ~sessions.in_session[:-1]) + 1
+        opens = opened[(timestamps[opened] % 86400)//60 == 17*60]
+        # Wednesday, Thursday, Sunday, Monday and Tuesday evenings
+        assert [data.epoch_to_datetime(timestamps[i]).weekday()
+                for i in opens] == [2, 3, 6, 0, 1]
+        assert [(utc[i] % 86400)//3600 for i in opens] == utc_hours
+
+        _, counts = np.unique(sessions.session_id[sessions.in_session],
+                              return_counts=True)
+        assert (counts[1:-1] == 23*60 - 15).all()
+
+def test_time_windows_wrap_midnight():
+    timestamps = _minutes(_local(2016, 9, 19), _local(2016, 9, 20))
+    for start, end in ((16*60 + 30, 9*60 + 29), (9*60, 15*60),
+                       (0, 24*60)):
+        mask = time_of_day_mask(timestamps, start, end)
+        assert mask.tolist() == [in_time_window(int(timestamp), start, end)
+                                 for timestamp in timestamps]
+        minutes = np.arange(24*60)
+        if start <= end:
+            expected = (minutes >= start) & (minutes < end)
+        else:
+            expected = (minutes >= start) | (minutes < end)
+        assert np.array_equal(mask, expected)
+
+def test_classify_matches_precompute():
+    timestamps = _minutes(_local(2016, 11, 20), _local(2016, 11, 28))
+    sessions = CME_CALENDAR.precompute(timestamps)
+    for i in range(0, len(timestamps), 7):
+        single = CME_CALENDAR.classify(int(timestamps[i]))
+        assert single.session_id == sessions.session_id[i]
+        assert single.in_session == sessions.in_session[i]
+        assert single.rth == sessions.rth[i]
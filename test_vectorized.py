@@ -0,0 +1,21 @@
+#! python3
+# test_vectorized.py
+
+import numpy as np
+import pytest
+
+import vectorized
+
+@pytest.mark.parametrize('params', [{},
+                                    {'sma_window': 10, 'ema_span': 5},
+                                    {'sma_window': 50, 'ema_span': 15}])
+def test_matches_event_driven(params):
+    # compare_with_event_driven() asserts the fills, positions, cash and
+    # total agree after every bar
+    result = vectorized.compare_with_event_driven('1weekemini.csv', **params)
+    assert np.count_nonzero(result['trades']) > 0
+
+def test_default_result():
+    result = vectorized.compare_with_event_driven('1weekemini.csv')
+    assert np.count_nonzero(result['trades']) == 261
+    assert result['total'][-1] == pytest.approx(99164.0)
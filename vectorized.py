@@ -0,0 +1,119 @@
+#! python3
+# vectorized.py
+
+import datetime
+import numpy as np
+
+import backtest
+import data
+import eventbus
+import execution
+import portfolio
+import strategy
+
+from contracts import CONTRACT_SPECS
+from event import (EventType, IB_MIN_PER_ORDER,
+                   IB_COMMISSION_PER_SHARE)
+
+def calculate_ib_commission(quantity):
+    """
+    Vectorized form of FillEvent.calculate_ib_commission(), returning the
+    commission for each non-zero quantity in an array and zero elsewhere.
+
+    Parameters:
+    quantity - Array of traded quantities (any sign).
+    """
+
+    quantity = np.abs(quantity)
+    commission = np.maximum(IB_MIN_PER_ORDER,
+                            IB_COMMISSION_PER_SHARE*quantity)
+    return np.where(quantity > 0, commission, 0.0)
+
+def run_vectorized(bars, signal_function, initial_capital, multiplier=1.0,
+                   **params):
+    """
+    Runs a backtest over whole arrays instead of replaying events.
+
+    The signal function maps the bar arrays to the position held after each
+    bar. Position changes are filled at that bar's close with IB commission,
+    as SimulatedExecutionHandler and EMiniPortfolio do in the event-driven
+    loop, and the cash, holdings and total are computed for every bar.
+
+    Parameters:
+    bars - A Bars tuple of column arrays, e.g. EMiniCSVHandler.columns.
+    signal_function - Callable (bars, **params) -> positions array, e.g.
+                      strategy.SMAtoEMA.vectorized_positions.
+    initial_capital - The starting capital in USD.
+    multiplier - Contract multiplier, e.g. CONTRACT_SPECS['ES'].multiplier.
+    params - Strategy parameters passed to the signal function.
+
+    Returns a dictionary of per-bar arrays.
+    """
+
+    positions = np.asarray(signal_function(bars, **params))
+    trades = np.diff(positions, prepend=0)
+    commission = calculate_ib_commission(trades)
+
+    close = bars.close*multiplier
+    cash = initial_capital - np.cumsum(trades*close + commission)
+    holdings = positions*close
+
+    return {'datetime': bars.datetime,
+            'positions': positions,
+            'trades': trades,
+            'commission': commission,
+            'cash': cash,
+            'holdings': holdings,
+            'total': cash + holdings}
+
+def compare_with_event_driven(csv_filename, initial_capital=100000, **params):
+    """
+    Runs SMAtoEMA on csv_filename through both the event-driven loop in
+    backtest.py and run_vectorized(), asserting that they trade on the same
+    bars in the same direction and have the same position, cash and total
+    after every bar.
+
+    Parameters:
+    csv_filename - Path to an e-mini CSV file.
+    initial_capital - The starting capital in USD.
+    params - SMAtoEMA parameters, e.g. sma_window and ema_span.
+    """
+
+    events = eventbus.DequeEventBus()
+    bars = data.EMiniCSVHandler(events, csv_filename)
+    es_portfolio = portfolio.EMiniPortfolio(bars, events,
+                                            datetime.datetime(2016, 1, 1),
+                                            initial_capital)
+    sma_to_ema = strategy.SMAtoEMA(bars, events, **params)
+    broker = execution.SimulatedExecutionHandler(events, bars)
+
+    # Record the bar and signed quantity of every fill
+    fills = []
+    def record_fill(fill):
+        sign = 1 if fill.direction == 'BUY' else -1
+        fills.append((bars.bar_index, sign*fill.quantity))
+    events.register(EventType.FILL, record_fill)
+    backtest.simulate(events, bars, sma_to_ema, es_portfolio, broker)
+
+    result = run_vectorized(bars.columns,
+                            strategy.SMAtoEMA.vectorized_positions,
+                            initial_capital,
+                            CONTRACT_SPECS['ES'].multiplier, **params)
+    traded = np.flatnonzero(result['trades'])
+    vectorized_fills = list(zip(traded.tolist(),
+                                result['trades'][traded].tolist()))
+
+    assert fills == vectorized_fills, \
+        "Fills differ: %s event-driven, %s vectorized" % \
+        (len(fills), len(vectorized_fills))
+    history = es_portfolio.get_history()
+    assert np.array_equal(history['positions'][:, 0], result['positions'])
+    assert np.allclose(history['cash'], result['cash'])
+    assert np.allclose(history['total'], result['total'])
+    return result
+
+if __name__ == "__main__":
+    result = compare_with_event_driven('1weekemini.csv')
+    print("Vectorized and event-driven backtests match: %s trades, "
+          "final total %.2f" % (np.count_nonzero(result['trades']),
+                                result['total'][-1]))
@@ -0,0 +1,255 @@
+#! python3
+# walkforward.py
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import data
+import performance
+import vectorized
+
+from contracts import CONTRACT_SPECS
+from sessions import CME_CALENDAR
+from strategy import SMAtoEMA
+from sweep import SharedBars, attach_columns, expand_grid
+
+class IndicatorCache(object):
+    """
+    Moving averages of the close computed once over the full history and
+    kept by window, so every fold and parameter combination using the same
+    window slices one array instead of recomputing it. Starting from the
+    first bar also means a fold's averages are warmed up exactly as they
+    would be in a single backtest over the whole history.
+    """
+
+    def __init__(self, close):
+        """
+        Parameters:
+        close - Array of closing prices of the full history.
+        """
+
+        self.close = pd.Series(close)
+        self.arrays = {}
+
+    def sma(self, window):
+        key = ('sma', window)
+        if key not in self.arrays:
+            self.arrays[key] = self.close.rolling(window).mean().values
+        return self.arrays[key]
+
+    def ema(self, span):
+        key = ('ema', span)
+        if key not in self.arrays:
+            self.arrays[key] = self.close.ewm(span=span).mean().values
+        return self.arrays[key]
+
+def make_folds(datetime, train_sessions, test_sessions, calendar=CME_CALENDAR):
+    """
+    Splits a bar history into rolling in-sample/out-of-sample windows of
+    whole trading sessions. Each fold's out-of-sample window follows its
+    in-sample window and the next fold starts test_sessions later, so the
+    out-of-sample windows are back to back.
+
+    Parameters:
+    datetime - Array of bar timestamps in epoch seconds.
+    train_sessions - Sessions in each in-sample window.
+    test_sessions - Sessions in each out-of-sample window.
+    calendar - The SessionCalendar mapping bars to sessions.
+
+    Returns a list of (train_start, train_end, test_start, test_end) bar
+    index ranges, end exclusive.
+    """
+
+    session_id = calendar.session_id(np.asarray(datetime))
+    # Index of the first bar of every session, and the end of the last
+    starts = np.flatnonzero(np.diff(session_id, prepend=session_id[:1] - 1))
+    starts = np.append(starts, len(session_id))
+
+    folds = []
+    first = 0
+    while first + train_sessions + test_sessions < len(starts):
+        split = first + train_sessions
+        folds.append((starts[first], starts[split],
+                      starts[split], starts[split + test_sessions]))
+        first += test_sessions
+    return folds
+
+def run_window(columns, indicators, params, start, end, initial_capital,
+               multiplier):
+    """
+    Runs SMAtoEMA with params over bars start to end of the history with the
+    vectorized engine, starting flat and closing any position on the last
+    bar so consecutive windows can be chained.
+
+    Parameters:
+    columns - A Bars tuple of the full history.
+    indicators - The IndicatorCache of the full history.
+    params - Dictionary with sma_window and ema_span.
+    start, end - Bar index range of the window, end exclusive.
+    initial_capital - The capital at the start of the window.
+    multiplier - Contract multiplier.
+
+    Returns the per-bar arrays of vectorized.run_vectorized().
+    """
+
+    sma = indicators.sma(params['sma_window'])[start:end]
+    ema = indicators.ema(params['ema_span'])[start:end]
+    positions = SMAtoEMA.positions_from_averages(columns.datetime[start:end],
+                                                 sma, ema)
+    positions[-1] = 0
+    bars = data.Bars(*[column[start:end] for column in columns])
+    return vectorized.run_vectorized(bars, lambda bars: positions,
+                                     initial_capital, multiplier)
+
+def score(result, objective, initial_capital, periods):
+    """
+    Returns the in-sample score of a window: its final value for 'total',
+    or its Sharpe ratio for 'sharpe', with windows that never trade scoring
+    lowest.
+    """
+
+    if objective == 'total':
+        return result['total'][-1]
+    sharpe = performance.create_sharpe_ratio(
+        performance.create_returns(np.append(initial_capital,
+                                             result['total'])), periods)
+    return sharpe if np.isfinite(sharpe) else -np.inf
+
+# State of a worker process, set by _attach_worker()
+_worker_shm = None
+_worker_state = None
+
+def _attach_worker(spec, folds, settings):
+    """
+    ProcessPoolExecutor initializer mapping the shared bars into the worker
+    and creating its IndicatorCache.
+    """
+
+    global _worker_shm, _worker_state
+    name, length = spec
+    _worker_shm = shared_memory.SharedMemory(name=name)
+    columns = attach_columns(_worker_shm, length)
+    _worker_state = (columns, IndicatorCache(columns.close), folds, settings)
+
+def _score_params(params, columns, indicators, folds, settings):
+    """
+    Returns the in-sample score of params on every fold.
+    """
+
+    initial_capital, multiplier, objective, periods = settings
+    return [score(run_window(columns, indicators, params, train_start,
+                             train_end, initial_capital, multiplier),
+                  objective, initial_capital, periods)
+            for train_start, train_end, _, _ in folds]
+
+def _score_worker(params):
+    return _score_params(params, *_worker_state)
+
+def walk_forward(columns, grid, train_sessions=3, test_sessions=1,
+                 initial_capital=100000, objective='sharpe',
+                 multiplier=CONTRACT_SPECS['ES'].multiplier,
+                 max_workers=None):
+    """
+    Walk-forward optimization of SMAtoEMA: for every fold the parameter
+    grid is run on the in-sample window, the best combination is run on the
+    following out-of-sample window, and the out-of-sample windows are
+    chained into one equity curve, each starting from the value the last
+    one ended with.
+
+    The parameter combinations are spread over a process pool with the bars
+    in shared memory. Each worker scores its combinations on every fold, so
+    the moving averages of a combination are computed once over the full
+    history and sliced per fold, and the overlapping in-sample windows share
+    them.
+
+    Parameters:
+    columns - A Bars tuple of the full history, e.g. load_emini_csv().
+    grid - Dictionary mapping sma_window and ema_span to lists of values.
+    train_sessions - Sessions in each in-sample window.
+    test_sessions - Sessions in each out-of-sample window.
+    initial_capital - The starting capital in USD.
+    objective - 'sharpe' or 'total', the in-sample score maximised.
+    multiplier - Contract multiplier.
+    max_workers - Number of worker processes, default os.cpu_count(). With
+                  one the grid is run in this process.
+
+    Returns a DataFrame with one row per fold and a dictionary of the
+    stitched out-of-sample per-bar arrays and their performance summary.
+    """
+
+    folds = make_folds(columns.datetime, train_sessions, test_sessions)
+    if not folds:
+        raise ValueError("History too short for %d in-sample and %d "
+                         "out-of-sample sessions" %
+                         (train_sessions, test_sessions))
+    combinations = [config['strategy_params']
+                    for config in expand_grid({}, grid)]
+    periods = performance.estimate_periods_per_year(columns.datetime)
+    settings = (initial_capital, multiplier, objective, periods)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    indicators = IndicatorCache(columns.close)
+    if max_workers == 1:
+        scores = [_score_params(params, columns, indicators, folds, settings)
+                  for params in combinations]
+    else:
+        # Keep a worker's combinations together so they share averages
+        chunksize = max(1, len(combinations) // max_workers)
+        shared = SharedBars(columns)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     initializer=_attach_worker,
+                                     initargs=(shared.spec, folds,
+                                               settings)) as pool:
+                scores = list(pool.map(_score_worker, combinations,
+                                       chunksize=chunksize))
+        finally:
+            shared.close()
+    # One row per fold, one column per combination
+    scores = np.array(scores).T
+
+    rows = []
+    segments = []
+    capital = initial_capital
+    for fold, (train_start, train_end, test_start, test_end) in \
+            enumerate(folds):
+        best = int(np.argmax(scores[fold]))
+        params = combinations[best]
+        result = run_window(columns, indicators, params, test_start,
+                            test_end, capital, multiplier)
+        segments.append(result)
+        row = {'train_start': data.epoch_to_datetime(
+                   columns.datetime[train_start]),
+               'test_start': data.epoch_to_datetime(
+                   columns.datetime[test_start]),
+               'test_end': data.epoch_to_datetime(
+                   columns.datetime[test_end - 1]),
+               'in_sample_score': scores[fold, best],
+               'out_of_sample_return': result['total'][-1]/capital - 1.0}
+        row.update(params)
+        rows.append(row)
+        capital = result['total'][-1]
+
+    stitched = dict((key, np.concatenate([segment[key]
+                                          for segment in segments]))
+                    for key in ('datetime', 'positions', 'trades',
+                                'commission', 'cash', 'holdings', 'total'))
+    # Every window ends flat, so the cash carries over between them
+    stitched['summary'] = performance.create_summary(
+        stitched['datetime'], stitched['positions'], stitched['cash'],
+        stitched['commission'], stitched['total'], initial_capital, periods)
+    return pd.DataFrame(rows), stitched
+
+if __name__ == "__main__":
+    columns = data.load_emini_csv('1weekemini.csv')
+    folds, stitched = walk_forward(columns, {'sma_window': [10, 20, 30, 50],
+                                             'ema_span': [5, 9, 15]},
+                                   train_sessions=2, test_sessions=1)
+    print(folds.to_string())
+    print("Out-of-sample: final total %.2f, sharpe %.2f, %d trades" %
+          (stitched['total'][-1], stitched['summary']['sharpe'],
+           np.count_nonzero(stitched['trades'])))